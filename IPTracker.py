@@ -1,37 +1,493 @@
 import sys
-import requests
-import json
+import time
+
+IMPORT_STARTED = time.perf_counter()  # start of the startup profile
+
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QLineEdit, QPushButton, QTextEdit, QComboBox, QSystemTrayIcon,
-    QMenu, QLabel, QTabWidget, QTableWidget, QTableWidgetItem,
-    QHeaderView, QDialog, QFormLayout, QCheckBox, QSpinBox, QProgressBar
+    QMenu, QLabel, QTabWidget, QTableView,
+    QHeaderView, QDialog, QFormLayout, QCheckBox, QSpinBox, QProgressBar,
+    QFileDialog, QDateEdit, QTableWidget, QTableWidgetItem, QAbstractItemView, QSplitter,
+    QListWidget, QListWidgetItem
 )
-from PyQt6.QtGui import QIcon, QFont, QAction, QPalette, QColor
-from PyQt6.QtCore import Qt, QTranslator, QLocale, QSettings, QTimer
-import os
-from datetime import datetime
-import sqlite3
+from PyQt6.QtGui import QIcon, QFont, QAction, QPalette, QColor, QImage, QPainter, QPen
+from PyQt6.QtCore import (
+    Qt, QTranslator, QLocale, QSettings, QTimer, QAbstractTableModel, QModelIndex, QDate,
+    QObject, pyqtSignal
+)
+from datetime import datetime, timedelta
 import logging
 from pathlib import Path
-import re
-import csv
-import qdarkstyle
 import threading
 import queue
+import struct
+import os
+import functools
+import math
+import sqlite3
 
-# Setup logging
-logging.basicConfig(
-    filename='ip_tracker.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
+from iptracker_core import (
+    CACHE_SIZE, CACHE_TTL, COMPACT_AFTER_DAYS, DEFAULT_DB_PATH, DEFAULT_PROVIDERS, DNS_SERVER, PROVIDERS, GRID_COLUMNS, GRID_ROWS, EXPORT_FORMATS, HISTORY_COLUMNS, HISTORY_HEADERS,
+    MAINTENANCE_INTERVAL, MAX_HISTORY_ROWS, METRICS, MIGRATIONS, PRIORITY_INTERACTIVE, PRIORITY_REFRESH, RATE_LIMIT_BATCH,
+    RETENTION_DAYS,
+    BulkLookupJob, DnsResolver, Enricher, HistoryExportJob, HistoryWriter, LogIngestJob, LookupCache, LookupEngine, MetricsServer, ApiServer,
+    OfflineGeoDB, ProviderPool, RateLimiter, WatchlistScheduler, format_enrichment, format_log_report, format_response, format_result, history_filter, history_row, location_changed, location_changes, location_snapshot, maintain_history, migrate_db, network_range, open_history_db, pack_ip, parse_ip_list, stored_response, unpack_response,
+    setup_logging, validate_ip, city_counts, country_counts, grid_counts, heatmap_grid
 )
 
-class SettingsDialog(QDialog):
+# UI text for every supported language, keyed by setting value
+TRANSLATIONS = {
+    "English": {
+        "window_title": "IP Tracker",
+        "lookup_button": "Lookup",
+        "clear_history": "Clear History",
+        "export_history": "Export",
+        "settings": "Settings",
+        "diagnostics": "Diagnostics",
+        "quit": "Quit",
+        "show": "Show",
+        "tab_lookup": "IP Lookup",
+        "tab_history": "History",
+        "tab_bulk": "Bulk Lookup",
+        "tab_watchlist": "Watchlist",
+        "tab_analytics": "Analytics",
+        "watch_add": "Watch",
+        "watch_remove": "Remove Selected",
+        "bulk_load": "Load from File",
+        "bulk_log": "Import Access Log",
+        "bulk_start": "Start Bulk Lookup",
+        "bulk_cancel": "Cancel",
+        "placeholder": "Enter IP address (e.g., 8.8.8.8)",
+        "invalid_ip": "Invalid IP address format",
+        "lookup_success": "Lookup successful",
+        "lookup_failed": "Lookup failed",
+        "network_error": "Network error",
+        "history_cleared": "History cleared",
+        "export_success": "History exported to {}",
+        "export_failed": "Export failed: {}",
+        "minimized_to_tray": "Application minimized to system tray"
+    },
+    "فارسی": {
+        "window_title": "ردیاب آی‌پی",
+        "lookup_button": "جستجو",
+        "clear_history": "پاک کردن تاریخچه",
+        "export_history": "صادر کردن",
+        "settings": "تنظیمات",
+        "diagnostics": "عیب‌یابی",
+        "quit": "خروج",
+        "show": "نمایش",
+        "tab_lookup": "جستجوی آی‌پی",
+        "tab_history": "تاریخچه",
+        "tab_bulk": "جستجوی گروهی",
+        "tab_watchlist": "فهرست پایش",
+        "tab_analytics": "تحلیل",
+        "watch_add": "پایش",
+        "watch_remove": "حذف موارد انتخاب‌شده",
+        "bulk_load": "بارگذاری از فایل",
+        "bulk_log": "وارد کردن لاگ دسترسی",
+        "bulk_start": "شروع جستجوی گروهی",
+        "bulk_cancel": "لغو",
+        "placeholder": "آدرس آی‌پی را وارد کنید (مثال: 8.8.8.8)",
+        "invalid_ip": "فرمت آدرس آی‌پی نامعتبر است",
+        "lookup_success": "جستجو با موفقیت انجام شد",
+        "lookup_failed": "جستجو ناموفق بود",
+        "network_error": "خطای شبکه",
+        "history_cleared": "تاریخچه پاک شد",
+        "export_success": "تاریخچه به {} صادر شد",
+        "export_failed": "خطا در صادرات: {}",
+        "minimized_to_tray": "برنامه به سینی سیستم مینیمایز شد"
+    },
+    "中文": {
+        "window_title": "IP追踪器",
+        "lookup_button": "查询",
+        "clear_history": "清除历史记录",
+        "export_history": "导出",
+        "settings": "设置",
+        "diagnostics": "诊断",
+        "quit": "退出",
+        "show": "显示",
+        "tab_lookup": "IP查询",
+        "tab_history": "历史记录",
+        "tab_bulk": "批量查询",
+        "tab_watchlist": "监视列表",
+        "tab_analytics": "分析",
+        "watch_add": "监视",
+        "watch_remove": "删除所选",
+        "bulk_load": "从文件加载",
+        "bulk_log": "导入访问日志",
+        "bulk_start": "开始批量查询",
+        "bulk_cancel": "取消",
+        "placeholder": "输入IP地址（例如：8.8.8.8）",
+        "invalid_ip": "IP地址格式无效",
+        "lookup_success": "查询成功",
+        "lookup_failed": "查询失败",
+        "network_error": "网络错误",
+        "history_cleared": "历史记录已清除",
+        "export_success": "历史记录导出到 {}",
+        "export_failed": "导出失败：{}",
+        "minimized_to_tray": "应用程序已最小化到系统托盘"
+    }
+}
+
+# Flat themes; "Dark" comes from qdarkstyle and the rest only set a palette
+THEME_STYLESHEETS = {
+    "Red": """
+        QWidget { background-color: #ffe6e6; color: #800000; }
+        QLineEdit, QTextEdit { background-color: #ffffff; border: 1px solid #800000; }
+        QPushButton { background-color: #ff3333; color: white; }
+        QPushButton:hover { background-color: #cc0000; }
+        QTabWidget::pane { border: 1px solid #800000; }
+        QTabBar::tab { background: #ff9999; color: #800000; }
+        QTabBar::tab:selected { background: #ff3333; color: white; }
+    """,
+    "Blue": """
+        QWidget { background-color: #e6f3ff; color: #003366; }
+        QLineEdit, QTextEdit { background-color: #ffffff; border: 1px solid #003366; }
+        QPushButton { background-color: #0066cc; color: white; }
+        QPushButton:hover { background-color: #003366; }
+        QTabWidget::pane { border: 1px solid #003366; }
+        QTabBar::tab { background: #99ccff; color: #003366; }
+        QTabBar::tab:selected { background: #0066cc; color: white; }
+    """,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def theme_stylesheet(theme):
+    """Build a theme's stylesheet once; qdarkstyle is only imported for Dark"""
+    if theme == "Dark":
+        import qdarkstyle
+        return qdarkstyle.load_stylesheet(qt_api='pyqt6')
+    return THEME_STYLESHEETS.get(theme, "")
+
+
+class StartupProfiler:
+    """Opt-in report of where startup time goes
+
+    Enabled with IPTRACKER_PROFILE_STARTUP=1 (or iptracker gui
+    --profile-startup). Phases are marked as startup proceeds; finish()
+    logs them together with the slowest functions from cProfile and prints
+    the report to stderr.
+    """
+
+    def __init__(self, enabled=False, started=None):
+        self.enabled = enabled
+        self.started = started or time.perf_counter()
+        self.last = self.started
+        self.phases = []
+        self.profile = None
+        if enabled:
+            import cProfile
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def mark(self, phase):
+        """Record the time since the previous mark under phase"""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def finish(self):
+        """Stop profiling and report"""
+        if not self.enabled:
+            return
+        self.enabled = False
+        self.profile.disable()
+        lines = ["Startup profile:"]
+        lines += [f"  {phase:<24} {seconds * 1000:8.1f} ms" for phase, seconds in self.phases]
+        lines.append(f"  {'total':<24} {(self.last - self.started) * 1000:8.1f} ms")
+
+        import io
+        import pstats
+        stream = io.StringIO()
+        pstats.Stats(self.profile, stream=stream).sort_stats("cumulative").print_stats(25)
+        report = "\n".join(lines) + "\n\n" + stream.getvalue()
+        logging.info(report)
+        print(report, file=sys.stderr)
+
+
+# Analytics time windows: label -> days back from today (None is all time)
+ANALYTICS_WINDOWS = {
+    "All Time": None,
+    "Today": 1,
+    "Last 7 Days": 7,
+    "Last 30 Days": 30,
+    "Last 365 Days": 365,
+}
+ANALYTICS_TOP = 50  # rows shown in the country and city tables
+SEARCH_DEBOUNCE_MS = 250
+# Heatmap colour stops from quiet to busy cells
+HEATMAP_STOPS = [(0.0, (40, 80, 255)), (0.35, (0, 220, 255)), (0.7, (255, 230, 0)), (1.0, (255, 40, 0))]
+
+
+class HeatmapWidget(QWidget):
+    """World heatmap drawn from the pre-binned stats_grid cells"""
+
     def __init__(self, parent=None):
+        super().__init__(parent)
+        self.image = None
+        self.setMinimumSize(360, 180)
+
+    def set_cells(self, cells):
+        """Rebuild the heatmap image from grid_counts() rows"""
+        try:
+            self.image = self.render_numpy(cells)
+        except ImportError:
+            self.image = self.render_cells(cells)
+        self.update()
+
+    @staticmethod
+    def render_numpy(cells):
+        """Bin, log-scale and colour every cell at once with NumPy"""
+        import numpy as np
+        grid = heatmap_grid(cells)[::-1]  # north at the top
+        peak = grid.max()
+        level = np.log1p(grid) / np.log1p(peak) if peak else grid
+        stops = [stop for stop, _ in HEATMAP_STOPS]
+        rgba = np.empty(grid.shape + (4,), dtype=np.uint8)
+        for channel in range(3):
+            rgba[..., channel] = np.interp(level, stops, [color[channel] for _, color in HEATMAP_STOPS])
+        rgba[..., 3] = np.where(grid > 0, 90 + 165 * level, 0)
+        image = QImage(rgba.tobytes(), GRID_COLUMNS, GRID_ROWS, GRID_COLUMNS * 4, QImage.Format.Format_RGBA8888)
+        return image.copy()
+
+    @staticmethod
+    def render_cells(cells):
+        """Fallback without NumPy: paint the non-empty cells one by one"""
+        image = QImage(GRID_COLUMNS, GRID_ROWS, QImage.Format.Format_ARGB32)
+        image.fill(Qt.GlobalColor.transparent)
+        peak = max((count for _, _, count in cells), default=0)
+        for lat_bin, lon_bin, count in cells:
+            level = math.log1p(count) / math.log1p(peak)
+            for (low, low_color), (high, high_color) in zip(HEATMAP_STOPS, HEATMAP_STOPS[1:]):
+                if level <= high:
+                    mix = (level - low) / (high - low)
+                    rgb = [int(a + (b - a) * mix) for a, b in zip(low_color, high_color)]
+                    break
+            image.setPixelColor(min(lon_bin, GRID_COLUMNS - 1), GRID_ROWS - 1 - min(lat_bin, GRID_ROWS - 1),
+                                QColor(*rgb, int(90 + 165 * level)))
+        return image
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        width = min(self.width(), self.height() * 2)
+        height = width // 2
+        left = (self.width() - width) // 2
+        top = (self.height() - height) // 2
+        painter.fillRect(left, top, width, height, QColor(18, 30, 48))
+
+        # Graticule every 30 degrees
+        painter.setPen(QPen(QColor(60, 80, 110), 1))
+        for degrees in range(30, 360, 30):
+            x = left + width * degrees // 360
+            painter.drawLine(x, top, x, top + height)
+        for degrees in range(30, 180, 30):
+            y = top + height * degrees // 180
+            painter.drawLine(left, y, left + width, y)
+
+        if self.image is not None:
+            painter.drawImage(left, top, self.image.scaled(width, height))
+        painter.end()
+
+
+class LookupSignals(QObject):
+    """Carries LookupEngine results from worker threads to the GUI thread"""
+    finished = pyqtSignal(object)
+
+
+class EnrichSignals(QObject):
+    """Carries Enricher stage results from worker threads to the GUI thread"""
+    finished = pyqtSignal(object)
+
+
+class MaintenanceSignals(QObject):
+    """Carries history maintenance results from the writer thread to the GUI thread"""
+    finished = pyqtSignal(object)
+
+
+class WriterSignals(QObject):
+    """Carries history writes that could not be stored from the writer thread to the GUI thread"""
+    failed = pyqtSignal(object)
+
+
+class MigrationSignals(QObject):
+    """Carries the outcome of schema migrations from the writer thread to the GUI thread"""
+    finished = pyqtSignal(object)
+
+
+class WatchSignals(QObject):
+    """Carries WatchlistScheduler results from worker threads to the GUI thread"""
+    checked = pyqtSignal(object)
+
+
+class HistoryModel(QAbstractTableModel):
+    """History table model that pages rows in from SQLite as the view scrolls
+
+    Pages are keyset-paged: each one starts after the sort value and id of
+    the last row fetched, so scrolling deep costs no more than the first page
+    and rows shown by prepend_row in between do not shift it. Every loaded
+    row carries its id after the COLUMNS values; rows shown by prepend_row
+    carry None and their packed response instead.
+    """
+
+    COLUMNS = HISTORY_COLUMNS
+    HEADERS = HISTORY_HEADERS
+    PAGE_SIZE = 256
+    NOT_NULL = ("ip_address", "timestamp")  # other columns sort NULL as '', which a keyset bound can match
+
+    def __init__(self, conn, parent=None):
+        super().__init__(parent)
+        self.conn = conn
+        self.rows = []
+        self.exhausted = True  # until refresh(), so the view does not page in before migrations finish
+        self.cursor = None  # (sort value, id) of the last row fetched
+        self.sort_column = self.COLUMNS.index("timestamp")
+        self.sort_order = Qt.SortOrder.DescendingOrder
+        self.filters = {}
+        self.network_bounds = None
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if index.isValid() and role == Qt.ItemDataRole.DisplayRole:
+            value = self.rows[index.row()][index.column()]
+            return "" if value is None else str(value)
+        return None
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.HEADERS[section]
+        return super().headerData(section, orientation, role)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        descending = self.sort_order == Qt.SortOrder.DescendingOrder
+        direction, after = ("DESC", "<") if descending else ("ASC", ">")
+        column = self.COLUMNS[self.sort_column]
+        key = column if column in self.NOT_NULL else f"ifnull({column}, '')"
+        order = f"{key} {direction}, id {direction}"
+        if column == "timestamp" and self.filters.get('search'):
+            # Search matches arrive in id order, which is lookup order, so no sort is needed
+            key = "match_id"
+            order = f"match_id {direction}"
+        if self.cursor is None:
+            queries = [(None, order)]
+        elif key == "match_id":
+            queries = [((f"match_id {after} ?", self.cursor[1:]), order)]
+        else:
+            # Rows tied with the last one, then the rest; each is a single index range
+            queries = [((f"{key} = ? AND id {after} ?", self.cursor), f"id {direction}"),
+                       ((f"{key} {after} ?", self.cursor[:1]), order)]
+        page = []
+        for bound, page_order in queries:
+            source, params = self.filter_clause(bound)
+            page += self.conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)}, id, {key}{source} ORDER BY {page_order} LIMIT ?",
+                (*params, self.PAGE_SIZE - len(page))
+            ).fetchall()
+            if len(page) == self.PAGE_SIZE:
+                break
+        self.exhausted = len(page) < self.PAGE_SIZE
+        if page:
+            self.cursor = (page[-1][-1], page[-1][-2])
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+            self.rows.extend(row[:-1] for row in page)
+            self.endInsertRows()
+
+    def filter_clause(self, bound=None):
+        """Return the FROM and WHERE clauses and parameters for the active filters and a page bound"""
+        return history_filter(**self.filters, bound=bound)
+
+    def set_filters(self, search=None, country=None, date_from=None, network=None):
+        """Combine a text search, country, start date and CIDR block; None clears a filter
+
+        Raises ValueError for an invalid network.
+        """
+        self.network_bounds = network_range(network) if network else None
+        self.filters = {key: value for key, value in
+                        dict(search=search, country=country, date_from=date_from, network=network).items() if value}
+        self.refresh()
+
+    def accepts(self, row):
+        """Whether a newly stored row passes the active filters"""
+        if self.filters.get('search'):
+            return False  # text matching follows FTS rules; the row shows up on the next refresh
+        if self.filters.get('country', row[1]) != row[1]:
+            return False
+        if row[-1] < self.filters.get('date_from', ""):
+            return False
+        if self.network_bounds is not None:
+            low, high = self.network_bounds
+            return low <= pack_ip(row[0]) <= high
+        return True
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        if (column, order) == (self.sort_column, self.sort_order) and (self.rows or self.exhausted):
+            return  # already loaded in this order, as when the view turns sorting on
+        self.sort_column = column
+        self.sort_order = order
+        self.refresh()
+
+    def refresh(self):
+        """Drop loaded rows and fetch the first page again"""
+        self.beginResetModel()
+        self.rows = []
+        self.exhausted = False
+        self.cursor = None
+        self.endResetModel()
+        self.fetchMore()
+
+    def clear(self):
+        """Drop every row without querying the database"""
+        self.beginResetModel()
+        self.rows = []
+        self.exhausted = True
+        self.cursor = None
+        self.endResetModel()
+
+    def prepend_row(self, row):
+        """Show a newly stored row without reloading the whole table"""
+        row, response = tuple(row[:len(self.COLUMNS)]), row[len(self.COLUMNS)]
+        if not self.accepts(row):
+            return
+        if (self.sort_column != self.COLUMNS.index("timestamp")
+                or self.sort_order != Qt.SortOrder.DescendingOrder):
+            self.refresh()
+            return
+        self.beginInsertRows(QModelIndex(), 0, 0)
+        self.rows.insert(0, (*row, None, response))  # the writer has not assigned an id yet
+        self.endInsertRows()
+
+    def response(self, row):
+        """Decoded response stored with a loaded row, or None if it has none
+
+        Raises sqlite3.Error or ValueError if it cannot be read.
+        """
+        row_id = row[len(self.COLUMNS)]
+        if row_id is None:
+            return unpack_response(row[-1])  # shown by prepend_row, perhaps not stored yet
+        return stored_response(self.conn, row_id)
+
+
+class SettingsDialog(QDialog):
+    PROVIDER_COLUMNS = ["Provider", "State", "Requests", "Errors", "p50 (ms)", "p95 (ms)", "Hedged", "Wins"]
+
+    def __init__(self, parent=None, providers=None):
         super().__init__(parent)
         self.setWindowTitle("Settings")
-        self.setMinimumWidth(400)
+        self.setMinimumWidth(560)
+        self.providers = providers
         layout = QFormLayout()
 
         # Theme selection
@@ -53,6 +509,89 @@ class SettingsDialog(QDialog):
         layout.addRow("Auto-refresh:", self.auto_refresh)
         layout.addRow("Refresh Interval:", self.refresh_interval)
 
+        # Lookup cache settings
+        self.cache_size = QSpinBox()
+        self.cache_size.setRange(0, 100000)
+        self.cache_size.setValue(CACHE_SIZE)
+        self.cache_size.setSuffix(" entries")
+        self.cache_ttl = QSpinBox()
+        self.cache_ttl.setRange(0, 720)
+        self.cache_ttl.setValue(CACHE_TTL)
+        self.cache_ttl.setSuffix(" hours")
+        layout.addRow("Cache Size:", self.cache_size)
+        layout.addRow("Cache TTL:", self.cache_ttl)
+
+        # History maintenance: old rows are rolled up, then deleted
+        self.compact_after = QSpinBox()
+        self.compact_after.setRange(0, 3650)
+        self.compact_after.setSpecialValueText("Never")
+        self.compact_after.setSuffix(" days")
+        self.retention_days = QSpinBox()
+        self.retention_days.setRange(0, 36500)
+        self.retention_days.setSpecialValueText("Forever")
+        self.retention_days.setSuffix(" days")
+        self.max_history_rows = QSpinBox()
+        self.max_history_rows.setRange(0, 100_000_000)
+        self.max_history_rows.setSingleStep(100_000)
+        self.max_history_rows.setSpecialValueText("Unlimited")
+        self.max_history_rows.setSuffix(" rows")
+        rollup_note = ("Compacted lookups leave the History tab, search and export; "
+                       "list them with 'iptracker history --compacted'")
+        self.compact_after.setToolTip(rollup_note)
+        self.max_history_rows.setToolTip(rollup_note)
+        layout.addRow("Compact History After:", self.compact_after)
+        layout.addRow("Keep History For:", self.retention_days)
+        layout.addRow("Max History Rows:", self.max_history_rows)
+
+        # Lookup source
+        self.lookup_source = QComboBox()
+        self.lookup_source.addItems(["Online", "Offline Database"])
+        self.lookup_source.setToolTip("The offline database covers IPv4 addresses only")
+        layout.addRow("Lookup Source:", self.lookup_source)
+
+        # Reverse DNS and ASN enrichment
+        self.enrich = QCheckBox("Reverse DNS and ASN lookups")
+        self.dns_server = QLineEdit()
+        self.dns_server.setPlaceholderText("System default (host or host:port)")
+        layout.addRow("Enrichment:", self.enrich)
+        layout.addRow("DNS Server:", self.dns_server)
+
+        # Prometheus endpoint on localhost
+        self.metrics_port = QSpinBox()
+        self.metrics_port.setRange(0, 65535)
+        self.metrics_port.setSpecialValueText("Off")
+        layout.addRow("Metrics Port:", self.metrics_port)
+
+        # Lookup API for local scripts, sharing the running engine
+        self.api_port = QSpinBox()
+        self.api_port.setRange(0, 65535)
+        self.api_port.setSpecialValueText("Off")
+        layout.addRow("API Port:", self.api_port)
+
+        # Geolocation providers: checked ones are used top to bottom, drag to reorder
+        self.provider_list = QListWidget()
+        self.provider_list.setDragDropMode(QAbstractItemView.DragDropMode.InternalMove)
+        self.provider_list.setMaximumHeight(90)
+        layout.addRow("Providers:", self.provider_list)
+
+        self.provider_table = QTableWidget(0, len(self.PROVIDER_COLUMNS))
+        self.provider_table.setHorizontalHeaderLabels(self.PROVIDER_COLUMNS)
+        self.provider_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.provider_table.verticalHeader().setVisible(False)
+        self.provider_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
+        self.provider_table.setMaximumHeight(120)
+        layout.addRow(self.provider_table)
+        if providers is not None:
+            for stats in providers.stats():
+                item = QListWidgetItem(stats['name'])
+                item.setFlags(item.flags() | Qt.ItemFlag.ItemIsUserCheckable)
+                item.setCheckState(Qt.CheckState.Checked if stats['enabled'] else Qt.CheckState.Unchecked)
+                self.provider_list.addItem(item)
+            self.provider_timer = QTimer(self)
+            self.provider_timer.timeout.connect(self.refresh_provider_stats)
+            self.provider_timer.start(1000)
+            self.refresh_provider_stats()
+
         # Buttons
         button_layout = QHBoxLayout()
         save_button = QPushButton("Save")
@@ -65,41 +604,339 @@ class SettingsDialog(QDialog):
         layout.addRow(button_layout)
         self.setLayout(layout)
 
+    def enabled_providers(self):
+        """Checked provider names in their listed order"""
+        items = [self.provider_list.item(row) for row in range(self.provider_list.count())]
+        return [item.text() for item in items if item.checkState() == Qt.CheckState.Checked]
+
+    def refresh_provider_stats(self):
+        """Show each provider's circuit state, latency and error counts"""
+        rows = self.providers.stats()
+        self.provider_table.setRowCount(len(rows))
+        for row, stats in enumerate(rows):
+            state = stats['state'] if stats['enabled'] else "disabled"
+            values = [stats['name'], state, str(stats['requests']), str(stats['errors'])] + [
+                "" if stats[key] is None else f"{stats[key] * 1000:.0f}" for key in ('p50', 'p95')
+            ] + [str(stats['hedged']), str(stats['wins'])]
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                if column == 3 and stats['last_error']:
+                    item.setToolTip(stats['last_error'])
+                self.provider_table.setItem(row, column, item)
+
+class DiagnosticsDialog(QDialog):
+    """Live per-stage lookup timings from METRICS"""
+
+    COLUMNS = ["Stage", "Count", "Mean (ms)", "p50 (ms)", "p95 (ms)", "p99 (ms)"]
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Diagnostics")
+        self.setMinimumSize(560, 320)
+        layout = QVBoxLayout(self)
+
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        layout.addWidget(self.table)
+
+        button_layout = QHBoxLayout()
+        reset_button = QPushButton("Reset")
+        close_button = QPushButton("Close")
+        reset_button.clicked.connect(self.reset)
+        close_button.clicked.connect(self.accept)
+        button_layout.addWidget(reset_button)
+        button_layout.addWidget(close_button)
+        layout.addLayout(button_layout)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(1000)
+        self.refresh()
+
+    def refresh(self):
+        """Reload the stage table from the shared histograms"""
+        rows = METRICS.summary()
+        self.table.setRowCount(len(rows))
+        for row, stage in enumerate(rows):
+            values = [stage['stage'], str(stage['count'])] + [
+                "" if stage[key] is None else f"{stage[key] * 1000:.2f}"
+                for key in ('mean', 'p50', 'p95', 'p99')
+            ]
+            for column, value in enumerate(values):
+                self.table.setItem(row, column, QTableWidgetItem(value))
+
+    def reset(self):
+        METRICS.reset()
+        self.refresh()
+
+
+class ExportDialog(QDialog):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Export History")
+        self.setMinimumWidth(450)
+        layout = QFormLayout()
+
+        # Output format and path
+        self.format_combo = QComboBox()
+        self.format_combo.addItems(list(EXPORT_FORMATS))
+        self.format_combo.currentTextChanged.connect(self.update_extension)
+        layout.addRow("Format:", self.format_combo)
+
+        path_layout = QHBoxLayout()
+        self.path_input = QLineEdit(str(Path.home() / "ip_history.csv"))
+        browse_button = QPushButton("Browse")
+        browse_button.clicked.connect(self.browse)
+        path_layout.addWidget(self.path_input)
+        path_layout.addWidget(browse_button)
+        layout.addRow("File:", path_layout)
+
+        # Optional filters
+        self.use_date_range = QCheckBox("Only export a date range")
+        self.date_from = QDateEdit(QDate.currentDate().addMonths(-1))
+        self.date_from.setCalendarPopup(True)
+        self.date_to = QDateEdit(QDate.currentDate())
+        self.date_to.setCalendarPopup(True)
+        layout.addRow("Date Range:", self.use_date_range)
+        layout.addRow("From:", self.date_from)
+        layout.addRow("To:", self.date_to)
+
+        self.country_input = QLineEdit()
+        self.country_input.setPlaceholderText("All countries")
+        layout.addRow("Country:", self.country_input)
+
+        # Buttons
+        button_layout = QHBoxLayout()
+        export_button = QPushButton("Export")
+        cancel_button = QPushButton("Cancel")
+        export_button.clicked.connect(self.accept)
+        cancel_button.clicked.connect(self.reject)
+        button_layout.addWidget(export_button)
+        button_layout.addWidget(cancel_button)
+
+        layout.addRow(button_layout)
+        self.setLayout(layout)
+
+    def update_extension(self, export_format):
+        """Keep the file extension in line with the selected format"""
+        path = self.path_input.text()
+        for extension in sorted(EXPORT_FORMATS.values(), key=len, reverse=True):
+            if path.endswith(extension):
+                path = path[:-len(extension)]
+                break
+        self.path_input.setText(path + EXPORT_FORMATS[export_format])
+
+    def browse(self):
+        """Pick the export file"""
+        path, _ = QFileDialog.getSaveFileName(self, "Export History", self.path_input.text())
+        if path:
+            self.path_input.setText(path)
+
+    def filters(self):
+        """Return (date_from, date_to, country) for HistoryExportJob"""
+        date_from = date_to = None
+        if self.use_date_range.isChecked():
+            date_from = self.date_from.date().toString("yyyy-MM-dd")
+            date_to = self.date_to.date().addDays(1).toString("yyyy-MM-dd")
+        return date_from, date_to, self.country_input.text().strip() or None
+
 class IPTracker(QMainWindow):
-    def __init__(self):
+    def __init__(self, profiler=None):
         super().__init__()
+        self.profiler = profiler or StartupProfiler()
         self.settings = QSettings("Hamid Yarali", "IPTracker")
         self.translator = QTranslator()
         self.current_language = self.settings.value("language", "English")
         self.current_theme = self.settings.value("theme", "Windows 11 Default")
-        self.history = []
-        self.lookup_queue = queue.Queue()
+        self.bulk_job = None
+        self.export_job = None
         self.init_db()
+        self.profiler.mark("init_db")
         self.init_ui()
+        self.profiler.mark("init_ui")
         self.load_language(self.current_language)
+        self.profiler.mark("load_language")
         self.apply_theme(self.current_theme)
+        self.profiler.mark("apply_theme")
         self.setup_auto_refresh()
+        # Fill history and start the watchlist once the window has been painted
+        QTimer.singleShot(0, self.finish_startup)
+
+    def finish_startup(self):
+        """Deferred startup work that does not need to block the first paint"""
+        self.profiler.mark("first_paint")
+        # Migrations can rebuild indexes over every row, so they run on the writer thread
+        # and history, analytics and the watchlist wait for them
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] < len(MIGRATIONS):
+            self.statusBar().showMessage("Upgrading history...")
+            for widget in (self.history_widget, self.analytics_widget):
+                self.tabs.setTabEnabled(self.tabs.indexOf(widget), False)
+        self.migration_signals = MigrationSignals()
+        self.migration_signals.finished.connect(self.finish_history_startup)
+        self.writer.submit(migrate_db).add_done_callback(self.migration_signals.finished.emit)
+
+    def finish_history_startup(self, future):
+        """Load history and start the watchlist once the schema is up to date"""
+        try:
+            future.result()
+        except Exception as e:
+            logging.error(f"History upgrade failed: {str(e)}")
+            self.statusBar().showMessage(f"History upgrade failed: {str(e)}")
+            return
+        for widget in (self.history_widget, self.analytics_widget):
+            self.tabs.setTabEnabled(self.tabs.indexOf(widget), True)
+        if self.statusBar().currentMessage() == "Upgrading history...":
+            self.statusBar().clearMessage()
+        self.profiler.mark("migrate_db")
+        # Scripts and other tools can share this engine, cache and quota over a local API
+        self.configure_api_server(self.settings.value("api_port", 0, type=int))
+        self.load_history()
+        self.history_table.setSortingEnabled(True)
+        self.load_countries()
+        self.profiler.mark("load_history")
+        self.watchlist.load()
+        self.watchlist.start()
+        self.load_watchlist()
+        self.profiler.mark("load_watchlist")
+        # First maintenance run once startup traffic has settled, then periodically
+        QTimer.singleShot(60 * 1000, self.maintain_history)
+        self.maintenance_timer.start(MAINTENANCE_INTERVAL * 1000)
+        self.profiler.finish()
 
     def init_db(self):
         """Initialize SQLite database for storing IP lookup history"""
-        home_dir = Path.home()
-        db_path = home_dir / ".ip_tracker" / "history.db"
-        db_path.parent.mkdir(exist_ok=True)
+        db_path = DEFAULT_DB_PATH
+        self.db_path = db_path
         
-        self.conn = sqlite3.connect(db_path)
+        self.conn = open_history_db(db_path, migrate=False)  # migrated on the writer thread by finish_startup
         self.cursor = self.conn.cursor()
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                ip_address TEXT,
-                country TEXT,
-                city TEXT,
-                latitude REAL,
-                longitude REAL,
-                timestamp TEXT
-            )
-        ''')
-        self.conn.commit()
+
+        # All history writes go through the writer thread, which reports the ones it cannot store
+        self.writer_signals = WriterSignals()
+        self.writer_signals.failed.connect(self.show_write_failure)
+        self.writer = HistoryWriter(db_path, on_error=self.writer_signals.failed.emit)
+        self.writer.start()
+        # The API server feeds the writer, so it has to stop first
+        self.api_server = None
+        QApplication.instance().aboutToQuit.connect(lambda: self.configure_api_server(0))
+        QApplication.instance().aboutToQuit.connect(self.writer.stop)
+
+        # Compaction, retention and vacuum run on the writer thread, between inserts
+        self.maintenance_signals = MaintenanceSignals()
+        self.maintenance_signals.finished.connect(self.show_maintenance_result)
+        self.maintenance_running = False
+        self.maintenance_requested = False
+        self.maintenance_timer = QTimer(self)
+        self.maintenance_timer.timeout.connect(self.maintain_history)
+
+        self.cache = LookupCache(
+            db_path,
+            max_entries=self.settings.value("cache_size", CACHE_SIZE, type=int),
+            ttl=self.settings.value("cache_ttl", CACHE_TTL, type=int) * 3600
+        )
+
+        # Single lookups run on a shared worker pool and report back through a signal
+        provider_names = self.settings.value("providers", ",".join(DEFAULT_PROVIDERS)).split(",")
+        self.lookup_engine = LookupEngine(cache=self.cache, providers=ProviderPool.from_names(
+            [name for name in provider_names if name in PROVIDERS] or DEFAULT_PROVIDERS))
+        self.lookup_signals = LookupSignals()
+        self.lookup_signals.finished.connect(self.check_lookup_result)
+        self.pending_lookups = set()
+        self.refresh_requests = set()
+        self.last_snapshot = None
+        self.batch_rate_limiter = RateLimiter(RATE_LIMIT_BATCH)
+        QApplication.instance().aboutToQuit.connect(self.lookup_engine.shutdown)
+
+        # Reverse DNS and ASN run next to geolocation and stream into the result pane
+        try:
+            resolver = DnsResolver(self.settings.value("dns_server", "") or DNS_SERVER)
+        except ValueError as e:
+            logging.error(f"Ignoring DNS server setting: {str(e)}")
+            resolver = DnsResolver()
+        self.enricher = Enricher(resolver, db_path)
+        self.enrich_signals = EnrichSignals()
+        self.enrich_signals.finished.connect(self.show_enrich_result)
+        self.lookup_view = None
+        QApplication.instance().aboutToQuit.connect(self.enricher.shutdown)
+
+        # Watched IPs are re-checked in the background and stored only when they change
+        self.watch_signals = WatchSignals()
+        self.watch_signals.checked.connect(self.check_watch_result)
+        self.watchlist = WatchlistScheduler(self.lookup_engine, self.writer, db_path,
+                                            on_result=self.watch_signals.checked.emit)
+        QApplication.instance().aboutToQuit.connect(self.watchlist.stop)
+
+        METRICS.register_gauge("queue_depth", self.lookup_engine.queue_depth, "IPs waiting for the rate limiter")
+        METRICS.register_gauge("lookups_in_flight", self.lookup_engine.in_flight, "Requests not yet completed")
+        METRICS.register_gauge("cache_hits", lambda: self.cache.hits, "Lookup cache hits since start")
+        METRICS.register_gauge("cache_misses", lambda: self.cache.misses, "Lookup cache misses since start")
+        self.metrics_server = None
+        self.configure_metrics_server(self.settings.value("metrics_port", 0, type=int))
+        QApplication.instance().aboutToQuit.connect(lambda: self.configure_metrics_server(0))
+
+        self.offline_db_path = db_path.parent / "ranges.bin"
+        self.offline_db = None
+        if self.settings.value("lookup_source", "Online") == "Offline Database":
+            self.open_offline_db()
+
+    def open_offline_db(self):
+        """Open the offline range database if it has been imported"""
+        self.close_offline_db()
+        if self.offline_db_path.exists():
+            try:
+                self.offline_db = OfflineGeoDB(self.offline_db_path)
+            except (OSError, ValueError, struct.error) as e:
+                logging.error(f"Failed to open offline database: {str(e)}")
+        self.lookup_engine.set_offline_db(self.offline_db)
+
+    def configure_metrics_server(self, port):
+        """Serve Prometheus metrics on localhost at port, or stop serving when port is 0"""
+        if self.metrics_server is not None:
+            if self.metrics_server.server_address[1] == port:
+                return
+            self.metrics_server.stop()
+            self.metrics_server = None
+        if port:
+            try:
+                self.metrics_server = MetricsServer(port)
+            except OSError as e:
+                logging.error(f"Failed to start metrics endpoint on port {port}: {str(e)}")
+                self.statusBar().showMessage(f"Metrics endpoint unavailable: {str(e)}")
+                return
+            self.metrics_server.start()
+            logging.info(f"Serving metrics at http://127.0.0.1:{port}/metrics")
+
+    def configure_api_server(self, port):
+        """Serve the lookup API on localhost at port, or stop serving when port is 0"""
+        if self.api_server is not None:
+            if self.api_server.server_address[1] == port:
+                return
+            self.api_server.stop()
+            self.api_server = None
+        if port:
+            try:
+                self.api_server = ApiServer(port, self.lookup_engine, self.db_path, self.writer,
+                                            batch_rate_limiter=self.batch_rate_limiter)
+            except OSError as e:
+                logging.error(f"Failed to start API server on port {port}: {str(e)}")
+                self.statusBar().showMessage(f"API server unavailable: {str(e)}")
+                return
+            self.api_server.start()
+            logging.info(f"Serving the lookup API at {self.api_server.url}")
+
+    def close_offline_db(self):
+        """Stop answering lookups from the offline range database
+
+        A bulk or log job still holding the database answers its remaining
+        IPs with a failure once it is closed.
+        """
+        self.lookup_engine.set_offline_db(None)
+        if self.offline_db is not None:
+            self.offline_db.close()
+            self.offline_db = None
 
     def init_ui(self):
         """Initialize the user interface"""
@@ -125,11 +962,15 @@ class IPTracker(QMainWindow):
         self.ip_input = QLineEdit()
         self.ip_input.setPlaceholderText("Enter IP address (e.g., 8.8.8.8)")
         self.lookup_button = QPushButton("Lookup")
-        self.lookup_button.clicked.connect(self.start_lookup_thread)
-        self.ip_input.returnPressed.connect(self.start_lookup_thread)
+        self.lookup_button.clicked.connect(self.start_lookup)
+        self.ip_input.returnPressed.connect(self.start_lookup)
+        self.cancel_lookup_button = QPushButton("Cancel")
+        self.cancel_lookup_button.setVisible(False)
+        self.cancel_lookup_button.clicked.connect(self.cancel_lookups)
         input_layout.addWidget(QLabel("IP Address:"))
         input_layout.addWidget(self.ip_input)
         input_layout.addWidget(self.lookup_button)
+        input_layout.addWidget(self.cancel_lookup_button)
         lookup_layout.addLayout(input_layout)
 
         # Progress bar
@@ -142,59 +983,214 @@ class IPTracker(QMainWindow):
         self.result_display.setReadOnly(True)
         lookup_layout.addWidget(self.result_display)
 
-        # History Tab
-        history_widget = QWidget()
-        history_layout = QVBoxLayout(history_widget)
-        self.history_table = QTableWidget()
-        self.history_table.setColumnCount(6)
-        self.history_table.setHorizontalHeaderLabels([
-            "IP Address", "Country", "City", "Latitude", "Longitude", "Timestamp"
+        # Bulk Lookup Tab
+        bulk_widget = QWidget()
+        bulk_layout = QVBoxLayout(bulk_widget)
+        self.bulk_input = QTextEdit()
+        self.bulk_input.setPlaceholderText("Paste IP addresses (one per line, or separated by spaces or commas)")
+        bulk_layout.addWidget(self.bulk_input)
+
+        bulk_controls = QHBoxLayout()
+        self.bulk_load_button = QPushButton("Load from File")
+        self.bulk_load_button.clicked.connect(self.load_bulk_file)
+        self.bulk_log_button = QPushButton("Import Access Log")
+        self.bulk_log_button.clicked.connect(self.start_log_ingest)
+        self.bulk_start_button = QPushButton("Start Bulk Lookup")
+        self.bulk_start_button.clicked.connect(self.start_bulk_lookup)
+        self.bulk_cancel_button = QPushButton("Cancel")
+        self.bulk_cancel_button.setEnabled(False)
+        self.bulk_cancel_button.clicked.connect(self.cancel_bulk_lookup)
+        bulk_controls.addWidget(self.bulk_load_button)
+        bulk_controls.addWidget(self.bulk_log_button)
+        bulk_controls.addWidget(self.bulk_start_button)
+        bulk_controls.addWidget(self.bulk_cancel_button)
+        bulk_layout.addLayout(bulk_controls)
+
+        self.bulk_progress = QProgressBar()
+        self.bulk_progress.setVisible(False)
+        bulk_layout.addWidget(self.bulk_progress)
+
+        self.bulk_results = QTextEdit()
+        self.bulk_results.setReadOnly(True)
+        bulk_layout.addWidget(self.bulk_results)
+
+        # Watchlist Tab
+        watch_widget = QWidget()
+        watch_layout = QVBoxLayout(watch_widget)
+        watch_controls = QHBoxLayout()
+        self.watch_input = QLineEdit()
+        self.watch_input.setPlaceholderText("IP addresses to watch (separated by spaces or commas)")
+        self.watch_interval = QSpinBox()
+        self.watch_interval.setRange(1, 1440)
+        self.watch_interval.setValue(15)
+        self.watch_interval.setSuffix(" minutes")
+        self.watch_add_button = QPushButton("Watch")
+        self.watch_add_button.clicked.connect(self.add_to_watchlist)
+        self.watch_input.returnPressed.connect(self.add_to_watchlist)
+        watch_controls.addWidget(self.watch_input)
+        watch_controls.addWidget(self.watch_interval)
+        watch_controls.addWidget(self.watch_add_button)
+        watch_layout.addLayout(watch_controls)
+
+        self.watch_table = QTableWidget()
+        self.watch_table.setColumnCount(6)
+        self.watch_table.setHorizontalHeaderLabels([
+            "IP Address", "Interval", "Last Checked", "Location", "ISP", "Organization"
         ])
+        self.watch_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.watch_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.watch_table.horizontalHeader().setStretchLastSection(True)
+        watch_layout.addWidget(self.watch_table)
+
+        self.watch_remove_button = QPushButton("Remove Selected")
+        self.watch_remove_button.clicked.connect(self.remove_from_watchlist)
+        watch_layout.addWidget(self.watch_remove_button)
+
+        # Analytics Tab
+        self.analytics_widget = QWidget()
+        analytics_layout = QVBoxLayout(self.analytics_widget)
+        analytics_controls = QHBoxLayout()
+        self.analytics_window = QComboBox()
+        self.analytics_window.addItems(list(ANALYTICS_WINDOWS))
+        self.analytics_window.currentTextChanged.connect(self.load_analytics)
+        self.analytics_refresh_button = QPushButton("Refresh")
+        self.analytics_refresh_button.clicked.connect(self.load_analytics)
+        self.analytics_summary = QLabel()
+        analytics_controls.addWidget(self.analytics_window)
+        analytics_controls.addWidget(self.analytics_refresh_button)
+        analytics_controls.addWidget(self.analytics_summary, 1)
+        analytics_layout.addLayout(analytics_controls)
+
+        analytics_splitter = QSplitter(Qt.Orientation.Horizontal)
+        self.heatmap = HeatmapWidget()
+        analytics_splitter.addWidget(self.heatmap)
+        tables = QSplitter(Qt.Orientation.Vertical)
+        self.country_table = QTableWidget(0, 2)
+        self.country_table.setHorizontalHeaderLabels(["Country", "Lookups"])
+        self.city_table = QTableWidget(0, 3)
+        self.city_table.setHorizontalHeaderLabels(["City", "Country", "Lookups"])
+        for table in (self.country_table, self.city_table):
+            table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+            table.verticalHeader().setVisible(False)
+            table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+            tables.addWidget(table)
+        analytics_splitter.addWidget(tables)
+        analytics_splitter.setStretchFactor(0, 3)
+        analytics_splitter.setStretchFactor(1, 1)
+        analytics_layout.addWidget(analytics_splitter)
+
+        # History Tab
+        self.history_widget = QWidget()
+        history_layout = QVBoxLayout(self.history_widget)
+        filter_layout = QHBoxLayout()
+        self.history_search = QLineEdit()
+        self.history_search.setPlaceholderText("Search IP, country, city, ISP or organization")
+        self.history_search.setClearButtonEnabled(True)
+        # Searching waits for a pause in typing instead of querying on every keystroke
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(self.apply_history_filters)
+        self.history_search.textChanged.connect(self.search_timer.start)
+        self.history_search.returnPressed.connect(self.apply_history_filters)
+        self.country_filter = QComboBox()
+        self.country_filter.setEditable(True)
+        self.country_filter.setMinimumWidth(140)
+        self.country_filter.lineEdit().setPlaceholderText("All countries")
+        self.country_filter.currentTextChanged.connect(self.search_timer.start)
+        self.date_filter = QComboBox()
+        self.date_filter.addItems(list(ANALYTICS_WINDOWS))
+        self.date_filter.currentTextChanged.connect(self.apply_history_filters)
+        self.network_filter = QLineEdit()
+        self.network_filter.setPlaceholderText("IP or CIDR block (e.g., 203.0.113.0/24)")
+        self.network_filter.returnPressed.connect(self.apply_history_filters)
+        filter_button = QPushButton("Filter")
+        filter_button.clicked.connect(self.apply_history_filters)
+        filter_layout.addWidget(self.history_search, 2)
+        filter_layout.addWidget(self.country_filter)
+        filter_layout.addWidget(self.date_filter)
+        filter_layout.addWidget(self.network_filter, 1)
+        filter_layout.addWidget(filter_button)
+        history_layout.addLayout(filter_layout)
+        self.history_model = HistoryModel(self.conn, self)
+        self.history_table = QTableView()
+        self.history_table.setModel(self.history_model)
+        # finish_startup turns sorting on, since that sorts and would query before the first paint
+        self.history_table.horizontalHeader().setSortIndicator(
+            HISTORY_COLUMNS.index("timestamp"), Qt.SortOrder.DescendingOrder)
+        self.history_table.horizontalHeader().setSortIndicatorShown(True)
         self.history_table.horizontalHeader().setStretchLastSection(True)
-        for i in range(5):
+        for i in range(len(HISTORY_COLUMNS) - 1):
             self.history_table.horizontalHeader().setSectionResizeMode(i, QHeaderView.ResizeMode.Interactive)
+        self.history_table.doubleClicked.connect(self.show_history_details)
         history_layout.addWidget(self.history_table)
 
         # History controls
         history_controls = QHBoxLayout()
         clear_history = QPushButton("Clear History")
         clear_history.clicked.connect(self.clear_history)
-        export_history = QPushButton("Export to CSV")
-        export_history.clicked.connect(self.export_history)
+        self.export_button = QPushButton("Export")
+        self.export_button.clicked.connect(self.export_history)
+        self.export_progress = QProgressBar()
+        self.export_progress.setVisible(False)
+        self.export_cancel_button = QPushButton("Cancel Export")
+        self.export_cancel_button.setVisible(False)
+        self.export_cancel_button.clicked.connect(self.cancel_export)
         history_controls.addWidget(clear_history)
-        history_controls.addWidget(export_history)
+        history_controls.addWidget(self.export_button)
+        history_controls.addWidget(self.export_progress)
+        history_controls.addWidget(self.export_cancel_button)
         history_layout.addLayout(history_controls)
 
         # Add tabs
         self.tabs.addTab(lookup_widget, "IP Lookup")
-        self.tabs.addTab(history_widget, "History")
+        self.tabs.addTab(self.history_widget, "History")
+        self.tabs.addTab(bulk_widget, "Bulk Lookup")
+        self.tabs.addTab(watch_widget, "Watchlist")
+        self.tabs.addTab(self.analytics_widget, "Analytics")
+        self.tabs.currentChanged.connect(self.on_tab_changed)
 
         # System tray
         self.tray_icon = QSystemTrayIcon(self)
         self.tray_icon.setIcon(QIcon("IPTracker.jpg"))  # Set tray icon
         tray_menu = QMenu()
-        show_action = QAction("Show", self)
-        quit_action = QAction("Quit", self)
-        show_action.triggered.connect(self.show)
-        quit_action.triggered.connect(QApplication.quit)
-        tray_menu.addAction(show_action)
-        tray_menu.addAction(quit_action)
+        self.show_action = QAction("Show", self)
+        self.quit_action = QAction("Quit", self)
+        self.show_action.triggered.connect(self.show)
+        self.quit_action.triggered.connect(QApplication.quit)
+        tray_menu.addAction(self.show_action)
+        tray_menu.addAction(self.quit_action)
         self.tray_icon.setContextMenu(tray_menu)
         self.tray_icon.show()
 
         # Menu bar
         menubar = self.menuBar()
         file_menu = menubar.addMenu("File")
-        settings_action = QAction("Settings", self)
-        settings_action.triggered.connect(self.show_settings)
-        file_menu.addAction(settings_action)
-        file_menu.addAction(quit_action)
+        self.settings_action = QAction("Settings", self)
+        self.settings_action.triggered.connect(self.show_settings)
+        file_menu.addAction(self.settings_action)
+        self.diagnostics_action = QAction("Diagnostics", self)
+        self.diagnostics_action.triggered.connect(self.show_diagnostics)
+        file_menu.addAction(self.diagnostics_action)
+        self.compact_action = QAction("Compact History", self)
+        # Asked for explicitly, so an older database may be rewritten to give space back
+        self.compact_action.triggered.connect(lambda: self.maintain_history(convert=True))
+        file_menu.addAction(self.compact_action)
+        import_offline_action = QAction("Import Offline Database", self)
+        import_offline_action.triggered.connect(self.import_offline_db)
+        file_menu.addAction(import_offline_action)
+        file_menu.addAction(self.quit_action)
 
         # Status bar
         self.statusBar().showMessage("Ready")
-
-        # Load history
-        self.load_history()
+        self.scheduler_label = QLabel()
+        self.statusBar().addPermanentWidget(self.scheduler_label)
+        self.cache_label = QLabel()
+        self.statusBar().addPermanentWidget(self.cache_label)
+        self.update_cache_stats()
+        self.scheduler_timer = QTimer(self)
+        self.scheduler_timer.timeout.connect(self.update_scheduler_stats)
+        self.scheduler_timer.start(1000)
 
     def load_language(self, language):
         """Load translation files"""
@@ -213,121 +1209,43 @@ class IPTracker(QMainWindow):
 
     def update_ui_texts(self):
         """Update UI texts based on current language"""
-        language = self.current_language
-        translations = {
-            "English": {
-                "window_title": "IP Tracker",
-                "lookup_button": "Lookup",
-                "clear_history": "Clear History",
-                "export_history": "Export to CSV",
-                "settings": "Settings",
-                "quit": "Quit",
-                "show": "Show",
-                "tab_lookup": "IP Lookup",
-                "tab_history": "History",
-                "placeholder": "Enter IP address (e.g., 8.8.8.8)",
-                "invalid_ip": "Invalid IP address format",
-                "lookup_success": "Lookup successful",
-                "lookup_failed": "Lookup failed",
-                "network_error": "Network error",
-                "history_cleared": "History cleared",
-                "export_success": "History exported to {}",
-                "export_failed": "Export failed: {}"
-            },
-            "فارسی": {
-                "window_title": "ردیاب آی‌پی",
-                "lookup_button": "جستجو",
-                "clear_history": "پاک کردن تاریخچه",
-                "export_history": "صادر کردن به CSV",
-                "settings": "تنظیمات",
-                "quit": "خروج",
-                "show": "نمایش",
-                "tab_lookup": "جستجوی آی‌پی",
-                "tab_history": "تاریخچه",
-                "placeholder": "آدرس آی‌پی را وارد کنید (مثال: 8.8.8.8)",
-                "invalid_ip": "فرمت آدرس آی‌پی نامعتبر است",
-                "lookup_success": "جستجو با موفقیت انجام شد",
-                "lookup_failed": "جستجو ناموفق بود",
-                "network_error": "خطای شبکه",
-                "history_cleared": "تاریخچه پاک شد",
-                "export_success": "تاریخچه به {} صادر شد",
-                "export_failed": "خطا در صادرات: {}"
-            },
-            "中文": {
-                "window_title": "IP追踪器",
-                "lookup_button": "查询",
-                "clear_history": "清除历史记录",
-                "export_history": "导出到CSV",
-                "settings": "设置",
-                "quit": "退出",
-                "show": "显示",
-                "tab_lookup": "IP查询",
-                "tab_history": "历史记录",
-                "placeholder": "输入IP地址（例如：8.8.8.8）",
-                "invalid_ip": "IP地址格式无效",
-                "lookup_success": "查询成功",
-                "lookup_failed": "查询失败",
-                "network_error": "网络错误",
-                "history_cleared": "历史记录已清除",
-                "export_success": "历史记录导出到 {}",
-                "export_failed": "导出失败：{}"
-            }
-        }
-
-        self.setWindowTitle(translations[language]["window_title"])
-        self.lookup_button.setText(translations[language]["lookup_button"])
-        self.ip_input.setPlaceholderText(translations[language]["placeholder"])
-        self.tabs.setTabText(0, translations[language]["tab_lookup"])
-        self.tabs.setTabText(1, translations[language]["tab_history"])
+        self.setWindowTitle(self.translate("window_title"))
+        self.lookup_button.setText(self.translate("lookup_button"))
+        self.ip_input.setPlaceholderText(self.translate("placeholder"))
+        self.tabs.setTabText(0, self.translate("tab_lookup"))
+        self.tabs.setTabText(1, self.translate("tab_history"))
+        self.tabs.setTabText(2, self.translate("tab_bulk"))
+        self.tabs.setTabText(3, self.translate("tab_watchlist"))
+        self.tabs.setTabText(4, self.translate("tab_analytics"))
+        self.watch_add_button.setText(self.translate("watch_add"))
+        self.watch_remove_button.setText(self.translate("watch_remove"))
+        self.bulk_load_button.setText(self.translate("bulk_load"))
+        self.bulk_log_button.setText(self.translate("bulk_log"))
+        self.bulk_start_button.setText(self.translate("bulk_start"))
+        self.bulk_cancel_button.setText(self.translate("bulk_cancel"))
+        self.cancel_lookup_button.setText(self.translate("bulk_cancel"))
         
-        # Update menu actions
-        for action in self.menuBar().actions()[0].menu().actions():
-            if action.text() in ["Settings", "تنظیمات", "设置"]:
-                action.setText(translations[language]["settings"])
-            elif action.text() in ["Quit", "خروج", "退出"]:
-                action.setText(translations[language]["quit"])
-
-        # Update tray menu
-        for action in self.tray_icon.contextMenu().actions():
-            if action.text() in ["Show", "نمایش", "显示"]:
-                action.setText(translations[language]["show"])
-            elif action.text() in ["Quit", "خروج", "退出"]:
-                action.setText(translations[language]["quit"])
+        self.settings_action.setText(self.translate("settings"))
+        self.diagnostics_action.setText(self.translate("diagnostics"))
+        self.quit_action.setText(self.translate("quit"))
+        self.show_action.setText(self.translate("show"))
+
+    def translate(self, key, *args):
+        """Catalog text for key in the current language, formatted with args"""
+        text = TRANSLATIONS.get(self.current_language, TRANSLATIONS["English"])[key]
+        return text.format(*args) if args else text
 
     def apply_theme(self, theme):
         """Apply selected theme"""
         app = QApplication.instance()
-        
-        if theme == "Dark":
-            app.setStyleSheet(qdarkstyle.load_stylesheet(qt_api='pyqt6'))
-        elif theme == "Light":
-            app.setStyleSheet("")
+        app.setStyleSheet(theme_stylesheet(theme))
+
+        if theme == "Light":
             palette = QPalette()
             palette.setColor(QPalette.ColorRole.Window, QColor(255, 255, 255))
             palette.setColor(QPalette.ColorRole.WindowText, QColor(0, 0, 0))
             app.setPalette(palette)
-        elif theme == "Red":
-            app.setStyleSheet("""
-                QWidget { background-color: #ffe6e6; color: #800000; }
-                QLineEdit, QTextEdit { background-color: #ffffff; border: 1px solid #800000; }
-                QPushButton { background-color: #ff3333; color: white; }
-                QPushButton:hover { background-color: #cc0000; }
-                QTabWidget::pane { border: 1px solid #800000; }
-                QTabBar::tab { background: #ff9999; color: #800000; }
-                QTabBar::tab:selected { background: #ff3333; color: white; }
-            """)
-        elif theme == "Blue":
-            app.setStyleSheet("""
-                QWidget { background-color: #e6f3ff; color: #003366; }
-                QLineEdit, QTextEdit { background-color: #ffffff; border: 1px solid #003366; }
-                QPushButton { background-color: #0066cc; color: white; }
-                QPushButton:hover { background-color: #003366; }
-                QTabWidget::pane { border: 1px solid #003366; }
-                QTabBar::tab { background: #99ccff; color: #003366; }
-                QTabBar::tab:selected { background: #0066cc; color: white; }
-            """)
-        else:  # Windows 11 Default
-            app.setStyleSheet("")
+        elif theme not in ("Dark", "Red", "Blue"):  # Windows 11 Default
             app.setStyle("Fusion")
             palette = QPalette()
             palette.setColor(QPalette.ColorRole.Window, QColor(243, 243, 243))
@@ -338,198 +1256,660 @@ class IPTracker(QMainWindow):
     def setup_auto_refresh(self):
         """Setup auto-refresh timer"""
         self.refresh_timer = QTimer()
+        self.refresh_timer.timeout.connect(self.refresh_lookup)
         if self.settings.value("auto_refresh", False, type=bool):
             interval = self.settings.value("refresh_interval", 5, type=int) * 60 * 1000
-            self.refresh_timer.timeout.connect(self.start_lookup_thread)
             self.refresh_timer.start(interval)
 
-    def start_lookup_thread(self):
-        """Start IP lookup in a separate thread"""
+    def start_lookup(self):
+        """Look up the entered IP ahead of background work"""
+        self.submit_lookup(PRIORITY_INTERACTIVE)
+
+    def refresh_lookup(self):
+        """Auto-refresh tick; yields to interactive lookups"""
+        request_id = self.submit_lookup(PRIORITY_REFRESH)
+        if request_id is not None:
+            self.refresh_requests.add(request_id)
+
+    def submit_lookup(self, priority):
+        """Queue a lookup of the entered IP on the lookup engine"""
         ip_address = self.ip_input.text().strip()
         if not ip_address:
-            return
+            return None
 
-        self.lookup_button.setEnabled(False)
+        request_id = self.lookup_engine.submit(ip_address, self.lookup_signals.finished.emit, priority)
+        self.pending_lookups.add(request_id)
+        if (validate_ip(ip_address) and self.offline_db is None
+                and self.settings.value("enrich", False, type=bool)):
+            # An auto-refresh of the shown IP keeps its results until the new ones arrive
+            if self.lookup_view is None or self.lookup_view['ip_address'] != ip_address:
+                self.lookup_view = {'ip_address': ip_address, 'geo': None, 'enrichment': {}}
+                self.render_lookup_view()
+            self.enricher.enrich(ip_address, self.enrich_signals.finished.emit)
+        else:
+            self.lookup_view = None
+        self.update_scheduler_stats()
         self.progress_bar.setVisible(True)
         self.progress_bar.setRange(0, 0)
+        self.cancel_lookup_button.setVisible(True)
         self.statusBar().showMessage("Looking up IP...")
+        return request_id
+
+    def cancel_lookups(self):
+        """Cancel every lookup that has not completed yet"""
+        for request_id in list(self.pending_lookups):
+            self.lookup_engine.cancel(request_id)
+
+    def check_lookup_result(self, result):
+        """Show a finished lookup, timing the UI update"""
+        with METRICS.timer("ui_update"):
+            self.show_lookup_result(result)
+
+    def show_lookup_result(self, result):
+        """Show a finished lookup and record it in history"""
+        self.pending_lookups.discard(result.request_id)
+        is_refresh = result.request_id in self.refresh_requests
+        self.refresh_requests.discard(result.request_id)
+        if not self.pending_lookups:
+            self.progress_bar.setVisible(False)
+            self.cancel_lookup_button.setVisible(False)
+        self.update_cache_stats()
+        ip_address = result.ip_address
 
-        thread = threading.Thread(target=self.perform_lookup, args=(ip_address,))
-        thread.daemon = True
-        thread.start()
+        if result.status == "cancelled":
+            self.statusBar().showMessage("Lookup cancelled")
+            return
 
-        # Check thread result periodically
-        self.check_thread_timer = QTimer()
-        self.check_thread_timer.timeout.connect(self.check_lookup_result)
-        self.check_thread_timer.start(100)
+        data = result.data
+        if result.status == "success":
+            self.show_geo_text(ip_address, format_result(ip_address, data))
+            self.statusBar().showMessage(self.translate("lookup_success"))
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            latitude, longitude = data.get('lat'), data.get('lon')
+            # Auto-refresh only records a row when something actually changed
+            snapshot = location_snapshot(data)
+            previous = self.last_snapshot
+            unchanged = (is_refresh and previous is not None and previous[0] == ip_address
+                         and not location_changed(previous[1], snapshot))
+            self.last_snapshot = (ip_address, snapshot)
+            if latitude is not None and longitude is not None and not unchanged:
+                row = history_row(ip_address, data, timestamp)
+                self.writer.write([row])
+                self.update_history_table(row)
+            logging.info(f"Successful lookup for IP: {ip_address}", extra={'ip_address': ip_address})
+        elif result.status == "invalid":
+            self.show_geo_text(ip_address, result.error)
+            self.statusBar().showMessage(self.translate("invalid_ip"))
+            logging.error(f"Invalid IP address entered: {ip_address}")
+        elif result.status == "failed":
+            self.show_geo_text(ip_address, "Unable to retrieve location information")
+            self.statusBar().showMessage(self.translate("lookup_failed"))
+            logging.error(f"Failed lookup for IP: {ip_address}")
+        else:
+            self.show_geo_text(ip_address, result.error)
+            self.statusBar().showMessage(self.translate("network_error"))
+            logging.error(f"Network error during lookup for IP: {ip_address} - {result.error}")
 
-    def perform_lookup(self, ip_address):
-        """Perform IP lookup and put result in queue"""
-        if not self.validate_ip(ip_address):
-            self.lookup_queue.put(("error", "Invalid IP address format", ip_address))
+    def show_geo_text(self, ip_address, text):
+        """Show the geolocation part of the result pane, keeping enrichment below it"""
+        view = self.lookup_view
+        if view is None or view['ip_address'] != ip_address:
+            self.result_display.setText(text)
             return
+        view['geo'] = text
+        self.render_lookup_view()
+
+    def show_enrich_result(self, result):
+        """Add a finished enrichment stage to the result pane"""
+        view = self.lookup_view
+        if view is None or view['ip_address'] != result.ip_address:
+            return  # a stage of an earlier lookup
+        view['enrichment'][result.stage] = result
+        self.render_lookup_view()
 
+    def render_lookup_view(self):
+        """Redraw the result pane from whatever stages have finished"""
+        view = self.lookup_view
+        geo = view['geo'] or f"IP: {view['ip_address']}\nLocating..."
+        self.result_display.setText(geo + "\n\n" + format_enrichment(view['enrichment']))
+
+    def show_history_details(self, index):
+        """Show everything stored for a double-clicked history row on the lookup tab"""
+        row = self.history_model.rows[index.row()]
+        ip_address, timestamp = row[0], row[HISTORY_COLUMNS.index("timestamp")]
         try:
-            url = f'http://ip-api.com/json/{ip_address}'
-            response = requests.get(url, timeout=5)
-            response.raise_for_status()
-            data = response.json()
-
-            if data['status'] == 'success':
-                result = (
-                    f"IP: {ip_address}\n"
-                    f"Country: {data['country']}\n"
-                    f"City: {data['city']}\n"
-                    f"Latitude: {data['lat']}\n"
-                    f"Longitude: {data['lon']}\n"
-                    f"ISP: {data.get('isp', 'N/A')}\n"
-                    f"Organization: {data.get('org', 'N/A')}\n"
-                    f"Timezone: {data.get('timezone', 'N/A')}"
-                )
-                self.lookup_queue.put(("success", result, ip_address, data.get('lat'), data.get('lon'), data.get('country'), data.get('city')))
-            else:
-                self.lookup_queue.put(("error", "Unable to retrieve location information", ip_address))
-        except requests.RequestException as e:
-            self.lookup_queue.put(("error", f"Error: {str(e)}", ip_address))
+            data = self.history_model.response(row)
+        except (sqlite3.Error, ValueError) as e:
+            logging.error(f"Failed to read stored response for {ip_address}: {str(e)}")
+            data = None
+        if data is None:
+            # Older rows only have the history columns
+            data = dict(zip(("country", "city", "lat", "lon", "isp", "org"), row[1:7]))
+        self.lookup_view = None  # keep a pending lookup's enrichment out of the pane
+        self.ip_input.setText(ip_address)
+        self.result_display.setText(format_response(ip_address, data, timestamp))
+        self.tabs.setCurrentIndex(0)
+
+    def on_tab_changed(self, index):
+        """Refresh analytics whenever its tab is opened"""
+        if self.tabs.widget(index) is self.analytics_widget:
+            self.load_analytics()
+
+    def load_analytics(self):
+        """Fill the Analytics tab from the pre-aggregated stats tables"""
+        days = ANALYTICS_WINDOWS[self.analytics_window.currentText()]
+        date_from = None
+        if days is not None:
+            date_from = (datetime.now() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
 
-    def check_lookup_result(self):
-        """Check lookup thread result"""
+        countries = country_counts(self.conn, date_from)
+        cities = city_counts(self.conn, date_from, limit=ANALYTICS_TOP)
+        self.heatmap.set_cells(grid_counts(self.conn, date_from))
+
+        total = sum(count for _, count in countries)
+        self.analytics_summary.setText(f"{total} lookups from {len(countries)} countries")
+        self.country_table.setRowCount(min(len(countries), ANALYTICS_TOP))
+        for row, (country, count) in enumerate(countries[:ANALYTICS_TOP]):
+            self.country_table.setItem(row, 0, QTableWidgetItem(country or "Unknown"))
+            self.country_table.setItem(row, 1, QTableWidgetItem(str(count)))
+        self.city_table.setRowCount(len(cities))
+        for row, (country, city, count) in enumerate(cities):
+            self.city_table.setItem(row, 0, QTableWidgetItem(city or "Unknown"))
+            self.city_table.setItem(row, 1, QTableWidgetItem(country or "Unknown"))
+            self.city_table.setItem(row, 2, QTableWidgetItem(str(count)))
+
+    def load_watchlist(self):
+        """Fill the Watchlist tab from the scheduler"""
+        self.watch_table.setRowCount(0)
+        for ip_address, entry in sorted(self.watchlist.snapshot().items()):
+            self.update_watch_row(ip_address, entry['interval'], entry['last_checked'], entry['last_result'])
+
+    def update_watch_row(self, ip_address, interval=None, last_checked=None, snapshot=None):
+        """Insert or update the Watchlist tab row for an IP"""
+        matches = self.watch_table.findItems(ip_address, Qt.MatchFlag.MatchExactly)
+        matches = [item for item in matches if item.column() == 0]
+        if matches:
+            row = matches[0].row()
+        else:
+            row = self.watch_table.rowCount()
+            self.watch_table.insertRow(row)
+            self.watch_table.setItem(row, 0, QTableWidgetItem(ip_address))
+        if interval is not None:
+            self.watch_table.setItem(row, 1, QTableWidgetItem(f"{interval // 60} min"))
+        if last_checked is not None:
+            checked = datetime.fromtimestamp(last_checked).strftime("%Y-%m-%d %H:%M:%S")
+            self.watch_table.setItem(row, 2, QTableWidgetItem(checked))
+        if snapshot is not None:
+            self.watch_table.setItem(row, 3, QTableWidgetItem(f"{snapshot.get('city')}, {snapshot.get('country')}"))
+            self.watch_table.setItem(row, 4, QTableWidgetItem(str(snapshot.get('isp'))))
+            self.watch_table.setItem(row, 5, QTableWidgetItem(str(snapshot.get('org'))))
+
+    def add_to_watchlist(self):
+        """Watch the entered IPs at the selected interval"""
+        ip_addresses, skipped = parse_ip_list(self.watch_input.text())
+        interval = self.watch_interval.value() * 60
+        for ip_address in ip_addresses:
+            self.watchlist.add(ip_address, interval)
+            self.update_watch_row(ip_address, interval)
+        self.watch_input.clear()
+        if skipped:
+            self.statusBar().showMessage(f"Skipped {skipped} invalid entries")
+        logging.info(f"Added {len(ip_addresses)} IPs to the watchlist")
+
+    def remove_from_watchlist(self):
+        """Stop watching the selected IPs"""
+        rows = sorted({index.row() for index in self.watch_table.selectedIndexes()}, reverse=True)
+        for row in rows:
+            ip_address = self.watch_table.item(row, 0).text()
+            self.watchlist.remove(ip_address)
+            self.watch_table.removeRow(row)
+            logging.info(f"Removed {ip_address} from the watchlist")
+
+    def check_watch_result(self, result):
+        """Show a finished watchlist check and notify when the IP changed"""
+        if result.status != "success":
+            logging.error(f"Watchlist check failed for IP: {result.ip_address} - {result.error}")
+            return
+        self.update_watch_row(result.ip_address, last_checked=time.time(), snapshot=result.snapshot)
+        if result.stored_row is not None:
+            self.update_history_table(result.stored_row)
+        if result.changed:
+            previous, current = result.previous, result.snapshot
+            changes = [
+                f"{field}: {previous.get(field)} → {current.get(field)}"
+                for field in location_changes(previous, current)
+            ]
+            self.tray_icon.showMessage(
+                "IP Tracker",
+                f"{result.ip_address} changed\n" + "\n".join(changes),
+                QSystemTrayIcon.MessageIcon.Information,
+                5000
+            )
+            logging.info(f"Watched IP changed: {result.ip_address} ({'; '.join(changes)})")
+
+    def load_bulk_file(self):
+        """Load IP addresses for a bulk lookup from a text file"""
+        path, _ = QFileDialog.getOpenFileName(self, "Load IP List", str(Path.home()),
+                                              "Text files (*.txt *.csv *.log);;All files (*)")
+        if not path:
+            return
         try:
-            result = self.lookup_queue.get_nowait()
-            status, message, ip_address = result[:3]
-            extra = result[3:] if len(result) > 3 else [None] * 4
+            with open(path, encoding='utf-8', errors='replace') as f:
+                self.bulk_input.setPlainText(f.read())
+        except OSError as e:
+            self.statusBar().showMessage(f"Error: {str(e)}")
+            logging.error(f"Failed to load IP list {path}: {str(e)}")
 
-            self.lookup_button.setEnabled(True)
-            self.progress_bar.setVisible(False)
-            self.check_thread_timer.stop()
-
-            translations = {
-                "English": {
-                    "invalid_ip": "Invalid IP address format",
-                    "lookup_success": "Lookup successful",
-                    "lookup_failed": "Lookup failed",
-                    "network_error": "Network error"
-                },
-                "فارسی": {
-                    "invalid_ip": "فرمت آدرس آی‌پی نامعتبر است",
-                    "lookup_success": "جستجو با موفقیت انجام شد",
-                    "lookup_failed": "جستجو ناموفق بود",
-                    "network_error": "خطای شبکه"
-                },
-                "中文": {
-                    "invalid_ip": "IP地址格式无效",
-                    "lookup_success": "查询成功",
-                    "lookup_failed": "查询失败",
-                    "network_error": "网络错误"
-                }
-            }
-
-            self.result_display.setText(message)
-            if status == "success":
-                self.statusBar().showMessage(translations[self.current_language]["lookup_success"])
-                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                latitude, longitude, country, city = extra
-                if latitude is not None and longitude is not None:
-                    self.cursor.execute('''
-                        INSERT INTO history (ip_address, country, city, latitude, longitude, timestamp)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (ip_address, country, city, latitude, longitude, timestamp))
-                    self.conn.commit()
-                    
-                    self.history.append({
-                        'ip': ip_address,
-                        'country': country,
-                        'city': city,
-                        'latitude': latitude,
-                        'longitude': longitude,
-                        'timestamp': timestamp
-                    })
-                    self.update_history_table()
-                logging.info(f"Successful lookup for IP: {ip_address}")
-            elif message == "Invalid IP address format":
-                self.statusBar().showMessage(translations[self.current_language]["invalid_ip"])
-                logging.error(f"Invalid IP address entered: {ip_address}")
-            elif message == "Unable to retrieve location information":
-                self.statusBar().showMessage(translations[self.current_language]["lookup_failed"])
-                logging.error(f"Failed lookup for IP: {ip_address}")
+    def start_bulk_lookup(self):
+        """Start a bulk lookup over the pasted or loaded IP list"""
+        if self.bulk_job is not None:
+            return
+
+        ip_addresses, skipped = parse_ip_list(self.bulk_input.toPlainText())
+        if not ip_addresses:
+            return
+
+        self.bulk_results.clear()
+        if skipped:
+            self.bulk_results.append(f"Skipped {skipped} invalid entries")
+        self.bulk_start_button.setEnabled(False)
+        self.bulk_log_button.setEnabled(False)
+        self.bulk_cancel_button.setEnabled(True)
+        self.bulk_progress.setRange(0, len(ip_addresses))
+        self.bulk_progress.setValue(0)
+        self.bulk_progress.setVisible(True)
+        self.statusBar().showMessage(f"Bulk lookup: 0/{len(ip_addresses)}")
+        logging.info(f"Bulk lookup started for {len(ip_addresses)} IPs")
+
+        self.bulk_job = BulkLookupJob(ip_addresses, self.writer, cache=self.cache,
+                                      offline_db=self.offline_db,
+                                      session=self.lookup_engine.session,
+                                      rate_limiter=self.batch_rate_limiter)
+        self.bulk_job.start()
+
+        self.bulk_timer = QTimer()
+        self.bulk_timer.timeout.connect(self.check_bulk_progress)
+        self.bulk_timer.start(100)
+
+    def cancel_bulk_lookup(self):
+        """Cancel the running bulk lookup"""
+        if self.bulk_job is not None:
+            self.bulk_job.cancel()
+            self.bulk_cancel_button.setEnabled(False)
+
+    def check_bulk_progress(self):
+        """Drain progress reported by the bulk lookup job"""
+        while True:
+            try:
+                kind, payload = self.bulk_job.progress_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if kind == "chunk":
+                for ip_address, status, message, data in payload:
+                    self.bulk_results.append(f"{ip_address}: {message}")
+                self.bulk_progress.setValue(self.bulk_progress.value() + len(payload))
+                self.update_cache_stats()
+                self.statusBar().showMessage(
+                    f"Bulk lookup: {self.bulk_progress.value()}/{self.bulk_progress.maximum()}")
             else:
-                self.statusBar().showMessage(translations[self.current_language]["network_error"])
-                logging.error(f"Network error during lookup for IP: {ip_address} - {message}")
-                
-        except queue.Empty:
-            pass
+                self.bulk_timer.stop()
+                self.bulk_job = None
+                self.bulk_start_button.setEnabled(True)
+                self.bulk_log_button.setEnabled(True)
+                self.bulk_cancel_button.setEnabled(False)
+                self.bulk_progress.setVisible(False)
+                self.statusBar().showMessage("Bulk lookup cancelled" if payload else "Bulk lookup finished")
+                logging.info("Bulk lookup cancelled" if payload else "Bulk lookup finished")
+                self.update_history_table()
+                break
+
+    def start_log_ingest(self):
+        """Count and geolocate the client IPs of an access log in the background"""
+        if self.bulk_job is not None:
+            return
+        path, _ = QFileDialog.getOpenFileName(self, "Import Access Log", str(Path.home()),
+                                              "Access logs (*.log *.gz *.txt);;All files (*)")
+        if not path:
+            return
+
+        self.bulk_results.clear()
+        self.bulk_start_button.setEnabled(False)
+        self.bulk_log_button.setEnabled(False)
+        self.bulk_cancel_button.setEnabled(True)
+        self.bulk_progress.setRange(0, 0)
+        self.bulk_progress.setVisible(True)
+        self.statusBar().showMessage(f"Reading {Path(path).name}")
+        logging.info(f"Access log import started for {path}")
+
+        # The job takes the bulk lookup's slot, so Cancel and the progress bar work for both
+        self.bulk_job = LogIngestJob(path, self.writer, cache=self.cache, offline_db=self.offline_db,
+                                     session=self.lookup_engine.session, rate_limiter=self.batch_rate_limiter)
+        self.bulk_job.start()
+
+        self.bulk_timer = QTimer()
+        self.bulk_timer.timeout.connect(self.check_log_progress)
+        self.bulk_timer.start(100)
+
+    def check_log_progress(self):
+        """Drain progress reported by the access log job"""
+        while True:
+            try:
+                kind, *payload = self.bulk_job.progress_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if kind == "progress":
+                bytes_read, total, lines = payload
+                # Progress bars hold an int, so large files are shown in KiB
+                self.bulk_progress.setRange(0, max(total // 1024, 1))
+                self.bulk_progress.setValue(bytes_read // 1024)
+                self.statusBar().showMessage(f"Reading access log: {lines} lines")
+            elif kind == "lookup":
+                done, total = payload
+                self.bulk_progress.setRange(0, total)
+                self.bulk_progress.setValue(done)
+                self.update_cache_stats()
+                self.statusBar().showMessage(f"Locating IPs: {done}/{total}")
+            else:
+                self.bulk_timer.stop()
+                self.bulk_job = None
+                self.bulk_start_button.setEnabled(True)
+                self.bulk_log_button.setEnabled(True)
+                self.bulk_cancel_button.setEnabled(False)
+                self.bulk_progress.setVisible(False)
+                if kind == "done":
+                    report = payload[0]
+                    self.bulk_results.setPlainText(format_log_report(report))
+                    message = f"Access log imported: {report['lines']} lines, {report['unique_ips']} unique IPs"
+                elif kind == "error":
+                    message = f"Access log import failed: {payload[0]}"
+                else:
+                    message = "Access log import cancelled"
+                self.statusBar().showMessage(message)
+                logging.info(message)
+                self.update_history_table()
+                break
 
     def validate_ip(self, ip_address):
         """Validate IP address format"""
-        ip_pattern = r'^(?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)$'
-        return bool(re.match(ip_pattern, ip_address))
+        return validate_ip(ip_address)
 
     def load_history(self):
-        """Load history from database"""
-        self.history_table.setRowCount(0)
-        self.cursor.execute("SELECT ip_address, country, city, latitude, longitude, timestamp FROM history ORDER BY timestamp DESC")
-        for row_data in self.cursor.fetchall():
-            row = self.history_table.rowCount()
-            self.history_table.insertRow(row)
-            for col, data in enumerate(row_data):
-                self.history_table.setItem(row, col, QTableWidgetItem(str(data)))
+        """Load the first page of history from database"""
+        self.history_model.refresh()
+
+    def apply_history_filters(self):
+        """Run the search, country, date and network filters as one query"""
+        self.search_timer.stop()
+        search = self.history_search.text().strip()
+        country = self.country_filter.currentText().strip()
+        network = self.network_filter.text().strip()
+        days = ANALYTICS_WINDOWS[self.date_filter.currentText()]
+        date_from = None
+        if days is not None:
+            date_from = (datetime.now() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+
+        started = time.perf_counter()
+        try:
+            self.history_model.set_filters(search, country, date_from, network)
+        except ValueError:
+            self.statusBar().showMessage(f"Invalid network: {network}")
+            return
+        except sqlite3.OperationalError as e:
+            self.statusBar().showMessage(f"Invalid search: {str(e)}")
+            return
+        elapsed = (time.perf_counter() - started) * 1000
+        if search or country or date_from or network:
+            self.statusBar().showMessage(f"Filtered history in {elapsed:.0f} ms")
+        else:
+            self.statusBar().showMessage("Showing all history")
+
+    def load_countries(self):
+        """Offer the countries seen so far in the History tab's country filter"""
+        current = self.country_filter.currentText()
+        self.country_filter.blockSignals(True)
+        self.country_filter.clear()
+        self.country_filter.addItem("")
+        self.country_filter.addItems(sorted(country for country, _ in country_counts(self.conn) if country))
+        self.country_filter.setCurrentText(current)
+        self.country_filter.blockSignals(False)
 
     def clear_history(self):
         """Clear lookup history"""
-        translations = {
-            "English": {"history_cleared": "History cleared"},
-            "فارسی": {"history_cleared": "تاریخچه پاک شد"},
-            "中文": {"history_cleared": "历史记录已清除"}
-        }
-        self.cursor.execute("DELETE FROM history")
-        self.conn.commit()
-        self.history_table.setRowCount(0)
-        self.statusBar().showMessage(translations[self.current_language]["history_cleared"])
+        self.writer.execute("DELETE FROM history")
+        self.history_model.clear()
+        self.statusBar().showMessage(self.translate("history_cleared"))
         logging.info("History cleared")
 
-    def export_history(self):
-        """Export history to CSV"""
-        translations = {
-            "English": {"export_success": "History exported to {}", "export_failed": "Export failed: {}"},
-            "فارسی": {"export_success": "تاریخچه به {} صادر شد", "export_failed": "خطا در صادرات: {}"},
-            "中文": {"export_success": "历史记录导出到 {}", "export_failed": "导出失败：{}"}
+    def maintain_history(self, convert=False):
+        """Compact, expire and vacuum history in the background with the configured limits"""
+        if self.maintenance_running:
+            return
+        self.maintenance_running = True
+        self.maintenance_requested = convert
+        if convert:
+            self.statusBar().showMessage("Compacting history...")
+        limits = {
+            "compact_after_days": self.settings.value("compact_after_days", COMPACT_AFTER_DAYS, type=int),
+            "retention_days": self.settings.value("retention_days", RETENTION_DAYS, type=int),
+            "max_rows": self.settings.value("max_history_rows", MAX_HISTORY_ROWS, type=int),
         }
+        future = self.writer.submit(lambda conn: maintain_history(conn, **limits, convert=convert))
+        future.add_done_callback(self.maintenance_signals.finished.emit)
+
+    def show_maintenance_result(self, future):
+        """Report a finished maintenance run and reload history if rows moved"""
+        self.maintenance_running = False
         try:
-            home_dir = Path.home()
-            export_path = home_dir / "ip_history.csv"
-            with open(export_path, 'w', newline='', encoding='utf-8') as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerow(["IP Address", "Country", "City", "Latitude", "Longitude", "Timestamp"])
-                self.cursor.execute("SELECT ip_address, country, city, latitude, longitude, timestamp FROM history")
-                writer.writerows(self.cursor.fetchall())
-            self.statusBar().showMessage(translations[self.current_language]["export_success"].format(export_path))
-            logging.info(f"History exported to {export_path}")
+            result = future.result()
         except Exception as e:
-            self.statusBar().showMessage(translations[self.current_language]["export_failed"].format(str(e)))
-            logging.error(f"Export failed: {str(e)}")
+            logging.error(f"History maintenance failed: {str(e)}")
+            self.statusBar().showMessage(f"History maintenance failed: {str(e)}")
+            return
+        logging.info("History maintenance finished", extra=result)
+        if result["compacted"] or result["expired"]:
+            self.statusBar().showMessage(
+                f"History compacted: {result['compacted']} rows rolled up, {result['expired']} expired")
+            self.load_history()
+            self.load_countries()
+        elif self.maintenance_requested:
+            self.statusBar().showMessage(f"History compacted: {result['freed_pages']} pages freed")
 
-    def update_history_table(self):
-        """Update history table display"""
-        self.load_history()
+    def show_write_failure(self, failure):
+        """Report history writes the writer thread gave up on"""
+        if failure.rows:
+            self.statusBar().showMessage(f"History not saved: {str(failure.error)} ({len(failure.rows)} lookups lost)")
+        else:
+            self.statusBar().showMessage(f"History update failed: {str(failure.error)}")
+
+    def export_history(self):
+        """Export history in the background"""
+        if self.export_job is not None:
+            return
+        dialog = ExportDialog(self)
+        if not dialog.exec():
+            return
+
+        date_from, date_to, country = dialog.filters()
+        self.export_job = HistoryExportJob(
+            self.db_path, dialog.path_input.text(), dialog.format_combo.currentText(),
+            writer=self.writer, date_from=date_from, date_to=date_to, country=country
+        )
+        self.export_job.start()
+        self.export_button.setEnabled(False)
+        self.export_progress.setRange(0, 0)
+        self.export_progress.setVisible(True)
+        self.export_cancel_button.setVisible(True)
+
+        self.export_timer = QTimer()
+        self.export_timer.timeout.connect(self.check_export_progress)
+        self.export_timer.start(100)
+
+    def cancel_export(self):
+        """Cancel the running export"""
+        if self.export_job is not None:
+            self.export_job.cancel()
+
+    def check_export_progress(self):
+        """Drain progress reported by the export job"""
+        while True:
+            try:
+                kind, *payload = self.export_job.progress_queue.get_nowait()
+            except queue.Empty:
+                return
+
+            if kind == "progress":
+                exported, total = payload
+                self.export_progress.setRange(0, max(total, 1))
+                self.export_progress.setValue(exported)
+                continue
+
+            self.export_timer.stop()
+            self.export_job = None
+            self.export_button.setEnabled(True)
+            self.export_progress.setVisible(False)
+            self.export_cancel_button.setVisible(False)
+            if kind == "done":
+                self.statusBar().showMessage(self.translate("export_success", payload[0]))
+                logging.info(f"History exported to {payload[0]}")
+            elif kind == "cancelled":
+                self.statusBar().showMessage("Export cancelled")
+                logging.info("Export cancelled")
+            else:
+                self.statusBar().showMessage(self.translate("export_failed", payload[0]))
+                logging.error(f"Export failed: {payload[0]}")
+            return
+
+    def import_offline_db(self):
+        """Import a CSV of IP ranges into the offline database"""
+        path, _ = QFileDialog.getOpenFileName(self, "Import IP Ranges", str(Path.home()),
+                                              "CSV files (*.csv);;All files (*)")
+        if not path:
+            return
+        self.statusBar().showMessage("Importing offline database...")
+        self.offline_import_queue = queue.Queue()
+        self.close_offline_db()
+
+        def run_import():
+            try:
+                count = OfflineGeoDB.build(path, self.offline_db_path)
+                self.offline_import_queue.put(("success", count))
+            except (OSError, ValueError, struct.error) as e:
+                self.offline_import_queue.put(("error", str(e)))
+
+        threading.Thread(target=run_import, daemon=True).start()
+        self.offline_import_timer = QTimer()
+        self.offline_import_timer.timeout.connect(self.check_offline_import)
+        self.offline_import_timer.start(100)
+
+    def check_offline_import(self):
+        """Check the result of an offline database import"""
+        try:
+            status, payload = self.offline_import_queue.get_nowait()
+        except queue.Empty:
+            return
+        self.offline_import_timer.stop()
+        if status == "success":
+            if self.settings.value("lookup_source", "Online") == "Offline Database":
+                self.open_offline_db()
+            self.statusBar().showMessage(f"Imported {payload} IPv4 ranges (IPv6 is not supported offline)")
+            logging.info(f"Offline database imported with {payload} ranges")
+        else:
+            self.statusBar().showMessage(f"Import failed: {payload}")
+            logging.error(f"Offline database import failed: {payload}")
+
+    def update_cache_stats(self):
+        """Show lookup cache hit and miss counters in the status bar"""
+        self.cache_label.setText(f"Cache: {self.cache.hits} hits / {self.cache.misses} misses")
+
+    def update_scheduler_stats(self):
+        """Show queued lookups and the time until the rate limit resets"""
+        depth = self.lookup_engine.queue_depth()
+        reset = max(self.lookup_engine.providers.seconds_until_reset(),
+                    self.batch_rate_limiter.seconds_until_reset())
+        parts = []
+        if depth:
+            parts.append(f"Queued: {depth}")
+        if reset:
+            parts.append(f"Quota resets in {int(reset + 0.5)}s")
+        self.scheduler_label.setText(" | ".join(parts))
+
+    def update_history_table(self, row=None):
+        """Update history table display, prepending a single new row when given"""
+        if row is None:
+            self.load_history()
+        else:
+            self.history_model.prepend_row(row)
+
+    def show_diagnostics(self):
+        """Show live lookup stage timings"""
+        DiagnosticsDialog(self).exec()
 
     def show_settings(self):
         """Show settings dialog"""
-        dialog = SettingsDialog(self)
+        dialog = SettingsDialog(self, self.lookup_engine.providers)
         dialog.theme_combo.setCurrentText(self.current_theme)
         dialog.language_combo.setCurrentText(self.current_language)
         dialog.auto_refresh.setChecked(self.settings.value("auto_refresh", False, type=bool))
         dialog.refresh_interval.setValue(self.settings.value("refresh_interval", 5, type=int))
+        dialog.cache_size.setValue(self.settings.value("cache_size", CACHE_SIZE, type=int))
+        dialog.cache_ttl.setValue(self.settings.value("cache_ttl", CACHE_TTL, type=int))
+        dialog.compact_after.setValue(self.settings.value("compact_after_days", COMPACT_AFTER_DAYS, type=int))
+        dialog.retention_days.setValue(self.settings.value("retention_days", RETENTION_DAYS, type=int))
+        dialog.max_history_rows.setValue(self.settings.value("max_history_rows", MAX_HISTORY_ROWS, type=int))
+        dialog.lookup_source.setCurrentText(self.settings.value("lookup_source", "Online"))
+        dialog.metrics_port.setValue(self.settings.value("metrics_port", 0, type=int))
+        dialog.api_port.setValue(self.settings.value("api_port", 0, type=int))
+        dialog.enrich.setChecked(self.settings.value("enrich", False, type=bool))
+        dialog.dns_server.setText(self.settings.value("dns_server", ""))
         
         if dialog.exec():
             new_theme = dialog.theme_combo.currentText()
             new_language = dialog.language_combo.currentText()
             auto_refresh = dialog.auto_refresh.isChecked()
             refresh_interval = dialog.refresh_interval.value()
+            cache_size = dialog.cache_size.value()
+            cache_ttl = dialog.cache_ttl.value()
+            lookup_source = dialog.lookup_source.currentText()
+            metrics_port = dialog.metrics_port.value()
+            api_port = dialog.api_port.value()
+            providers = dialog.enabled_providers()
+            enrich = dialog.enrich.isChecked()
+            dns_server = dialog.dns_server.text().strip()
 
             self.settings.setValue("theme", new_theme)
             self.settings.setValue("language", new_language)
             self.settings.setValue("auto_refresh", auto_refresh)
             self.settings.setValue("refresh_interval", refresh_interval)
+            self.settings.setValue("cache_size", cache_size)
+            self.settings.setValue("cache_ttl", cache_ttl)
+            self.cache.configure(cache_size, cache_ttl * 3600)
+            self.settings.setValue("compact_after_days", dialog.compact_after.value())
+            self.settings.setValue("retention_days", dialog.retention_days.value())
+            self.settings.setValue("max_history_rows", dialog.max_history_rows.value())
+            self.settings.setValue("lookup_source", lookup_source)
+            self.settings.setValue("metrics_port", metrics_port)
+            self.configure_metrics_server(metrics_port)
+            self.settings.setValue("api_port", api_port)
+            self.configure_api_server(api_port)
+            try:
+                self.lookup_engine.providers.configure(providers)
+                self.settings.setValue("providers", ",".join(providers))
+            except ValueError as e:
+                self.statusBar().showMessage(str(e))
+            self.settings.setValue("enrich", enrich)
+            try:
+                self.enricher.resolver = DnsResolver(dns_server or DNS_SERVER)
+                self.settings.setValue("dns_server", dns_server)
+            except ValueError as e:
+                self.statusBar().showMessage(str(e))
+
+            if lookup_source == "Offline Database":
+                if self.offline_db is None:
+                    self.open_offline_db()
+            else:
+                self.close_offline_db()
 
             if new_theme != self.current_theme:
                 self.current_theme = new_theme
@@ -548,27 +1928,31 @@ class IPTracker(QMainWindow):
         """Handle window close event"""
         event.ignore()
         self.hide()
-        translations = {
-            "English": "Application minimized to system tray",
-            "فارسی": "برنامه به سینی سیستم مینیمایز شد",
-            "中文": "应用程序已最小化到系统托盘"
-        }
         self.tray_icon.showMessage(
             "IP Tracker",
-            translations[self.current_language],
+            self.translate("minimized_to_tray"),
             QSystemTrayIcon.MessageIcon.Information,
             2000
         )
 
-def main():
+def main(profile_startup=None):
+    if profile_startup is None:
+        profile_startup = os.environ.get("IPTRACKER_PROFILE_STARTUP", "") not in ("", "0")
+    profiler = StartupProfiler(profile_startup, started=IMPORT_STARTED)
+    profiler.mark("imports")
+    log_listener = setup_logging()
     app = QApplication(sys.argv)
     app.setFont(QFont("Segoe UI", 10))
     app.setWindowIcon(QIcon("IPTracker.jpg"))  # Set application icon (favicon)
-    
-    tracker = IPTracker()
+    profiler.mark("qapplication")
+
+    tracker = IPTracker(profiler)
     tracker.show()
+    profiler.mark("show")
     
-    sys.exit(app.exec())
+    exit_code = app.exec()
+    log_listener.stop()
+    sys.exit(exit_code)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
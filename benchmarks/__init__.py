@@ -0,0 +1 @@
+"""Benchmarks for IP Tracker, run with python -m benchmarks.bench"""
@@ -0,0 +1,599 @@
+"""IP Tracker benchmark suite
+
+Runs entirely offline against the bundled fake ip-api server and writes
+the results as JSON so runs can be compared between versions:
+
+    python -m benchmarks.bench --output results.json
+    python -m benchmarks.bench --latency 40 --error-rate 0.02 --rows 10000 100000
+    python -m benchmarks.bench --output new.json --compare old.json
+
+Suites: lookup (single lookup latency and throughput, batch throughput),
+enrich (reverse DNS and ASN latency against the stub DNS server), api
+(local API server throughput with --clients parallel clients), ingest
+(access log lines/s, plain and gzipped), cache (memory and disk hit
+latency), history (history tab first page at each --rows size, pages
+deep into a sort by country, and opening a row's stored response), export
+(rows/s per format) and startup (cold start of the core, the CLI and the
+GUI window).
+"""
+import argparse
+import gzip
+import http.client
+import importlib.util
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from iptracker_core import (
+    ENRICH_STAGES, EXPORT_FORMATS, HISTORY_COLUMNS, HISTORY_INSERT, ApiServer, BulkLookupJob, DnsResolver,
+    Enricher, HistoryExportJob, HistoryWriter, LogIngestJob, LookupCache, LookupEngine, ProviderPool, RateLimiter,
+    connect_db, history_filter, history_row, open_history_db, stored_response
+)
+from benchmarks.fake_dns import FakeDnsServer
+from benchmarks.fake_ipapi import UNLIMITED_QUOTA, FakeGeoServer, geolocate
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+SUITES = ["lookup", "enrich", "api", "ingest", "cache", "history", "export", "startup"]
+DEFAULT_ROWS = [10_000, 100_000, 1_000_000]
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def latency_stats(seconds):
+    """Summarize a list of durations in milliseconds"""
+    ms = [value * 1000 for value in seconds]
+    return {
+        "count": len(ms),
+        "mean_ms": round(sum(ms) / len(ms), 3) if ms else None,
+        "p50_ms": round(percentile(ms, 0.50), 3) if ms else None,
+        "p99_ms": round(percentile(ms, 0.99), 3) if ms else None,
+        "max_ms": round(max(ms), 3) if ms else None,
+    }
+
+
+def sample_ips(count, offset=0):
+    """Distinct public-looking IPv4 addresses"""
+    return [f"{11 + (i >> 24) % 200}.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+            for i in range(offset, offset + count)]
+
+
+def bench_lookup(args, api_url):
+    """Single lookups through LookupEngine and batch lookups through BulkLookupJob"""
+    results = {}
+    # Only the stand-in server: hedges must not reach the real fallback providers
+    providers = ProviderPool.from_names(["ip-api"], api_url, RateLimiter(UNLIMITED_QUOTA), args.workers)
+    engine = LookupEngine(api_url=api_url, workers=args.workers, providers=providers)
+    try:
+        # One lookup at a time, the way interactive lookups arrive
+        durations = []
+        statuses = {}
+        done = threading.Event()
+        outcome = []
+        for ip_address in sample_ips(args.sequential):
+            done.clear()
+            started = time.perf_counter()
+            engine.submit(ip_address, lambda result: (outcome.append(result), done.set()))
+            done.wait()
+            durations.append(time.perf_counter() - started)
+            status = outcome.pop().status
+            statuses[status] = statuses.get(status, 0) + 1
+        results["single_sequential"] = dict(latency_stats(durations), statuses=statuses)
+
+        # A burst of distinct IPs to measure throughput with the full worker pool
+        finished = {}
+        lock = threading.Lock()
+        all_done = threading.Event()
+        submitted = {}
+        ip_addresses = sample_ips(args.concurrent, offset=args.sequential)
+
+        def on_result(result):
+            with lock:
+                finished[result.request_id] = (time.perf_counter(), result.status)
+                if len(finished) == len(ip_addresses):
+                    all_done.set()
+
+        started = time.perf_counter()
+        for ip_address in ip_addresses:
+            submitted[engine.submit(ip_address, on_result)] = time.perf_counter()
+        all_done.wait()
+        elapsed = time.perf_counter() - started
+        statuses = {}
+        for _, status in finished.values():
+            statuses[status] = statuses.get(status, 0) + 1
+        results["single_concurrent"] = dict(
+            latency_stats([finished[request_id][0] - sent for request_id, sent in submitted.items()]),
+            workers=args.workers,
+            lookups_per_sec=round(len(ip_addresses) / elapsed, 1),
+            statuses=statuses,
+        )
+    finally:
+        engine.shutdown()
+
+    # The /batch endpoint used by bulk lookups and the CLI
+    ip_addresses = sample_ips(args.batch, offset=args.sequential + args.concurrent)
+    job = BulkLookupJob(ip_addresses, rate_limiter=RateLimiter(UNLIMITED_QUOTA), api_url=api_url)
+    started = time.perf_counter()
+    job.start()
+    statuses = {}
+    while True:
+        kind, payload = job.progress_queue.get()
+        if kind == "done":
+            break
+        for _, status, _, _ in payload:
+            statuses[status] = statuses.get(status, 0) + 1
+    elapsed = time.perf_counter() - started
+    results["batch"] = {
+        "count": len(ip_addresses),
+        "seconds": round(elapsed, 3),
+        "lookups_per_sec": round(len(ip_addresses) / elapsed, 1),
+        "statuses": statuses,
+    }
+    return results
+
+
+def bench_enrich(args, workdir):
+    """Per-stage enrichment latency for a burst of addresses, uncached and then cached"""
+    server = FakeDnsServer(latency=args.latency / 1000, jitter=args.jitter / 1000,
+                           drop_rate=args.error_rate, seed=args.seed)
+    enricher = Enricher(DnsResolver(server.serve_in_background()), workdir / "enrich.db")
+    ip_addresses = sample_ips(args.concurrent)
+    results = {}
+    try:
+        for label in ("cold", "cached"):
+            durations = {}
+            statuses = {}
+            lock = threading.Lock()
+            all_done = threading.Event()
+            expected = len(ip_addresses) * len(ENRICH_STAGES)
+            started = time.perf_counter()
+
+            def on_result(result, started=started):
+                with lock:
+                    durations.setdefault(result.stage, []).append(time.perf_counter() - started)
+                    key = f"{result.stage}_{result.status}"
+                    statuses[key] = statuses.get(key, 0) + 1
+                    if sum(statuses.values()) == expected:
+                        all_done.set()
+
+            for ip_address in ip_addresses:
+                enricher.enrich(ip_address, on_result)
+            all_done.wait()
+            elapsed = time.perf_counter() - started
+            results[label] = dict(
+                {stage: latency_stats(seconds) for stage, seconds in durations.items()},
+                lookups_per_sec=round(len(ip_addresses) / elapsed, 1),
+                statuses=statuses,
+            )
+    finally:
+        enricher.shutdown()
+        server.shutdown()
+    return results
+
+
+def bench_api(args, workdir, geo_server):
+    """Lookups from --clients parallel clients through one ApiServer
+
+    cold spreads distinct addresses over the clients, shared has every client
+    ask for the same addresses (served by coalescing and the cache) and batch
+    sends /batch requests of 100 addresses. upstream_requests counts what
+    reached the fake ip-api server.
+    """
+    db_path = workdir / "api.db"
+    open_history_db(db_path).close()
+    writer = HistoryWriter(db_path)
+    writer.start()
+    providers = ProviderPool.from_names(["ip-api"], geo_server.url, RateLimiter(UNLIMITED_QUOTA), args.workers)
+    engine = LookupEngine(cache=LookupCache(db_path), api_url=geo_server.url, workers=args.workers,
+                          providers=providers)
+    server = ApiServer(0, engine, db_path, writer, batch_rate_limiter=RateLimiter(UNLIMITED_QUOTA))
+    server.start()
+    per_client = max(1, args.concurrent // args.clients)
+    cold = sample_ips(per_client * args.clients, offset=2_000_000)
+    shared = sample_ips(per_client, offset=3_000_000)
+    batches = sample_ips(100 * args.clients, offset=4_000_000)
+    scenarios = {
+        "cold": lambda client: [("GET", ip) for ip in cold[client::args.clients]],
+        "shared": lambda client: [("GET", ip) for ip in shared],
+        "batch": lambda client: [("POST", batches[client * 100:(client + 1) * 100])],
+    }
+    results = {}
+    try:
+        for label, requests_for in scenarios.items():
+            durations = []
+            statuses = {}
+            lock = threading.Lock()
+            upstream = geo_server.requests
+
+            def client(number):
+                # http.client keeps the clients' own overhead low next to the server in this process
+                connection = http.client.HTTPConnection(*server.server_address[:2], timeout=60)
+                for method, target in requests_for(number):
+                    sent = time.perf_counter()
+                    if method == "GET":
+                        connection.request("GET", f"/json/{target}")
+                        answers = [json.loads(connection.getresponse().read())]
+                    else:
+                        connection.request("POST", "/batch", json.dumps(target),
+                                           {"Content-Type": "application/json"})
+                        answers = json.loads(connection.getresponse().read())
+                    elapsed = time.perf_counter() - sent
+                    with lock:
+                        durations.append(elapsed)
+                        for answer in answers:
+                            statuses[answer["status"]] = statuses.get(answer["status"], 0) + 1
+                connection.close()
+
+            threads = [threading.Thread(target=client, args=(number,)) for number in range(args.clients)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            results[label] = dict(
+                latency_stats(durations),
+                clients=args.clients,
+                lookups_per_sec=round(sum(statuses.values()) / elapsed, 1),
+                upstream_requests=geo_server.requests - upstream,
+                statuses=statuses,
+            )
+    finally:
+        server.stop()
+        engine.shutdown()
+        writer.stop()
+    return results
+
+
+def build_access_log(path, lines, distinct=50_000):
+    """Write an nginx combined-format access log with lines requests from distinct clients"""
+    if path.exists():
+        return
+    clients = sample_ips(distinct)
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "wt", encoding="ascii") as f:
+        for i in range(lines):
+            f.write(f'{clients[(i * 7919) % distinct]} - - [18/Oct/2026:10:{i // 60 % 60:02d}:{i % 60:02d} +0000] '
+                    f'"GET /items/{i % 997} HTTP/1.1" 200 {i % 5000} "-" "Mozilla/5.0 (X11; Linux x86_64)"\n')
+
+
+def bench_ingest(args, workdir):
+    """Access log parse and count throughput, without geolocation"""
+    results = {}
+    for name in ("access.log", "access.log.gz"):
+        path = workdir / f"{args.log_lines}-{name}"
+        build_access_log(path, args.log_lines)
+        reports = [LogIngestJob(path, lookup=False).ingest() for _ in range(args.repeat)]
+        best = min(reports, key=lambda report: report["seconds"])
+        results[name] = {
+            "lines": best["lines"],
+            "unique_ips": best["unique_ips"],
+            "seconds": best["seconds"],
+            # Reading and counting only; seconds also covers validating the distinct addresses
+            "lines_per_sec": round(max(report["lines_per_sec"] for report in reports)),
+            "mb_per_sec": round(path.stat().st_size / best["seconds"] / 1e6, 1),
+        }
+    return results
+
+
+def bench_cache(args, workdir):
+    """Hit latency of the in-memory LRU and of the persistent SQLite tier"""
+    db_path = workdir / "cache.db"
+    ip_addresses = sample_ips(args.cache_entries)
+    cache = LookupCache(db_path, max_entries=len(ip_addresses))
+    for ip_address in ip_addresses:
+        cache.put(ip_address, geolocate(ip_address))
+
+    memory = []
+    for ip_address in ip_addresses:
+        started = time.perf_counter()
+        cache.get(ip_address)
+        memory.append(time.perf_counter() - started)
+    cache.conn.close()
+
+    # A fresh instance has an empty LRU, so every first get reads SQLite
+    cache = LookupCache(db_path, max_entries=len(ip_addresses))
+    disk = []
+    for ip_address in ip_addresses:
+        started = time.perf_counter()
+        cache.get(ip_address)
+        disk.append(time.perf_counter() - started)
+    misses = []
+    for ip_address in sample_ips(args.cache_entries, offset=len(ip_addresses)):
+        started = time.perf_counter()
+        cache.get(ip_address)
+        misses.append(time.perf_counter() - started)
+    cache.conn.close()
+    return {"memory_hit": latency_stats(memory), "disk_hit": latency_stats(disk), "miss": latency_stats(misses)}
+
+
+def build_history(db_path, rows):
+    """Create a history database holding rows synthetic lookups"""
+    if db_path.exists():
+        return
+    open_history_db(db_path).close()
+    conn = connect_db(db_path)
+    start = datetime(2024, 1, 1)
+    chunk = 50_000
+    with conn:
+        for offset in range(0, rows, chunk):
+            batch = []
+            for i, ip_address in enumerate(sample_ips(min(chunk, rows - offset), offset), start=offset):
+                timestamp = (start + timedelta(seconds=i * 30)).strftime("%Y-%m-%d %H:%M:%S")
+                batch.append(history_row(ip_address, geolocate(ip_address), timestamp))
+            conn.executemany(HISTORY_INSERT, batch)
+    conn.close()
+
+
+def history_databases(args, workdir):
+    for rows in args.rows:
+        db_path = workdir / f"history-{rows}.db"
+        build_history(db_path, rows)
+        yield rows, db_path
+
+
+def bench_history(args, workdir):
+    """Time to open the database and show the first page of the history tab"""
+    try:
+        from IPTracker import HistoryModel
+    except ImportError:
+        HistoryModel = None
+
+    results = {}
+    for rows, db_path in history_databases(args, workdir):
+        durations = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            conn = open_history_db(db_path)
+            if HistoryModel is not None:
+                model = HistoryModel(conn)
+                model.refresh()
+            else:
+                conn.execute("SELECT * FROM history ORDER BY timestamp DESC, id DESC LIMIT 256").fetchall()
+            durations.append(time.perf_counter() - started)
+            conn.close()
+        results[str(rows)] = dict(latency_stats(durations), method="model" if HistoryModel else "sql")
+
+        # Scrolling sorted by country, timed from the 100th page on, where OFFSET paging used to slow down
+        if HistoryModel is not None:
+            conn = open_history_db(db_path)
+            model = HistoryModel(conn)
+            model.sort(HISTORY_COLUMNS.index("country"))
+            for _ in range(99):
+                model.fetchMore()
+            durations = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                model.fetchMore()
+                durations.append(time.perf_counter() - started)
+            conn.close()
+            results[str(rows)]["deep_page"] = latency_stats(durations)
+
+        # Text search combined with country and date filters, as typed into the History tab
+        source, params = history_filter("frankfurt isp", "Germany", "2024-01-02")
+        conn = open_history_db(db_path)
+        durations = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            conn.execute(f"SELECT *{source} ORDER BY match_id DESC LIMIT 256", params).fetchall()
+            durations.append(time.perf_counter() - started)
+        results[str(rows)]["search"] = latency_stats(durations)
+
+        # Double-clicking a row decodes its stored response; sizes show the storage overhead
+        durations = []
+        packed_bytes = json_bytes = 0
+        sample = conn.execute("SELECT id, response FROM history ORDER BY id DESC LIMIT 256").fetchall()
+        for row_id, response in sample:
+            started = time.perf_counter()
+            data = stored_response(conn, row_id)
+            durations.append(time.perf_counter() - started)
+            packed_bytes += len(response or b"")
+            json_bytes += len(json.dumps(data, separators=(",", ":")).encode()) if data else 0
+        conn.close()
+        results[str(rows)]["details"] = dict(
+            latency_stats(durations),
+            response_bytes=round(packed_bytes / len(sample), 1) if sample else None,
+            json_bytes=round(json_bytes / len(sample), 1) if sample else None,
+        )
+    return results
+
+
+def bench_export(args, workdir):
+    """Export throughput for every available format at each history size"""
+    formats = list(EXPORT_FORMATS)
+    if importlib.util.find_spec("pyarrow") is None:
+        formats.remove("Parquet")
+
+    results = {}
+    for rows, db_path in history_databases(args, workdir):
+        sized = results[str(rows)] = {}
+        for export_format in formats:
+            path = workdir / f"export-{rows}{EXPORT_FORMATS[export_format]}"
+            job = HistoryExportJob(db_path, path, export_format)
+            started = time.perf_counter()
+            job.run()
+            elapsed = time.perf_counter() - started
+            kind, payload = None, None
+            while not job.progress_queue.empty():
+                kind, *payload = job.progress_queue.get()
+            if kind != "done":
+                sized[export_format] = {"error": payload[0] if payload else kind}
+                continue
+            size = path.stat().st_size
+            sized[export_format] = {
+                "seconds": round(elapsed, 3),
+                "rows_per_sec": round(rows / elapsed),
+                "mb_per_sec": round(size / elapsed / 1e6, 2),
+                "bytes": size,
+            }
+            path.unlink()
+    return results
+
+
+STARTUP_SCRIPTS = {
+    "interpreter": "pass",
+    "core_import": "import iptracker_core",
+    "cli_help": "import sys, iptracker_cli; sys.argv = ['iptracker', '--help']\n"
+                "try:\n    iptracker_cli.main()\nexcept SystemExit:\n    pass",
+    "gui_window": "import os\n"
+                  "from PyQt6.QtWidgets import QApplication\n"
+                  "import IPTracker\n"
+                  "app = QApplication([])\n"
+                  "window = IPTracker.IPTracker()\n"
+                  "window.show()\n"
+                  "app.processEvents()\n"
+                  "os._exit(0)",
+}
+
+
+def bench_startup(args, workdir, api_url):
+    """Wall time of fresh interpreters importing the core, running the CLI and showing the GUI"""
+    env = dict(os.environ, HOME=str(workdir / "home"), IPTRACKER_API_URL=api_url,
+               QT_QPA_PLATFORM=os.environ.get("QT_QPA_PLATFORM", "offscreen"),
+               PYTHONDONTWRITEBYTECODE="1")
+    scripts = dict(STARTUP_SCRIPTS)
+    if importlib.util.find_spec("PyQt6") is None:
+        del scripts["gui_window"]
+
+    results = {}
+    for name, code in scripts.items():
+        durations = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], cwd=workdir, env=dict(env, PYTHONPATH=str(REPO_ROOT)),
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            durations.append(time.perf_counter() - started)
+        results[name] = latency_stats(durations)
+    return results
+
+
+def environment():
+    """Describe the machine and revision the results came from"""
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {
+        "revision": revision,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def flatten(results, prefix=""):
+    """Map dotted metric names to numeric values"""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(baseline, current):
+    """Print the change of every metric present in both result sets"""
+    old, new = flatten(baseline["results"]), flatten(current["results"])
+    print(f"{'metric':60} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name in sorted(old.keys() & new.keys()):
+        change = f"{(new[name] - old[name]) / old[name] * 100:+.1f}%" if old[name] else ""
+        print(f"{name:60} {old[name]:>12} {new[name]:>12} {change:>8}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench", description="Benchmark IP Tracker")
+    parser.add_argument("suites", nargs="*", metavar="suite",
+                        help=f"suites to run: {', '.join(SUITES)} (default: all)")
+    parser.add_argument("-o", "--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="print the change against a previous results file")
+    parser.add_argument("--workdir", help="keep generated databases here and reuse them between runs")
+    parser.add_argument("--latency", type=float, default=20.0, help="fake server latency per request (ms)")
+    parser.add_argument("--jitter", type=float, default=5.0, help="fake server latency variation (ms)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=8, help="lookup engine workers")
+    parser.add_argument("--sequential", type=int, default=200, help="lookups timed one at a time")
+    parser.add_argument("--concurrent", type=int, default=1000, help="lookups submitted as one burst")
+    parser.add_argument("--batch", type=int, default=10_000, help="IPs looked up through /batch")
+    parser.add_argument("--clients", type=int, default=32, help="parallel clients of the API server")
+    parser.add_argument("--cache-entries", type=int, default=1000)
+    parser.add_argument("--log-lines", type=int, default=1_000_000, help="lines in the generated access log")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS, help="history sizes")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions of history and startup timings")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    unknown = [suite for suite in args.suites if suite not in SUITES]
+    if unknown:
+        parser.error(f"unknown suite: {', '.join(unknown)}")
+    suites = args.suites or SUITES
+
+    server = FakeGeoServer(latency=args.latency / 1000, jitter=args.jitter / 1000,
+                           error_rate=args.error_rate, seed=args.seed)
+    api_url = server.serve_in_background()
+
+    with tempfile.TemporaryDirectory(prefix="iptracker-bench-") as tmp:
+        workdir = Path(args.workdir or tmp)
+        workdir.mkdir(parents=True, exist_ok=True)
+        results = {}
+        for suite in suites:
+            print(f"Running {suite} benchmarks...", file=sys.stderr)
+            if suite == "lookup":
+                results[suite] = bench_lookup(args, api_url)
+            elif suite == "enrich":
+                results[suite] = bench_enrich(args, workdir)
+            elif suite == "api":
+                results[suite] = bench_api(args, workdir, server)
+            elif suite == "ingest":
+                results[suite] = bench_ingest(args, workdir)
+            elif suite == "cache":
+                results[suite] = bench_cache(args, workdir)
+            elif suite == "history":
+                results[suite] = bench_history(args, workdir)
+            elif suite == "export":
+                results[suite] = bench_export(args, workdir)
+            elif suite == "startup":
+                results[suite] = bench_startup(args, workdir, api_url)
+    server.shutdown()
+
+    report = {
+        "environment": environment(),
+        "config": {
+            "latency_ms": args.latency, "jitter_ms": args.jitter, "error_rate": args.error_rate,
+            "seed": args.seed, "workers": args.workers, "clients": args.clients, "rows": args.rows, "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+    if args.compare:
+        compare(json.loads(Path(args.compare).read_text(encoding="utf-8")), report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""Local stub DNS server answering the enrichment queries
+
+Answers PTR queries for in-addr.arpa names and the Team Cymru TXT queries
+(origin.asn.cymru.com, origin6.asn.cymru.com and AS<n>.asn.cymru.com) with
+deterministic records derived from the address, consistent with the ASNs
+the fake ip-api server reports. Latency and the share of dropped queries
+are configurable:
+
+    python -m benchmarks.fake_dns --port 5353 --latency 30 --drop-rate 0.05
+
+Point IP Tracker at it with IPTRACKER_DNS_SERVER=127.0.0.1:5353.
+"""
+import argparse
+import random
+import socketserver
+import struct
+import threading
+import time
+import zlib
+
+from benchmarks.fake_ipapi import LOCATIONS
+
+PTR, TXT = 12, 16
+
+
+def parse_query(packet):
+    """Return (query id, flags, qname, qtype, end of question) for a DNS query"""
+    query_id, flags = struct.unpack("!HH", packet[:4])
+    labels = []
+    offset = 12
+    while packet[offset]:
+        length = packet[offset]
+        labels.append(packet[offset + 1:offset + 1 + length].decode("ascii"))
+        offset += 1 + length
+    qtype = struct.unpack("!H", packet[offset + 1:offset + 3])[0]
+    return query_id, flags, ".".join(labels).lower(), qtype, offset + 5
+
+
+def origin(address_key):
+    """Deterministic (asn, country code) for an address, matching benchmarks.fake_ipapi"""
+    key = zlib.crc32(address_key.encode())
+    return 1000 + key % 64000, LOCATIONS[key % len(LOCATIONS)][1]
+
+
+def answer(qname, qtype):
+    """Records for a query as (type, rdata) pairs, or None for NXDOMAIN"""
+    if qtype == PTR and qname.endswith(".in-addr.arpa"):
+        octets = qname[:-len(".in-addr.arpa")].split(".")[::-1]
+        if len(octets) != 4 or octets[0] in ("10", "127"):
+            return None
+        host = "host-" + "-".join(octets) + ".example.net"
+        return [(PTR, b"".join(bytes([len(label)]) + label.encode() for label in host.split(".")) + b"\0")]
+    if qtype == TXT and qname.endswith(".origin.asn.cymru.com"):
+        octets = qname[:-len(".origin.asn.cymru.com")].split(".")[::-1]
+        if len(octets) != 4 or octets[0] in ("10", "127"):
+            return None
+        ip_address = ".".join(octets)
+        asn, country_code = origin(ip_address)
+        prefix = ".".join(octets[:3]) + ".0/24"
+        return [(TXT, f"{asn} | {prefix} | {country_code} | ripencc | 2010-01-01")]
+    if qtype == TXT and qname.startswith("as") and qname.endswith(".asn.cymru.com"):
+        asn = qname[2:-len(".asn.cymru.com")]
+        if not asn.isdigit():
+            return None
+        return [(TXT, f"{asn} | ZZ | ripencc | 2010-01-01 | EXAMPLE-{asn} Example Networks")]
+    return None
+
+
+def build_response(packet):
+    query_id, flags, qname, qtype, question_end = parse_query(packet)
+    records = answer(qname, qtype)
+    rcode = 3 if records is None else 0
+    header = struct.pack("!HHHHHH", query_id, 0x8180 | (flags & 0x0100) | rcode, 1, len(records or []), 0, 0)
+    body = packet[12:question_end]
+    for rtype, rdata in records or []:
+        if rtype == TXT:
+            text = rdata.encode()
+            rdata = b"".join(bytes([len(text[i:i + 255])]) + text[i:i + 255] for i in range(0, len(text), 255))
+        # 0xC00C points back at the name in the question
+        body += struct.pack("!HHHIH", 0xC00C, rtype, 1, 60, len(rdata)) + rdata
+    return header + body
+
+
+class FakeDnsServer(socketserver.ThreadingUDPServer):
+    """Threaded UDP server answering enrichment queries with simulated latency and loss"""
+
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), latency=0.0, jitter=0.0, drop_rate=0.0, seed=0):
+        super().__init__(address, FakeDnsHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.queries = 0
+
+    @property
+    def address(self):
+        host, port = self.server_address[:2]
+        return f"{host}:{port}"
+
+    def admit(self):
+        """Count a query; returns (drop, delay)"""
+        with self.lock:
+            self.queries += 1
+            drop = self.random.random() < self.drop_rate
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            return drop, delay
+
+    def serve_in_background(self):
+        """Serve from a daemon thread and return the server's host:port"""
+        threading.Thread(target=self.serve_forever, name="fake-dns", daemon=True).start()
+        return self.address
+
+
+class FakeDnsHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        packet, sock = self.request
+        drop, delay = self.server.admit()
+        if drop:
+            return
+        try:
+            response = build_response(packet)
+        except (struct.error, IndexError, UnicodeDecodeError):
+            return
+        if delay:
+            time.sleep(delay)
+        sock.sendto(response, self.client_address)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve stub DNS answers for enrichment")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5353)
+    parser.add_argument("--latency", type=float, default=0.0, help="added latency per query (ms)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random latency variation (ms)")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="fraction of queries left unanswered")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    server = FakeDnsServer((args.host, args.port), latency=args.latency / 1000, jitter=args.jitter / 1000,
+                           drop_rate=args.drop_rate, seed=args.seed)
+    print(f"Serving stub DNS on {server.address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
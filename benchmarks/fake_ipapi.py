@@ -0,0 +1,171 @@
+"""Local stand-in for ip-api.com used by the benchmarks
+
+Serves GET /json/<ip> and POST /batch with deterministic answers derived
+from the address, so runs are repeatable and never touch the network.
+Latency, jitter, error rate and the per-minute quota are configurable:
+
+    python -m benchmarks.fake_ipapi --port 8765 --latency 40 --jitter 10 --error-rate 0.01
+
+Point IP Tracker at it with IPTRACKER_API_URL=http://127.0.0.1:8765.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LOCATIONS = [
+    ("United States", "US", "Mountain View", 37.4056, -122.0775, "America/Los_Angeles"),
+    ("Germany", "DE", "Frankfurt", 50.1109, 8.6821, "Europe/Berlin"),
+    ("Japan", "JP", "Tokyo", 35.6895, 139.6917, "Asia/Tokyo"),
+    ("Brazil", "BR", "Sao Paulo", -23.5505, -46.6333, "America/Sao_Paulo"),
+    ("Iran", "IR", "Tehran", 35.6892, 51.3890, "Asia/Tehran"),
+    ("China", "CN", "Beijing", 39.9042, 116.4074, "Asia/Shanghai"),
+    ("Australia", "AU", "Sydney", -33.8688, 151.2093, "Australia/Sydney"),
+    ("South Africa", "ZA", "Johannesburg", -26.2041, 28.0473, "Africa/Johannesburg"),
+]
+UNLIMITED_QUOTA = 1_000_000  # X-Rl reported when no quota is configured
+
+
+def geolocate(ip_address):
+    """Deterministic ip-api style response for an address"""
+    if ip_address.startswith(("10.", "192.168.", "127.")):
+        return {"status": "fail", "message": "private range", "query": ip_address}
+    key = zlib.crc32(ip_address.encode())
+    country, code, city, lat, lon, timezone = LOCATIONS[key % len(LOCATIONS)]
+    asn = 1000 + key % 64000
+    return {
+        "status": "success", "country": country, "countryCode": code, "city": city,
+        "lat": lat, "lon": lon, "timezone": timezone,
+        "isp": f"ISP {key % 97}", "org": f"Org {key % 89}", "as": f"AS{asn} Example Networks",
+        "query": ip_address,
+    }
+
+
+class FakeGeoServer(ThreadingHTTPServer):
+    """Threaded HTTP server answering like ip-api with simulated latency and failures"""
+
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), latency=0.0, jitter=0.0, error_rate=0.0,
+                 quota=None, window=60, seed=0):
+        super().__init__(address, FakeGeoHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.quota = quota
+        self.window = window
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.window_start = time.monotonic()
+        self.used = 0
+        self.requests = 0
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def admit(self):
+        """Count a request against the quota; returns (allowed, remaining, ttl, fail, delay)"""
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= self.window:
+                self.window_start = now
+                self.used = 0
+            self.requests += 1
+            ttl = max(0, int(self.window - (now - self.window_start)))
+            fail = self.random.random() < self.error_rate
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            if self.quota is None:
+                return True, UNLIMITED_QUOTA, ttl, fail, delay
+            if self.used >= self.quota:
+                return False, 0, ttl, fail, 0.0
+            self.used += 1
+            return True, self.quota - self.used, ttl, fail, delay
+
+    def serve_in_background(self):
+        """Serve from a daemon thread and return the server's base URL"""
+        threading.Thread(target=self.serve_forever, name="fake-ipapi", daemon=True).start()
+        return self.url
+
+
+class FakeGeoHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Send headers and body in one segment so keep-alive clients are not held up by delayed ACKs
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, status, payload, remaining, ttl):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Rl", str(remaining))
+        self.send_header("X-Ttl", str(ttl))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def answer(self, build):
+        allowed, remaining, ttl, fail, delay = self.server.admit()
+        if delay:
+            time.sleep(delay)
+        if not allowed:
+            self.respond(429, {"status": "fail", "message": "rate limited"}, remaining, ttl)
+        elif fail:
+            self.respond(503, {"status": "fail", "message": "simulated error"}, remaining, ttl)
+        else:
+            self.respond(200, build(), remaining, ttl)
+
+    def do_GET(self):
+        if not self.path.startswith("/json/"):
+            self.send_error(404)
+            return
+        ip_address = self.path[len("/json/"):].split("?")[0]
+        self.answer(lambda: geolocate(ip_address))
+
+    def do_POST(self):
+        if not self.path.startswith("/batch"):
+            self.send_error(404)
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            queries = json.loads(self.rfile.read(length))
+        except ValueError:
+            self.send_error(400)
+            return
+        self.answer(lambda: [
+            geolocate(query["query"] if isinstance(query, dict) else query) for query in queries
+        ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for ip-api.com")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="added latency per request (ms)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random latency variation (ms)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered HTTP 503")
+    parser.add_argument("--quota", type=int, help="requests allowed per window (default: unlimited)")
+    parser.add_argument("--window", type=int, default=60, help="quota window length (s)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    server = FakeGeoServer((args.host, args.port), latency=args.latency / 1000, jitter=args.jitter / 1000,
+                           error_rate=args.error_rate, quota=args.quota, window=args.window, seed=args.seed)
+    print(f"Serving fake ip-api on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,441 @@
+"""Command line interface for IP Tracker
+
+    iptracker lookup 8.8.8.8
+    iptracker lookup -f ips.txt --jobs 32 --format jsonl
+    iptracker lookup 8.8.8.8 --enrich --dns-server 127.0.0.1:5353
+    iptracker history --limit 20
+    iptracker history --search "frankfurt hetzner" --from 2024-01-01
+    iptracker stats --by city --from 2024-01-01
+    iptracker export history.csv.gz --format csv.gz --country Germany
+    iptracker compact --after 30 --keep 365 --max-rows 1000000
+    iptracker ingest /var/log/nginx/access.log.1.gz --top 50
+    iptracker import-ranges ranges.csv
+    iptracker serve --port 8770   # share one lookup engine with local scripts
+    iptracker                 # launch the GUI
+
+Only the GUI command imports Qt, so scripted use starts in a few tens of
+milliseconds and works without a display.
+"""
+import argparse
+import csv
+import json
+import logging
+import sys
+from pathlib import Path
+
+from iptracker_core import (
+    API_PORT, BATCH_WORKERS, COMPACT_AFTER_DAYS, DEFAULT_DB_PATH, DEFAULT_PROVIDERS, DNS_SERVER, HISTORY_COLUMNS,
+    HISTORY_HEADERS, LOG_TOP_IPS, MAX_HISTORY_ROWS, PROVIDERS, RETENTION_DAYS, ROLLUP_COLUMNS, ROLLUP_HEADERS,
+    ApiServer, BulkLookupJob, DnsResolver, Enricher, HistoryExportJob, HistoryWriter, LogIngestJob, LookupCache,
+    LookupEngine, OfflineGeoDB, ProviderPool, city_counts, compacted_history, country_counts, format_enrichment,
+    format_log_report, format_result, history_filter, maintain_history, open_history_db, parse_ip_list
+)
+
+EXPORT_FORMAT_NAMES = {
+    "csv": "CSV",
+    "csv.gz": "CSV (gzip)",
+    "jsonl": "JSON Lines",
+    "parquet": "Parquet",
+}
+
+
+def read_targets(args):
+    """Collect lookup targets from positional arguments and --file"""
+    text = " ".join(args.ip)
+    if args.file == "-":
+        text += "\n" + sys.stdin.read()
+    elif args.file:
+        with open(args.file, encoding='utf-8', errors='replace') as f:
+            text += "\n" + f.read()
+    return parse_ip_list(text)
+
+
+def report_write_failures(failures):
+    """Print history writes the writer gave up on; returns True if there were any"""
+    for failure in failures:
+        print(f"History write failed: {failure.error} ({len(failure.rows)} results not saved)", file=sys.stderr)
+    return bool(failures)
+
+
+def cmd_lookup(args):
+    """Look up one or more IPs"""
+    ip_addresses, skipped = read_targets(args)
+    if skipped:
+        print(f"Skipped {skipped} invalid entries", file=sys.stderr)
+    if not ip_addresses:
+        print("No valid IP addresses given", file=sys.stderr)
+        return 2
+
+    db_path = Path(args.db)
+    writer = cache = offline_db = None
+    write_failures = []
+    if not (args.no_history and (args.offline or args.no_cache)):
+        open_history_db(db_path).close()
+    if not args.no_history:
+        writer = HistoryWriter(db_path, on_error=write_failures.append)
+        writer.start()
+    if args.offline:
+        offline_db = OfflineGeoDB(db_path.parent / "ranges.bin")
+    elif not args.no_cache:
+        cache = LookupCache(db_path)
+
+    # Enrichment runs for every address while the geolocation batches are in flight
+    enricher = None
+    enrichment = {}
+    if args.enrich:
+        enricher = Enricher(DnsResolver(args.dns_server or DNS_SERVER), None if args.no_cache else db_path)
+        enrichment = {ip_address: enricher.enrich(ip_address) for ip_address in ip_addresses}
+
+    job = BulkLookupJob(ip_addresses, writer, cache=cache, offline_db=offline_db, workers=args.jobs)
+    job.start()
+
+    failed = 0
+    collected = []
+    csv_writer = None
+    if args.format == "csv":
+        csv_writer = csv.writer(sys.stdout)
+        headers = ["IP Address", "Status", "Country", "City", "Latitude", "Longitude", "Message"]
+        if args.enrich:
+            headers += ["Reverse DNS", "ASN", "Prefix", "AS Name"]
+        csv_writer.writerow(headers)
+    while True:
+        kind, payload = job.progress_queue.get()
+        if kind == "done":
+            break
+        for ip_address, status, message, data in payload:
+            if status != "success":
+                failed += 1
+            record = dict(data or {}, query=ip_address)
+            if status != "success":
+                record.setdefault('status', 'fail')
+                record.setdefault('message', message)
+            stages = {stage: future.result() for stage, future in enrichment.get(ip_address, {}).items()}
+            for stage, result in stages.items():
+                if result.status == "success":
+                    record.update(result.data)
+                else:
+                    record[f"{stage}_error"] = result.error
+
+            if args.format == "jsonl":
+                print(json.dumps(record, ensure_ascii=False), flush=True)
+            elif args.format == "json":
+                collected.append(record)
+            elif args.format == "csv":
+                row = [ip_address, status, record.get('country'), record.get('city'),
+                       record.get('lat'), record.get('lon'), record.get('message', '')]
+                if args.enrich:
+                    row += [record.get('ptr'), record.get('asn'), record.get('prefix'), record.get('as_name')]
+                csv_writer.writerow(row)
+            elif status == "success":
+                text = format_result(ip_address, data)
+                if stages:
+                    text += "\n" + format_enrichment(stages)
+                print(text + "\n", flush=True)
+            else:
+                print(f"{ip_address}: {message}", file=sys.stderr)
+
+    if args.format == "json":
+        print(json.dumps(collected, ensure_ascii=False, indent=2))
+    if writer is not None:
+        writer.stop()
+    if offline_db is not None:
+        offline_db.close()
+    if enricher is not None:
+        enricher.shutdown()
+    write_failed = report_write_failures(write_failures)
+    return 1 if failed or write_failed else 0
+
+
+def cmd_history(args):
+    """Print the most recent history rows"""
+    conn = open_history_db(args.db)
+    if args.compacted:
+        columns, headers = ROLLUP_COLUMNS, ROLLUP_HEADERS
+        if args.search:
+            raise ValueError("--search cannot be combined with --compacted")
+        rows = compacted_history(conn, args.country, args.date_from, args.date_to, args.network, args.limit)
+    else:
+        columns, headers = HISTORY_COLUMNS, HISTORY_HEADERS
+        source, params = history_filter(args.search, args.country, args.date_from, args.date_to, args.network)
+        order = "match_id DESC" if args.search and args.search.strip() else "timestamp DESC"
+        rows = conn.execute(
+            f"SELECT {', '.join(columns)}{source} ORDER BY {order} LIMIT ?",
+            (*params, args.limit)
+        ).fetchall()
+    conn.close()
+
+    if args.format == "jsonl":
+        for row in rows:
+            print(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+    elif args.format == "csv":
+        writer = csv.writer(sys.stdout)
+        writer.writerow(headers)
+        writer.writerows(rows)
+    else:
+        for row in rows:
+            print("\t".join(str(value) for value in row))
+    return 0
+
+
+def cmd_ingest(args):
+    """Count and geolocate the client IPs of an access log"""
+    db_path = Path(args.db)
+    open_history_db(db_path).close()
+    write_failures = []
+    writer = HistoryWriter(db_path, on_error=write_failures.append)
+    writer.start()
+    cache = offline_db = None
+    if args.offline:
+        offline_db = OfflineGeoDB(db_path.parent / "ranges.bin")
+    elif not args.no_cache:
+        cache = LookupCache(db_path)
+
+    job = LogIngestJob(args.log, writer, cache=cache, offline_db=offline_db, field=args.field,
+                       lookup=not args.no_lookup, top=args.top, workers=args.jobs)
+    job.start()
+    try:
+        while True:
+            kind, *payload = job.progress_queue.get()
+            if kind == "progress" and sys.stderr.isatty():
+                print(f"\rRead {payload[2]} lines ({payload[0] * 100 // max(payload[1], 1)}%)",
+                      end="", file=sys.stderr, flush=True)
+            elif kind == "lookup" and sys.stderr.isatty():
+                print(f"\rLooked up {payload[0]}/{payload[1]} IPs", end="", file=sys.stderr, flush=True)
+            elif kind in ("done", "error", "cancelled"):
+                break
+    except KeyboardInterrupt:
+        job.cancel()
+        job.thread.join()
+        raise
+    finally:
+        if sys.stderr.isatty():
+            print(file=sys.stderr)
+        writer.stop()
+        if offline_db is not None:
+            offline_db.close()
+
+    write_failed = report_write_failures(write_failures)
+    if kind == "error":
+        print(f"Ingestion failed: {payload[0]}", file=sys.stderr)
+        return 1
+    report = payload[0]
+    if args.format == "jsonl":
+        for ip_address, hits, country, city in report['top_ips']:
+            print(json.dumps({"ip": ip_address, "hits": hits, "country": country, "city": city}, ensure_ascii=False))
+    elif args.format == "csv":
+        writer = csv.writer(sys.stdout)
+        writer.writerow(["IP Address", "Hits", "Country", "City"])
+        writer.writerows(report['top_ips'])
+    else:
+        print(format_log_report(report))
+    return 1 if write_failed else 0
+
+
+def cmd_compact(args):
+    """Roll up old history, apply retention and give free space back"""
+    conn = open_history_db(args.db)
+    result = maintain_history(conn, args.after, args.keep, args.max_rows, convert=args.convert)
+    conn.close()
+    print(f"Compacted {result['compacted']} rows, expired {result['expired']} records and freed "
+          f"{result['freed_pages']} pages in {result['seconds']:.1f}s", file=sys.stderr)
+    return 0
+
+
+def cmd_stats(args):
+    """Print lookup counts per country or city"""
+    conn = open_history_db(args.db)
+    if args.by == "city":
+        headers = ["Country", "City", "Lookups"]
+        rows = city_counts(conn, args.date_from, args.date_to, args.limit)
+    else:
+        headers = ["Country", "Lookups"]
+        rows = country_counts(conn, args.date_from, args.date_to, args.limit)
+    conn.close()
+
+    if args.format == "jsonl":
+        keys = [header.lower() for header in headers]
+        for row in rows:
+            print(json.dumps(dict(zip(keys, row)), ensure_ascii=False))
+    elif args.format == "csv":
+        writer = csv.writer(sys.stdout)
+        writer.writerow(headers)
+        writer.writerows(rows)
+    else:
+        for row in rows:
+            print("\t".join(str(value) for value in row))
+    return 0
+
+
+def cmd_export(args):
+    """Export history to a file"""
+    job = HistoryExportJob(
+        Path(args.db), args.path, EXPORT_FORMAT_NAMES[args.format],
+        date_from=args.date_from, date_to=args.date_to, country=args.country
+    )
+    job.run()
+    while True:
+        kind, *payload = job.progress_queue.get()
+        if kind == "done":
+            print(f"History exported to {payload[0]}", file=sys.stderr)
+            return 0
+        if kind == "error":
+            print(f"Export failed: {payload[0]}", file=sys.stderr)
+            return 1
+
+
+def cmd_import_ranges(args):
+    """Build the offline range database from a CSV"""
+    count = OfflineGeoDB.build(args.csv, Path(args.db).parent / "ranges.bin")
+    print(f"Imported {count} IPv4 ranges (the offline database does not cover IPv6)", file=sys.stderr)
+    return 0
+
+
+def cmd_serve(args):
+    """Serve lookups and history to local clients until interrupted"""
+    db_path = Path(args.db)
+    open_history_db(db_path).close()
+    writer = offline_db = None
+    if not args.no_history:
+        writer = HistoryWriter(db_path)
+        writer.start()
+    if args.offline:
+        offline_db = OfflineGeoDB(db_path.parent / "ranges.bin")
+    engine = LookupEngine(cache=LookupCache(db_path), offline_db=offline_db,
+                          providers=ProviderPool.from_names(args.providers))
+    server = ApiServer(args.port, engine, db_path, writer, host=args.host)
+    print(f"Serving the IP Tracker API on {server.url}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    finally:
+        server.stop()
+        engine.shutdown()
+        if writer is not None:
+            writer.stop()
+        if offline_db is not None:
+            offline_db.close()
+
+
+def provider_names(value):
+    """argparse type for a comma-separated list of lookup providers"""
+    names = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = [name for name in names if name not in PROVIDERS]
+    if unknown or not names:
+        raise argparse.ArgumentTypeError(f"invalid provider list {value!r} (choose from {', '.join(PROVIDERS)})")
+    return names
+
+
+def cmd_gui(args):
+    """Launch the desktop application"""
+    import IPTracker
+    IPTracker.main(profile_startup=getattr(args, "profile_startup", False) or None)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="iptracker", description="Geolocate IP addresses")
+    parser.add_argument("--db", default=str(DEFAULT_DB_PATH), help="history database path")
+    parser.set_defaults(func=cmd_gui)
+    commands = parser.add_subparsers(title="commands")
+
+    lookup = commands.add_parser("lookup", help="look up one or more IP addresses")
+    lookup.add_argument("ip", nargs="*", help="IP addresses to look up")
+    lookup.add_argument("-f", "--file", help="read IP addresses from a file ('-' for stdin)")
+    lookup.add_argument("-j", "--jobs", type=int, default=BATCH_WORKERS,
+                        help="batch requests sent concurrently")
+    lookup.add_argument("--format", choices=["text", "json", "jsonl", "csv"], default="text")
+    lookup.add_argument("--offline", action="store_true", help="use the imported offline range database")
+    lookup.add_argument("--no-cache", action="store_true", help="bypass the lookup cache")
+    lookup.add_argument("--no-history", action="store_true", help="do not record results in history")
+    lookup.add_argument("--enrich", action="store_true", help="add reverse DNS, ASN and prefix to each result")
+    lookup.add_argument("--dns-server", help="resolver for --enrich as host[:port] (default: system nameserver)")
+    lookup.set_defaults(func=cmd_lookup)
+
+    history = commands.add_parser("history", help="show recent lookups")
+    history.add_argument("-n", "--limit", type=int, default=20)
+    history.add_argument("-s", "--search", help="only show rows matching this text (IP, place, ISP or organization)")
+    history.add_argument("--country", help="only show this country")
+    history.add_argument("--from", dest="date_from", help="first day to include (YYYY-MM-DD)")
+    history.add_argument("--to", dest="date_to", help="first day to exclude (YYYY-MM-DD)")
+    history.add_argument("--network", help="only show addresses in this CIDR block")
+    history.add_argument("--compacted", action="store_true",
+                         help="show rolled-up records (address, place, first and last seen, count)")
+    history.add_argument("--format", choices=["text", "jsonl", "csv"], default="text")
+    history.set_defaults(func=cmd_history)
+
+    stats = commands.add_parser("stats", help="show lookup counts per country or city")
+    stats.add_argument("--by", choices=["country", "city"], default="country")
+    stats.add_argument("--from", dest="date_from", help="first day to include (YYYY-MM-DD)")
+    stats.add_argument("--to", dest="date_to", help="first day to exclude (YYYY-MM-DD)")
+    stats.add_argument("-n", "--limit", type=int, default=20)
+    stats.add_argument("--format", choices=["text", "jsonl", "csv"], default="text")
+    stats.set_defaults(func=cmd_stats)
+
+    export = commands.add_parser("export", help="export history to a file")
+    export.add_argument("path")
+    export.add_argument("--format", choices=list(EXPORT_FORMAT_NAMES), default="csv")
+    export.add_argument("--from", dest="date_from", help="first day to include (YYYY-MM-DD)")
+    export.add_argument("--to", dest="date_to", help="first day to exclude (YYYY-MM-DD)")
+    export.add_argument("--country", help="only export this country")
+    export.set_defaults(func=cmd_export)
+
+    ingest = commands.add_parser("ingest", help="count and geolocate the client IPs of an access log")
+    ingest.add_argument("log", help="access log, plain or gzipped")
+    ingest.add_argument("--field", type=int, default=0,
+                        help="whitespace-separated column holding the client IP (default: 0, as in nginx and Apache)")
+    ingest.add_argument("--top", type=int, default=LOG_TOP_IPS, help="busiest IPs to list")
+    ingest.add_argument("-j", "--jobs", type=int, default=BATCH_WORKERS,
+                        help="batch requests sent concurrently")
+    ingest.add_argument("--format", choices=["text", "jsonl", "csv"], default="text")
+    ingest.add_argument("--offline", action="store_true", help="use the imported offline range database")
+    ingest.add_argument("--no-cache", action="store_true", help="bypass the lookup cache")
+    ingest.add_argument("--no-lookup", action="store_true", help="only count hits, do not geolocate")
+    ingest.set_defaults(func=cmd_ingest)
+
+    compact = commands.add_parser("compact", help="roll up old history and apply retention")
+    compact.add_argument("--after", type=int, default=COMPACT_AFTER_DAYS,
+                         help="roll up rows older than this many days (0: never)")
+    compact.add_argument("--keep", type=int, default=RETENTION_DAYS,
+                         help="delete history not seen for this many days (0: keep everything)")
+    compact.add_argument("--max-rows", type=int, default=MAX_HISTORY_ROWS,
+                         help="roll up the oldest rows beyond this count (0: no limit)")
+    compact.add_argument("--convert", action="store_true",
+                         help="let an older database give free space back to the disk (one full VACUUM)")
+    compact.set_defaults(func=cmd_compact)
+
+    import_ranges = commands.add_parser("import-ranges", help="build the offline IPv4 database from a CSV")
+    import_ranges.add_argument("csv", help="rows of start, end, country, city, lat, lon; IPv6 rows are skipped")
+    import_ranges.set_defaults(func=cmd_import_ranges)
+
+    serve = commands.add_parser("serve", help="serve lookups and history over a local HTTP/JSON API")
+    serve.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    serve.add_argument("-p", "--port", type=int, default=API_PORT)
+    serve.add_argument("--offline", action="store_true", help="use the imported offline range database")
+    serve.add_argument("--no-history", action="store_true", help="do not record results in history")
+    serve.add_argument("--providers", type=provider_names, default=DEFAULT_PROVIDERS,
+                       help=f"lookup providers in rotation order, comma-separated "
+                            f"(default: {','.join(DEFAULT_PROVIDERS)}; known: {','.join(PROVIDERS)})")
+    serve.set_defaults(func=cmd_serve)
+
+    gui = commands.add_parser("gui", help="launch the desktop application")
+    gui.add_argument("--profile-startup", action="store_true",
+                     help="report where startup time goes on stderr and in the log")
+    gui.set_defaults(func=cmd_gui)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.func is not cmd_gui:
+        # The GUI sets up its own log file
+        logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+    try:
+        return args.func(args)
+    except KeyboardInterrupt:
+        return 130
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,3145 @@
+"""GUI-free IP Tracker core: lookups, validation, caching and history storage
+
+Nothing in this module imports Qt, and the HTTP client is only imported
+when a network lookup is actually made, so scripts and the command line
+interface start quickly and run without a display.
+"""
+import os
+import re
+import csv
+import gzip
+import json
+import time
+import bisect
+import heapq
+import mmap
+import queue
+import struct
+import sqlite3
+import logging
+import threading
+import ipaddress
+import zlib
+import random
+import socket
+import contextlib
+import itertools
+import urllib.parse
+from collections import Counter, OrderedDict, deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+# Lookup service (override to point at a local stand-in server)
+API_URL = os.environ.get("IPTRACKER_API_URL", "http://ip-api.com").rstrip("/")
+LOOKUP_TIMEOUT = 5  # seconds
+LOOKUP_WORKERS = 8  # concurrent single lookups
+
+# ip-api free tier quotas, per RATE_LIMIT_PERIOD seconds
+RATE_LIMIT_SINGLE = 45
+RATE_LIMIT_BATCH = 15
+RATE_LIMIT_PERIOD = 60
+RATE_LIMIT_RETRIES = 3
+
+# Geolocation providers, hedging and circuit breaking
+DEFAULT_PROVIDERS = ["ip-api"]  # rotation order; the first is the primary. See PROVIDERS for the others
+HEDGE_PERCENTILE = 0.95  # a second provider is asked once the primary is slower than this share of its answers
+HEDGE_MIN_SAMPLES = 20  # answers needed before the learned latency is trusted
+HEDGE_DEFAULT_DELAY = 1.0  # seconds to wait before hedging until then
+PROVIDER_LATENCY_WINDOW = 200  # recent answer times kept per provider
+BREAKER_FAILURES = 5  # consecutive failures that take a provider out of rotation
+BREAKER_COOLDOWN = 30  # seconds before a tripped provider is tried again
+
+# Enrichment: reverse DNS and ASN/prefix lookups run next to geolocation
+DNS_SERVER = os.environ.get("IPTRACKER_DNS_SERVER", "")  # host[:port]; empty uses the system nameserver
+DEFAULT_DNS_SERVER = "1.1.1.1"  # used when no system nameserver can be found
+ENRICH_STAGES = ("ptr", "asn")
+ENRICH_TIMEOUTS = {"ptr": 2.0, "asn": 3.0}  # seconds per stage
+ENRICH_WORKERS = 16
+
+# Scheduling priorities, lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_REFRESH = 1
+PRIORITY_BULK = 2
+DEFAULT_DB_PATH = Path.home() / ".ip_tracker" / "history.db"
+BATCH_SIZE = 100  # ip-api accepts at most 100 queries per /batch request
+BATCH_WORKERS = 4
+CACHE_SIZE = 1000  # entries kept in memory
+CACHE_TTL = 24  # hours
+WRITE_BATCH_SIZE = 500  # rows per history transaction
+WRITE_FLUSH_INTERVAL = 0.05  # seconds to wait for more rows before committing
+WRITE_RETRIES = 3  # further attempts at a history batch that failed, e.g. on a locked database
+WRITE_RETRY_DELAY = 0.1  # seconds before the first retry, doubled for each one after
+WATCH_MIN_INTERVAL = 60  # seconds
+WATCH_FIELDS = ("country", "city", "lat", "lon", "isp", "org")  # compared between watchlist checks
+LOCATION_FIELDS = ("countryCode", "city", "asn")  # normalized alike by every provider, see location_changes()
+
+# History maintenance: old rows are rolled up per address and location, then expired.
+# All off by default: rolled-up rows leave the History tab, search and export.
+COMPACT_AFTER_DAYS = 0  # raw rows older than this are rolled up; 0 keeps them
+RETENTION_DAYS = 0  # history, rollups and analytics older than this are deleted; 0 keeps everything
+MAX_HISTORY_ROWS = 0  # raw rows beyond this are rolled up oldest first; 0 for no limit
+COMPACT_BATCH_SIZE = 10_000  # rows per compaction transaction
+VACUUM_STEP_PAGES = 2000  # free pages handed back to the file system per transaction
+MAINTENANCE_INTERVAL = 6 * 3600  # seconds between background maintenance runs in the GUI
+
+# Access log ingestion
+LOG_READ_SIZE = 4 * 1024 * 1024  # bytes parsed per block
+LOG_TOP_IPS = 20  # busiest addresses listed in a report
+
+# Local API server
+API_PORT = 8770  # default port of `iptracker serve`
+API_LOOKUP_TIMEOUT = 30  # seconds a /json request waits for the engine
+API_BATCH_LIMIT = 10_000  # addresses accepted per /batch request
+API_HISTORY_LIMIT = 1000  # rows returned per /history request
+API_QUOTA = 1_000_000  # X-Rl sent to clients; throttling happens in the server's shared engine
+
+# Instrumentation
+STAGES = ("queue", "connect", "http", "parse", "db_write", "ui_update", "lookup", "ptr", "asn")
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # seconds
+LOG_FILE = "ip_tracker.log"
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+
+HISTORY_INSERT = '''
+    INSERT INTO history (ip_address, country, city, latitude, longitude, isp, org, timestamp, response, ip_packed)
+    VALUES (?1, ?2, ?3, ?4, ?5, ?6, ?7, ?8, ?9, pack_ip(?1))
+'''
+
+# Full responses are stored as raw deflate primed with RESPONSE_DICTIONARY, behind a format byte.
+# The dictionary must never change once rows use it; a new one needs a new format byte.
+RESPONSE_FORMAT = 1
+RESPONSE_DICTIONARY = (
+    b'"status":"fail","message":"private range","message":"reserved range","message":"invalid query",'
+    b'"countryCode":"US","countryCode":"DE","countryCode":"GB","countryCode":"CN","countryCode":"IR",'
+    b'"timezone":"America/New_York","timezone":"America/Los_Angeles","timezone":"America/Chicago",'
+    b'"timezone":"Europe/London","timezone":"Europe/Berlin","timezone":"Europe/Paris",'
+    b'"timezone":"Europe/Amsterdam","timezone":"Europe/Moscow","timezone":"Asia/Shanghai",'
+    b'"timezone":"Asia/Tokyo","timezone":"Asia/Tehran","timezone":"Asia/Kolkata","timezone":"Asia/Singapore",'
+    b'"timezone":"Australia/Sydney", Communications Inc." Telecommunication Company Telecom Networks Network'
+    b' Limited Ltd." Corporation Internet Services Hosting Cloud GmbH LLC" LLC"," Inc.",'
+    # The skeleton of a success response goes last, where matches are cheapest to encode
+    b'{"status":"success","country":"United States","countryCode":"","region":"","regionName":"","city":"",'
+    b'"zip":"","lat":,"lon":,"timezone":"America/","timezone":"Europe/","timezone":"Asia/","isp":"","org":"",'
+    b'"as":"AS","query":"'
+)
+RESPONSE_LABELS = {
+    'countryCode': "Country Code",
+    'region': "Region Code",
+    'regionName': "Region",
+    'zip': "ZIP",
+    'as': "AS",
+    'provider': "Provider",
+}
+
+EXPORT_BATCH_SIZE = 5000  # rows fetched per fetchmany() during export
+EXPORT_FORMATS = {
+    "CSV": ".csv",
+    "CSV (gzip)": ".csv.gz",
+    "JSON Lines": ".jsonl",
+    "Parquet": ".parquet",
+}
+HISTORY_COLUMNS = ["ip_address", "country", "city", "latitude", "longitude", "isp", "org", "timestamp"]
+HISTORY_HEADERS = ["IP Address", "Country", "City", "Latitude", "Longitude", "ISP", "Organization", "Timestamp"]
+ROLLUP_COLUMNS = ["ip_address", "country", "city", "isp", "org", "first_seen", "last_seen", "count"]
+ROLLUP_HEADERS = ["IP Address", "Country", "City", "ISP", "Organization", "First Seen", "Last Seen", "Lookups"]
+GRID_DEGREES = 0.5  # heatmap cell size; changing it needs the stats_grid table rebuilt
+GRID_ROWS = int(180 / GRID_DEGREES)
+GRID_COLUMNS = int(360 / GRID_DEGREES)
+
+
+def _stats_delete_trigger(condition):
+    """Trigger taking deleted history rows out of the per-day stats tables"""
+    return f'''CREATE TRIGGER IF NOT EXISTS history_stats_delete AFTER DELETE ON history
+        WHEN {condition}
+        BEGIN
+            UPDATE stats_country SET lookups = lookups - 1
+                WHERE day = substr(OLD.timestamp, 1, 10) AND country = COALESCE(OLD.country, '');
+            DELETE FROM stats_country
+                WHERE day = substr(OLD.timestamp, 1, 10) AND country = COALESCE(OLD.country, '')
+                AND lookups <= 0;
+            UPDATE stats_city SET lookups = lookups - 1
+                WHERE day = substr(OLD.timestamp, 1, 10) AND country = COALESCE(OLD.country, '')
+                AND city = COALESCE(OLD.city, '');
+            DELETE FROM stats_city
+                WHERE day = substr(OLD.timestamp, 1, 10) AND country = COALESCE(OLD.country, '')
+                AND city = COALESCE(OLD.city, '') AND lookups <= 0;
+            UPDATE stats_grid SET lookups = lookups - 1
+                WHERE day = substr(OLD.timestamp, 1, 10)
+                AND lat_bin = CAST((OLD.latitude + 90) / {GRID_DEGREES} AS INTEGER)
+                AND lon_bin = CAST((OLD.longitude + 180) / {GRID_DEGREES} AS INTEGER);
+            DELETE FROM stats_grid
+                WHERE day = substr(OLD.timestamp, 1, 10)
+                AND lat_bin = CAST((OLD.latitude + 90) / {GRID_DEGREES} AS INTEGER)
+                AND lon_bin = CAST((OLD.longitude + 180) / {GRID_DEGREES} AS INTEGER) AND lookups <= 0;
+        END'''
+
+
+# Schema migrations, applied in order and tracked with PRAGMA user_version
+MIGRATIONS = [
+    [
+        "CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_history_ip_address ON history (ip_address)",
+    ],
+    [
+        "ALTER TABLE history ADD COLUMN ip_packed BLOB",
+        "UPDATE history SET ip_packed = pack_ip(ip_address)",
+        "CREATE INDEX IF NOT EXISTS idx_history_ip_packed ON history (ip_packed)",
+    ],
+    [
+        '''CREATE TABLE IF NOT EXISTS watchlist (
+            ip_address TEXT PRIMARY KEY,
+            interval INTEGER NOT NULL,
+            last_checked REAL,
+            last_result TEXT
+        )''',
+    ],
+    [
+        # Per-day lookup counts kept current by triggers, so analytics never scan history
+        "CREATE TABLE IF NOT EXISTS stats_country (day TEXT NOT NULL, country TEXT NOT NULL, "
+        "lookups INTEGER NOT NULL, PRIMARY KEY (day, country)) WITHOUT ROWID",
+        "CREATE TABLE IF NOT EXISTS stats_city (day TEXT NOT NULL, country TEXT NOT NULL, city TEXT NOT NULL, "
+        "lookups INTEGER NOT NULL, PRIMARY KEY (day, country, city)) WITHOUT ROWID",
+        "CREATE TABLE IF NOT EXISTS stats_grid (day TEXT NOT NULL, lat_bin INTEGER NOT NULL, "
+        "lon_bin INTEGER NOT NULL, lookups INTEGER NOT NULL, PRIMARY KEY (day, lat_bin, lon_bin)) WITHOUT ROWID",
+        '''INSERT INTO stats_country (day, country, lookups)
+            SELECT substr(timestamp, 1, 10), COALESCE(country, ''), COUNT(*) FROM history
+            WHERE timestamp IS NOT NULL GROUP BY 1, 2''',
+        '''INSERT INTO stats_city (day, country, city, lookups)
+            SELECT substr(timestamp, 1, 10), COALESCE(country, ''), COALESCE(city, ''), COUNT(*) FROM history
+            WHERE timestamp IS NOT NULL GROUP BY 1, 2, 3''',
+        f'''INSERT INTO stats_grid (day, lat_bin, lon_bin, lookups)
+            SELECT substr(timestamp, 1, 10), CAST((latitude + 90) / {GRID_DEGREES} AS INTEGER),
+                   CAST((longitude + 180) / {GRID_DEGREES} AS INTEGER), COUNT(*) FROM history
+            WHERE timestamp IS NOT NULL AND latitude IS NOT NULL AND longitude IS NOT NULL
+            GROUP BY 1, 2, 3''',
+        f'''CREATE TRIGGER IF NOT EXISTS history_stats_insert AFTER INSERT ON history
+            WHEN NEW.timestamp IS NOT NULL
+            BEGIN
+                INSERT INTO stats_country (day, country, lookups)
+                    VALUES (substr(NEW.timestamp, 1, 10), COALESCE(NEW.country, ''), 1)
+                    ON CONFLICT (day, country) DO UPDATE SET lookups = lookups + 1;
+                INSERT INTO stats_city (day, country, city, lookups)
+                    VALUES (substr(NEW.timestamp, 1, 10), COALESCE(NEW.country, ''), COALESCE(NEW.city, ''), 1)
+                    ON CONFLICT (day, country, city) DO UPDATE SET lookups = lookups + 1;
+                INSERT INTO stats_grid (day, lat_bin, lon_bin, lookups)
+                    SELECT substr(NEW.timestamp, 1, 10), CAST((NEW.latitude + 90) / {GRID_DEGREES} AS INTEGER),
+                           CAST((NEW.longitude + 180) / {GRID_DEGREES} AS INTEGER), 1
+                    WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL
+                    ON CONFLICT (day, lat_bin, lon_bin) DO UPDATE SET lookups = lookups + 1;
+            END''',
+        _stats_delete_trigger("OLD.timestamp IS NOT NULL"),
+    ],
+    [
+        # ISP and organization for search, and an external-content FTS5 index over the text fields.
+        # '.' and ':' are token characters so a partial address matches as a prefix, and
+        # prefix indexes keep short, common prefixes from merging huge doclists while typing.
+        "ALTER TABLE history ADD COLUMN isp TEXT",
+        "ALTER TABLE history ADD COLUMN org TEXT",
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+            ip_address, country, city, isp, org,
+            content='history', content_rowid='id', tokenize="unicode61 tokenchars '.:'", prefix='2 3 4'
+        )''',
+        "INSERT INTO history_fts (history_fts) VALUES ('rebuild')",
+        '''CREATE TRIGGER IF NOT EXISTS history_fts_insert AFTER INSERT ON history BEGIN
+            INSERT INTO history_fts (rowid, ip_address, country, city, isp, org)
+                VALUES (NEW.id, NEW.ip_address, NEW.country, NEW.city, NEW.isp, NEW.org);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS history_fts_delete AFTER DELETE ON history BEGIN
+            INSERT INTO history_fts (history_fts, rowid, ip_address, country, city, isp, org)
+                VALUES ('delete', OLD.id, OLD.ip_address, OLD.country, OLD.city, OLD.isp, OLD.org);
+        END''',
+        "CREATE INDEX IF NOT EXISTS idx_history_country ON history (country, timestamp)",
+    ],
+    [
+        # One record per address and location for compacted history. Rows deleted while
+        # history_compacting holds a row stay counted in the stats tables.
+        '''CREATE TABLE IF NOT EXISTS history_rollup (
+            ip_address TEXT NOT NULL,
+            country TEXT NOT NULL,
+            city TEXT NOT NULL,
+            isp TEXT NOT NULL,
+            org TEXT NOT NULL,
+            latitude REAL,
+            longitude REAL,
+            first_seen TEXT NOT NULL,
+            last_seen TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            ip_packed BLOB,
+            PRIMARY KEY (ip_address, country, city, isp, org)
+        ) WITHOUT ROWID''',
+        "CREATE INDEX IF NOT EXISTS idx_history_rollup_last_seen ON history_rollup (last_seen)",
+        "CREATE INDEX IF NOT EXISTS idx_history_rollup_ip_packed ON history_rollup (ip_packed)",
+        "CREATE TABLE IF NOT EXISTS history_compacting (active INTEGER)",
+        "DROP TRIGGER IF EXISTS history_stats_delete",
+        _stats_delete_trigger("OLD.timestamp IS NOT NULL AND NOT EXISTS (SELECT 1 FROM history_compacting)"),
+    ],
+    [
+        # Hit counts per client address for each ingested access log
+        '''CREATE TABLE IF NOT EXISTS log_imports (
+            id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL,
+            imported_at TEXT NOT NULL,
+            lines INTEGER NOT NULL,
+            matched INTEGER NOT NULL,
+            unique_ips INTEGER NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS log_hits (
+            import_id INTEGER NOT NULL REFERENCES log_imports (id),
+            ip_address TEXT NOT NULL,
+            country TEXT,
+            city TEXT,
+            hits INTEGER NOT NULL,
+            PRIMARY KEY (import_id, ip_address)
+        ) WITHOUT ROWID''',
+    ],
+    [
+        # Full lookup response, written by pack_response()
+        "ALTER TABLE history ADD COLUMN response BLOB",
+    ],
+    [
+        # The History tab pages by (sort key, id) and an index ends in the rowid, so every page
+        # is an index range. Columns that may hold NULL sort as '', which a page bound can match.
+        "CREATE INDEX IF NOT EXISTS idx_history_sort_country ON history (ifnull(country, ''))",
+        "CREATE INDEX IF NOT EXISTS idx_history_sort_city ON history (ifnull(city, ''))",
+        "CREATE INDEX IF NOT EXISTS idx_history_sort_latitude ON history (ifnull(latitude, ''))",
+        "CREATE INDEX IF NOT EXISTS idx_history_sort_longitude ON history (ifnull(longitude, ''))",
+        "CREATE INDEX IF NOT EXISTS idx_history_sort_isp ON history (ifnull(isp, ''))",
+        "CREATE INDEX IF NOT EXISTS idx_history_sort_org ON history (ifnull(org, ''))",
+    ],
+]
+
+
+class Histogram:
+    """Fixed-bucket latency histogram in the Prometheus layout"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside its bucket"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                low = self.buckets[index - 1] if index else 0.0
+                if index == len(self.buckets):
+                    return low
+                return low + (self.buckets[index] - low) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+class Metrics:
+    """Thread-safe registry of stage histograms, counters and gauges
+
+    Stages are the parts of a lookup listed in STAGES. Counters are keyed by
+    name and labels; gauges are callables read when metrics are rendered.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        """Record the duration of one stage"""
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        """Time the body of a with block as one stage"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def register_gauge(self, name, read, help_text=""):
+        """Expose the value returned by read() as a gauge"""
+        with self.lock:
+            self.gauges[name] = (read, help_text)
+
+    def reset(self):
+        """Forget every histogram and counter; gauges stay registered"""
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def summary(self):
+        """Per-stage count, mean and percentiles in seconds, in STAGES order"""
+        with self.lock:
+            histograms = dict(self.histograms)
+            rows = []
+            for stage in sorted(histograms, key=lambda name: (STAGES + (name,)).index(name)):
+                histogram = histograms[stage]
+                rows.append({
+                    'stage': stage,
+                    'count': histogram.count,
+                    'mean': histogram.sum / histogram.count if histogram.count else None,
+                    'p50': histogram.quantile(0.50),
+                    'p95': histogram.quantile(0.95),
+                    'p99': histogram.quantile(0.99),
+                })
+            return rows
+
+    def prometheus_text(self):
+        """Render everything in the Prometheus text exposition format"""
+        lines = [
+            "# HELP iptracker_stage_seconds Time spent in each lookup stage",
+            "# TYPE iptracker_stage_seconds histogram",
+        ]
+        with self.lock:
+            for stage, histogram in self.histograms.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f'iptracker_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'iptracker_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'iptracker_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+
+            names = sorted({name for name, _ in self.counters})
+            for name in names:
+                lines.append(f"# TYPE iptracker_{name} counter")
+                for (counter_name, labels), value in sorted(self.counters.items()):
+                    if counter_name == name:
+                        label_text = ",".join(f'{key}="{label}"' for key, label in labels)
+                        lines.append(f"iptracker_{name}{{{label_text}}} {value}" if labels
+                                     else f"iptracker_{name} {value}")
+            gauges = dict(self.gauges)
+
+        for name, (read, help_text) in sorted(gauges.items()):
+            try:
+                value = read()
+            except Exception:
+                continue
+            if help_text:
+                lines.append(f"# HELP iptracker_{name} {help_text}")
+            lines.append(f"# TYPE iptracker_{name} gauge")
+            lines.append(f"iptracker_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide metrics shared by the lookup engine, writer and GUI
+METRICS = Metrics()
+_stage_local = threading.local()
+
+
+def _http_server(address, handler, owner, request_queue_size=5):
+    """Bind a daemon-threaded HTTP server whose handlers reach owner as self.server.owner
+
+    http.server is imported on first use rather than with this module, which
+    would add a third to the CLI's start-up time for a server few runs start.
+    """
+    from http.server import ThreadingHTTPServer
+    server = ThreadingHTTPServer(address, handler, bind_and_activate=False)
+    server.daemon_threads = True
+    server.request_queue_size = request_queue_size
+    server.owner = owner
+    try:
+        server.server_bind()
+        server.server_activate()
+    except OSError:
+        server.server_close()
+        raise
+    return server
+
+
+class MetricsServer:
+    """Local HTTP endpoint serving METRICS at /metrics for Prometheus to scrape"""
+
+    def __init__(self, port, metrics=METRICS, host="127.0.0.1"):
+        self.metrics = metrics
+        self.httpd = _http_server((host, port), _metrics_handler(), self)
+
+    @property
+    def server_address(self):
+        return self.httpd.server_address
+
+    def start(self):
+        """Serve from a daemon thread"""
+        threading.Thread(target=self.httpd.serve_forever, name="metrics-server", daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _metrics_handler():
+    """Request handler class for MetricsServer"""
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = self.server.owner.metrics.prometheus_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return MetricsHandler
+
+
+class JsonLogFormatter(logging.Formatter):
+    """Format each record as one JSON object, keeping fields passed through extra="""
+
+    RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in self.RESERVED:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(log_path=LOG_FILE, level=logging.INFO, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT):
+    """Send log records through a queue to a rotating JSON lines file
+
+    Callers only pay for putting the record on a queue; formatting and disk
+    writes happen on the listener thread. Returns the started
+    QueueListener, which should be stopped at exit to flush the queue.
+    """
+    import logging.handlers
+    log_queue = queue.SimpleQueue()
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+    file_handler.setFormatter(JsonLogFormatter())
+    listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+    listener.start()
+    return listener
+
+
+def validate_ip(ip_address):
+    """Validate IPv4 or IPv6 address format"""
+    try:
+        ipaddress.ip_address(ip_address)
+    except ValueError:
+        return False
+    return True
+
+
+def pack_ip(ip_address):
+    """Pack an address into 16 bytes that sort in address order
+
+    IPv4 addresses are stored in their IPv4-mapped IPv6 form so both
+    families share one index.
+    """
+    address = ipaddress.ip_address(ip_address)
+    if address.version == 4:
+        return b'\x00' * 10 + b'\xff\xff' + address.packed
+    return address.packed
+
+
+def _sql_pack_ip(ip_address):
+    try:
+        return pack_ip(ip_address)
+    except (TypeError, ValueError):
+        return None
+
+
+def network_range(network):
+    """Return the (low, high) packed bounds of an address or CIDR block"""
+    network = ipaddress.ip_network(network.strip(), strict=False)
+    return pack_ip(network.network_address), pack_ip(network.broadcast_address)
+
+
+def parse_ip_list(text):
+    """Split pasted or file text into unique valid IPs; returns (ip_addresses, skipped)"""
+    ip_addresses = []
+    skipped = 0
+    for token in re.split(r'[\s,;]+', text):
+        if not token:
+            continue
+        if validate_ip(token):
+            ip_addresses.append(token)
+        else:
+            skipped += 1
+    return list(dict.fromkeys(ip_addresses)), skipped
+
+
+def create_session(pool_size=LOOKUP_WORKERS):
+    """Create a keep-alive HTTP session sized for pool_size concurrent requests
+
+    New connections are timed, so the connect stage is only recorded when
+    keep-alive could not reuse one.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    class TimedAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                scheme: _timed_pool(pool_class)
+                for scheme, pool_class in self.poolmanager.pool_classes_by_scheme.items()
+            }
+
+    session = requests.Session()
+    adapter = TimedAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _timed_pool(pool_class):
+    """Subclass a urllib3 connection pool so connect() reports its duration"""
+    class TimedConnection(pool_class.ConnectionCls):
+        def connect(self):
+            started = time.perf_counter()
+            try:
+                super().connect()
+            finally:
+                elapsed = time.perf_counter() - started
+                _stage_local.connect = getattr(_stage_local, 'connect', 0.0) + elapsed
+                METRICS.observe("connect", elapsed)
+
+    return type(f"Timed{pool_class.__name__}", (pool_class,), {'ConnectionCls': TimedConnection})
+
+
+def fetch_ip(ip_address, cache=None, offline_db=None, api_url=API_URL, timeout=LOOKUP_TIMEOUT,
+             session=None, rate_limiter=None):
+    """Return the ip-api style response for one IP
+
+    Raises requests.RequestException on network errors and RateLimitError
+    when the service answers HTTP 429.
+    """
+    if offline_db is not None:
+        return offline_db.lookup(ip_address)
+    if cache is not None:
+        data = cache.get(ip_address)
+        if data is not None:
+            return data
+
+    if session is None:
+        import requests as session
+    _stage_local.connect = 0.0
+    started = time.perf_counter()
+    response = session.get(f'{api_url}/json/{ip_address}', timeout=timeout)
+    METRICS.observe("http", time.perf_counter() - started - _stage_local.connect)
+    check_rate_limit(response, rate_limiter)
+    response.raise_for_status()
+    with METRICS.timer("parse"):
+        data = response.json()
+    if cache is not None and data.get('status') == 'success':
+        cache.put(ip_address, data)
+    return data
+
+
+def check_rate_limit(response, rate_limiter=None):
+    """Feed quota headers to rate_limiter and raise RateLimitError on HTTP 429"""
+    if rate_limiter is not None:
+        rate_limiter.update(response.headers)
+    if response.status_code == 429:
+        try:
+            retry_after = int(response.headers.get('X-Ttl', RATE_LIMIT_PERIOD))
+        except ValueError:
+            retry_after = RATE_LIMIT_PERIOD
+        if rate_limiter is not None:
+            rate_limiter.block(retry_after)
+        raise RateLimitError(retry_after)
+
+
+def format_result(ip_address, data):
+    """Render a successful response the way the lookup tab shows it"""
+    return (
+        f"IP: {ip_address}\n"
+        f"Country: {data['country']}\n"
+        f"City: {data['city']}\n"
+        f"Latitude: {data['lat']}\n"
+        f"Longitude: {data['lon']}\n"
+        f"ISP: {data.get('isp', 'N/A')}\n"
+        f"Organization: {data.get('org', 'N/A')}\n"
+        f"Timezone: {data.get('timezone', 'N/A')}"
+    )
+
+
+def format_response(ip_address, data, timestamp=None):
+    """Render every field of a stored response: the lookup tab's lines, then the rest"""
+    lines = [format_result(ip_address, data)]
+    shown = {'status', 'query', 'country', 'city', 'lat', 'lon', 'isp', 'org', 'timezone'}
+    for key, value in data.items():
+        if key not in shown and value not in (None, ""):
+            lines.append(f"{RESPONSE_LABELS.get(key, key)}: {value}")
+    if timestamp:
+        lines.append(f"Looked up: {timestamp}")
+    return "\n".join(lines)
+
+
+def pack_response(data):
+    """Compress a lookup response for the history response column (about a third of its JSON)"""
+    text = json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode()
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=RESPONSE_DICTIONARY)
+    return bytes([RESPONSE_FORMAT]) + compressor.compress(text) + compressor.flush()
+
+
+def unpack_response(blob):
+    """Decode a pack_response() blob; None for rows stored before responses were kept
+
+    Raises ValueError for an unknown format or a damaged blob.
+    """
+    if not blob:
+        return None
+    if blob[0] != RESPONSE_FORMAT:
+        raise ValueError(f"Unknown response format {blob[0]}")
+    decompressor = zlib.decompressobj(-15, zdict=RESPONSE_DICTIONARY)
+    try:
+        return json.loads(decompressor.decompress(blob[1:]) + decompressor.flush())
+    except zlib.error as e:
+        raise ValueError(f"Corrupt stored response: {e}") from e
+
+
+def stored_response(conn, row_id):
+    """Decoded response stored with the history row of that id, or None if it has none"""
+    row = conn.execute("SELECT response FROM history WHERE id = ?", (row_id,)).fetchone()
+    return unpack_response(row[0]) if row else None
+
+
+def format_log_report(report):
+    """Render a LogIngestJob report as text: totals, hits per country and the busiest addresses"""
+    lines = [
+        f"Log: {report['path']}",
+        f"Lines: {report['lines']} ({report['lines_per_sec']:.0f} lines/s), "
+        f"without a client address: {report['skipped']}",
+        f"Unique IPs: {report['unique_ips']}, located: {report['located']}",
+        "",
+        "Hits by country:",
+    ]
+    lines += [f"  {country or 'Unknown'}: {hits} hits from {ips} IPs" for country, hits, ips in report['countries']]
+    lines += ["", "Top IPs:"]
+    lines += [f"  {ip_address}: {hits} hits ({', '.join(filter(None, (city, country))) or 'Unknown'})"
+              for ip_address, hits, country, city in report['top_ips']]
+    return "\n".join(lines)
+
+
+def format_enrichment(results):
+    """Render enrichment stage results; a stage still running is None or missing"""
+    def pending(result):
+        if result is None:
+            return "looking up..."
+        if result.status == "timeout":
+            return "timed out"
+        return f"error ({result.error})"
+
+    ptr = results.get("ptr")
+    if ptr is not None and ptr.status == "success":
+        lines = [f"Reverse DNS: {ptr.data.get('ptr') or 'none'}"]
+    else:
+        lines = [f"Reverse DNS: {pending(ptr)}"]
+
+    asn = results.get("asn")
+    if asn is None or asn.status != "success":
+        lines.append(f"ASN: {pending(asn)}")
+    elif asn.data.get('asn') is None:
+        lines.append("ASN: none")
+    else:
+        name = asn.data.get('as_name')
+        lines.append(f"ASN: AS{asn.data['asn']}" + (f" {name}" if name else ""))
+        lines.append(f"Prefix: {asn.data.get('prefix')}")
+    return "\n".join(lines)
+
+
+def history_row(ip_address, data, timestamp=None):
+    """Build the history tuple stored for a successful response
+
+    The values follow HISTORY_COLUMNS, then the packed response for HISTORY_INSERT.
+    """
+    timestamp = timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return (ip_address, data.get('country'), data.get('city'), data.get('lat'), data.get('lon'),
+            data.get('isp'), data.get('org'), timestamp, pack_response(data))
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 query matching every word as a prefix, or None if empty"""
+    words = text.split()
+    if not words:
+        return None
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+
+
+def history_filter(search=None, country=None, date_from=None, date_to=None, network=None, bound=None):
+    """FROM and WHERE clauses with parameters combining every history filter into one query
+
+    search is free text matched through the history_fts index, dates are
+    compared with the timestamp column (date_to is exclusive) and network is
+    a CIDR block or single address. bound is an extra (condition, params)
+    pair, such as where the previous page of a keyset-paged query ended.
+
+    A search reads matches straight from the index, which yields them by rowid
+    and exposes it as match_id. Ordering by match_id (newer lookups have higher
+    ids) lets SQLite stop after the first page instead of sorting every match.
+    """
+    source = " FROM history"
+    conditions = []
+    params = []
+    match = fts_query(search or "")
+    if match:
+        source = (" FROM (SELECT history_fts.rowid AS match_id, history.* FROM history_fts"
+                  " JOIN history ON history.id = history_fts.rowid WHERE history_fts MATCH ?) AS history")
+        params.append(match)
+    if country:
+        conditions.append("country = ?")
+        params.append(country)
+    if date_from:
+        conditions.append("timestamp >= ?")
+        params.append(date_from)
+    if date_to:
+        conditions.append("timestamp < ?")
+        params.append(date_to)
+    if network:
+        conditions.append("ip_packed BETWEEN ? AND ?")
+        params.extend(network_range(network))
+    if bound is not None:
+        conditions.append(bound[0])
+        params.extend(bound[1])
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    return source + where, params
+
+
+def compacted_history(conn, country=None, date_from=None, date_to=None, network=None, limit=20):
+    """Rollup records (in ROLLUP_COLUMNS order) matching the history filters, most recently seen first
+
+    Dates are compared with last_seen. There is no text search: the index
+    only covers rows that have not been compacted yet.
+    """
+    conditions = []
+    params = []
+    if country:
+        conditions.append("country = ?")
+        params.append(country)
+    if date_from:
+        conditions.append("last_seen >= ?")
+        params.append(date_from)
+    if date_to:
+        conditions.append("last_seen < ?")
+        params.append(date_to)
+    if network:
+        conditions.append("ip_packed BETWEEN ? AND ?")
+        params.extend(network_range(network))
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    return conn.execute(
+        f"SELECT {', '.join(ROLLUP_COLUMNS)} FROM history_rollup{where} ORDER BY last_seen DESC LIMIT ?",
+        (*params, limit)
+    ).fetchall()
+
+
+def connect_db(db_path, check_same_thread=True):
+    """Open the history database with WAL journaling and tuned pragmas"""
+    conn = sqlite3.connect(db_path, timeout=10, check_same_thread=check_same_thread)
+    conn.create_function("pack_ip", 1, _sql_pack_ip, deterministic=True)
+    # Only takes effect on a new database; older ones are converted by vacuum_history()
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-16000")
+    return conn
+
+
+def open_history_db(db_path=DEFAULT_DB_PATH, migrate=True):
+    """Open the history database, creating and migrating the schema as needed
+
+    With migrate=False the caller runs migrate_db() itself before relying on
+    the current schema.
+    """
+    db_path = Path(db_path)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = connect_db(db_path)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ip_address TEXT,
+            country TEXT,
+            city TEXT,
+            latitude REAL,
+            longitude REAL,
+            timestamp TEXT
+        )
+    ''')
+    conn.commit()
+    if migrate:
+        migrate_db(conn)
+    return conn
+
+
+def migrate_db(conn):
+    """Bring the schema up to date with MIGRATIONS"""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+        # sqlite3 only opens a transaction before DML, so without BEGIN each ALTER and
+        # CREATE would commit on its own and a failed migration could not be re-run
+        conn.execute("BEGIN")
+        try:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {number}")
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+        logging.info(f"Database migrated to schema version {number}")
+
+
+def _stats_query(table, columns, date_from=None, date_to=None, limit=None):
+    conditions = []
+    params = []
+    if date_from:
+        conditions.append("day >= ?")
+        params.append(date_from)
+    if date_to:
+        conditions.append("day < ?")
+        params.append(date_to)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    sql = f"SELECT {columns}, SUM(lookups) AS total FROM {table}{where} GROUP BY {columns} ORDER BY total DESC"
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return sql, params
+
+
+def country_counts(conn, date_from=None, date_to=None, limit=None):
+    """[(country, lookups)] from the pre-aggregated stats, busiest first
+
+    Dates are YYYY-MM-DD; date_to is exclusive.
+    """
+    return conn.execute(*_stats_query("stats_country", "country", date_from, date_to, limit)).fetchall()
+
+
+def city_counts(conn, date_from=None, date_to=None, limit=None):
+    """[(country, city, lookups)] from the pre-aggregated stats, busiest first"""
+    return conn.execute(*_stats_query("stats_city", "country, city", date_from, date_to, limit)).fetchall()
+
+
+def grid_counts(conn, date_from=None, date_to=None):
+    """[(lat_bin, lon_bin, lookups)] per GRID_DEGREES cell"""
+    return conn.execute(*_stats_query("stats_grid", "lat_bin, lon_bin", date_from, date_to)).fetchall()
+
+
+def heatmap_grid(cells):
+    """Scatter grid_counts() cells into a GRID_ROWS x GRID_COLUMNS NumPy array
+
+    Row 0 is the southernmost band. Requires NumPy (raises ImportError).
+    """
+    import numpy as np
+    grid = np.zeros((GRID_ROWS, GRID_COLUMNS), dtype=np.float64)
+    if cells:
+        lat_bins, lon_bins, counts = np.array(cells, dtype=np.int64).T
+        np.add.at(grid, (np.clip(lat_bins, 0, GRID_ROWS - 1), np.clip(lon_bins, 0, GRID_COLUMNS - 1)), counts)
+    return grid
+
+
+def _begin_write(conn):
+    """Start a write transaction holding the write lock
+
+    The schema is read first because SQLite reports "no such table" from the
+    FTS5 trigger when another connection changed it since this one last did.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute("SELECT 1 FROM history LIMIT 0")
+
+
+def compact_history(conn, before, batch_size=COMPACT_BATCH_SIZE):
+    """Roll history rows older than before into history_rollup; returns the rows compacted
+
+    Rows are moved oldest first, batch_size at a time, so each transaction
+    holds the write lock only briefly. Compacted lookups stay counted in the
+    per-day stats.
+    """
+    compacted = 0
+    while True:
+        with conn:
+            _begin_write(conn)
+            last = conn.execute(
+                "SELECT timestamp FROM history WHERE timestamp < ? ORDER BY timestamp LIMIT 1 OFFSET ?",
+                (before, batch_size - 1)
+            ).fetchone()
+            condition, params = ("timestamp <= ?", last) if last else ("timestamp < ?", (before,))
+            conn.execute(f'''
+                INSERT INTO history_rollup (ip_address, country, city, isp, org, latitude, longitude,
+                                            first_seen, last_seen, count, ip_packed)
+                SELECT ip_address, COALESCE(country, ''), COALESCE(city, ''), COALESCE(isp, ''),
+                       COALESCE(org, ''), latitude, longitude, MIN(timestamp), MAX(timestamp), COUNT(*), ip_packed
+                FROM history WHERE {condition} AND ip_address IS NOT NULL
+                GROUP BY 1, 2, 3, 4, 5
+                ON CONFLICT (ip_address, country, city, isp, org) DO UPDATE SET
+                    latitude = CASE WHEN excluded.last_seen >= last_seen THEN excluded.latitude ELSE latitude END,
+                    longitude = CASE WHEN excluded.last_seen >= last_seen THEN excluded.longitude ELSE longitude END,
+                    first_seen = MIN(first_seen, excluded.first_seen),
+                    last_seen = MAX(last_seen, excluded.last_seen),
+                    count = count + excluded.count
+            ''', params)
+            conn.execute("INSERT INTO history_compacting VALUES (1)")
+            compacted += conn.execute(f"DELETE FROM history WHERE {condition}", params).rowcount
+            conn.execute("DELETE FROM history_compacting")
+        if last is None:
+            return compacted
+
+
+def expire_history(conn, before):
+    """Delete history rows, rollups and per-day stats older than before; returns the records deleted"""
+    with conn:
+        _begin_write(conn)
+        # The stats for these days are dropped wholesale below
+        conn.execute("INSERT INTO history_compacting VALUES (1)")
+        expired = conn.execute("DELETE FROM history WHERE timestamp < ?", (before,)).rowcount
+        conn.execute("DELETE FROM history_compacting")
+        expired += conn.execute("DELETE FROM history_rollup WHERE last_seen < ?", (before,)).rowcount
+        for table in ("stats_country", "stats_city", "stats_grid"):
+            conn.execute(f"DELETE FROM {table} WHERE day < ?", (before[:10],))
+    return expired
+
+
+def vacuum_history(conn, step_pages=VACUUM_STEP_PAGES, convert=False):
+    """Hand free database pages back to the file system; returns the pages freed
+
+    Pages are released step_pages at a time with incremental vacuum. A
+    database created before auto-vacuum was enabled keeps its free pages for
+    reuse unless convert is set, which rewrites it once with a full VACUUM.
+    That blocks every other writer for as long as the copy takes, so it only
+    runs when asked for.
+    """
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        if not convert:
+            return 0
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+    while conn.execute("PRAGMA freelist_count").fetchone()[0]:
+        conn.execute(f"PRAGMA incremental_vacuum({int(step_pages)})").fetchall()
+    return max(0, page_count - conn.execute("PRAGMA page_count").fetchone()[0])
+
+
+def maintain_history(conn, compact_after_days=COMPACT_AFTER_DAYS, retention_days=RETENTION_DAYS,
+                     max_rows=MAX_HISTORY_ROWS, now=None, convert=False):
+    """Compact, expire and vacuum the history database
+
+    Rows older than compact_after_days, and the oldest rows beyond max_rows,
+    are rolled up; everything older than retention_days is deleted. Zero
+    turns a limit off. Rows stored in the same second as the max_rows
+    boundary are kept together. convert is passed on to vacuum_history().
+    Returns a dict of what was done.
+    """
+    now = now or datetime.now()
+    started = time.perf_counter()
+    before = ""
+    if compact_after_days:
+        before = (now - timedelta(days=compact_after_days)).strftime("%Y-%m-%d")
+    if max_rows:
+        excess = conn.execute("SELECT COUNT(*) FROM history").fetchone()[0] - max_rows
+        if excess > 0:
+            oldest_kept = conn.execute(
+                "SELECT timestamp FROM history WHERE timestamp IS NOT NULL ORDER BY timestamp LIMIT 1 OFFSET ?",
+                (excess,)
+            ).fetchone()
+            if oldest_kept:
+                before = max(before, oldest_kept[0])
+    compacted = compact_history(conn, before) if before else 0
+    expired = 0
+    if retention_days:
+        expired = expire_history(conn, (now - timedelta(days=retention_days)).strftime("%Y-%m-%d"))
+    freed_pages = vacuum_history(conn, convert=convert)
+    METRICS.increment("history_rows_compacted_total", compacted)
+    METRICS.increment("history_records_expired_total", expired)
+    return {
+        "compacted": compacted,
+        "expired": expired,
+        "freed_pages": freed_pages,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+WriteFailure = namedtuple("WriteFailure", "error rows statements")
+WriteFailure.__doc__ = """History writes that HistoryWriter could not commit
+
+rows are the history rows passed to write() and statements the (sql, params)
+pairs passed to execute() that were not stored, after retries.
+"""
+
+
+class HistoryWriter(threading.Thread):
+    """Background thread that owns the history write connection and batches inserts
+
+    A batch that fails is retried WRITE_RETRIES times. If it still fails,
+    its writes are tried one at a time so a single bad row does not lose
+    the rest, and whatever cannot be stored is logged and passed to
+    on_error(WriteFailure) on the writer thread.
+    """
+
+    def __init__(self, db_path, batch_size=WRITE_BATCH_SIZE, flush_interval=WRITE_FLUSH_INTERVAL, on_error=None):
+        super().__init__(daemon=True)
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_error = on_error
+        self.queue = queue.Queue()
+    def write(self, rows):
+        """Queue history rows for insertion"""
+        self.queue.put(("insert", list(rows)))
+
+    def execute(self, sql, params=()):
+        """Queue an arbitrary write statement, ordered with pending inserts"""
+        self.queue.put(("execute", sql, params))
+
+    def flush(self, timeout=None):
+        """Block until everything queued so far has been committed"""
+        done = threading.Event()
+        self.queue.put(("flush", done))
+        return done.wait(timeout)
+
+    def submit(self, task):
+        """Run task(conn) on the writer thread after the writes queued so far; returns a Future"""
+        future = Future()
+        self.queue.put(("task", future, task))
+        return future
+
+    def stop(self):
+        """Commit pending writes and stop the thread"""
+        self.queue.put(("stop",))
+        self.join()
+
+    def run(self):
+        conn = connect_db(self.db_path)
+        running = True
+        while running:
+            ops = [self.queue.get()]
+            pending = len(ops[0][1]) if ops[0][0] == "insert" else 0
+            deadline = time.monotonic() + self.flush_interval
+            while ops[-1][0] not in ("flush", "stop", "task") and pending < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    op = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                ops.append(op)
+                if op[0] == "insert":
+                    pending += len(op[1])
+
+            # Waiters and stop are honoured even when the write fails
+            waiters = [op[1] for op in ops if op[0] == "flush"]
+            running = ops[-1][0] != "stop"
+            writes = [op for op in ops if op[0] in ("insert", "execute")]
+            started = time.perf_counter()
+            error = self.commit(conn, writes, WRITE_RETRIES) if writes else None
+            failed = []
+            if error is not None:
+                failed = writes
+                # Split the batch so one bad row does not lose the rest, unless the
+                # database stayed locked through every retry and would fail them all
+                if len(writes) > 1 and "locked" not in str(error):
+                    failed = [op for op in writes if self.commit(conn, [op]) is not None]
+                if failed:
+                    self.report(error, failed)
+            written = pending - sum(len(op[1]) for op in failed if op[0] == "insert")
+            if written:
+                METRICS.observe("db_write", time.perf_counter() - started)
+                METRICS.increment("history_rows_written_total", written)
+            for waiter in waiters:
+                waiter.set()
+            # A task ends the batch, so it sees every write queued before it
+            if ops[-1][0] == "task" and ops[-1][1].set_running_or_notify_cancel():
+                try:
+                    ops[-1][1].set_result(ops[-1][2](conn))
+                except Exception as e:
+                    ops[-1][1].set_exception(e)
+        conn.close()
+
+    def commit(self, conn, writes, retries=0):
+        """Apply insert and execute ops in one transaction, retrying failures; returns the last error or None"""
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(WRITE_RETRY_DELAY * 2 ** (attempt - 1))
+            try:
+                with conn:
+                    _begin_write(conn)
+                    for op in writes:
+                        if op[0] == "insert":
+                            conn.executemany(HISTORY_INSERT, op[1])
+                        else:
+                            conn.execute(op[1], op[2])
+                return None
+            except sqlite3.Error as e:
+                error = e
+        return error
+
+    def report(self, error, failed):
+        """Log writes that could not be stored and hand them to on_error"""
+        rows = [row for op in failed if op[0] == "insert" for row in op[1]]
+        statements = [(op[1], op[2]) for op in failed if op[0] == "execute"]
+        logging.error(f"History write failed: {str(error)} ({len(rows)} rows and "
+                      f"{len(statements)} statements not stored)")
+        if self.on_error is not None:
+            try:
+                self.on_error(WriteFailure(error, rows, statements))
+            except Exception as e:
+                logging.error(f"History write failure handler failed: {str(e)}")
+
+
+class LookupCache:
+    """In-memory LRU of lookup responses backed by a persistent SQLite TTL cache
+
+    table names the SQLite table, so each enrichment stage can keep its own cache.
+    """
+
+    def __init__(self, db_path, max_entries=CACHE_SIZE, ttl=CACHE_TTL * 3600, table="lookup_cache"):
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = connect_db(db_path, check_same_thread=False)
+        self.conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                ip_address TEXT PRIMARY KEY,
+                response TEXT,
+                expires_at REAL
+            )
+        ''')
+        self.conn.execute(f"DELETE FROM {table} WHERE expires_at < ?", (time.time(),))
+        self.conn.commit()
+
+    def configure(self, max_entries, ttl):
+        """Apply new size and TTL limits"""
+        with self.lock:
+            self.max_entries = max_entries
+            self.ttl = ttl
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get(self, ip_address):
+        """Return the cached response for an IP, or None if missing or expired"""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(ip_address)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(ip_address)
+                self.hits += 1
+                return entry[1]
+
+            row = self.conn.execute(
+                f"SELECT response, expires_at FROM {self.table} WHERE ip_address = ? AND expires_at > ?",
+                (ip_address, now)
+            ).fetchone()
+            if row is None:
+                self.entries.pop(ip_address, None)
+                self.misses += 1
+                return None
+
+            data = json.loads(row[0])
+            self._remember(ip_address, row[1], data)
+            self.hits += 1
+            return data
+
+    def put(self, ip_address, data):
+        """Store a successful response in both tiers"""
+        expires_at = time.time() + self.ttl
+        with self.lock:
+            self._remember(ip_address, expires_at, data)
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (ip_address, response, expires_at) VALUES (?, ?, ?)",
+                (ip_address, json.dumps(data), expires_at)
+            )
+            self.conn.commit()
+
+    def _remember(self, ip_address, expires_at, data):
+        self.entries[ip_address] = (expires_at, data)
+        self.entries.move_to_end(ip_address)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """Drop every cached response"""
+        with self.lock:
+            self.entries.clear()
+            self.conn.execute(f"DELETE FROM {self.table}")
+            self.conn.commit()
+
+
+class OfflineGeoDB:
+    """Memory-mapped IPv4 range database answering lookups with a binary search
+
+    IPv4 only: IPv6 rows in the imported CSV are skipped and IPv6 addresses
+    are answered with a failure saying the database does not cover them.
+
+    File layout (little-endian):
+        header   magic, range count, string table offset
+        starts   sorted uint32 range starts, one per range
+        records  (end, country offset, city offset, lat, lon) per range
+        strings  deduplicated, length-prefixed UTF-8 strings
+    """
+
+    MAGIC = b"IPGEO001"
+    HEADER = struct.Struct("<8sII")
+    RECORD = struct.Struct("<IIIff")
+    STRING_LENGTH = struct.Struct("<H")
+
+    def __init__(self, path):
+        self.lock = threading.Lock()  # close() waits for lookups running on other threads
+        self.file = open(path, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.strings_offset = self.HEADER.unpack_from(self.mm, 0)
+        if magic != self.MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not an offline IP range database")
+        self.starts = memoryview(self.mm)[self.HEADER.size:self.HEADER.size + 4 * self.count].cast('I')
+        self.records_offset = self.HEADER.size + 4 * self.count
+
+    @classmethod
+    def build(cls, csv_path, out_path):
+        """Import a CSV of (start, end, country, city, lat, lon) rows; returns the IPv4 range count"""
+        ranges = []
+        skipped_ipv6 = 0
+        with open(csv_path, newline='', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                if len(row) < 6:
+                    continue
+                try:
+                    start, end = cls._parse_address(row[0]), cls._parse_address(row[1])
+                    lat, lon = float(row[4]), float(row[5])
+                except ValueError:
+                    if ":" in row[0]:
+                        skipped_ipv6 += 1
+                    continue  # header or malformed line
+                ranges.append((start, end, row[2].strip(), row[3].strip(), lat, lon))
+        ranges.sort()
+        if skipped_ipv6:
+            logging.warning(f"Skipped {skipped_ipv6} IPv6 ranges; the offline database covers IPv4 only")
+
+        strings = bytearray()
+        string_offsets = {}
+
+        def intern(value):
+            if value not in string_offsets:
+                encoded = value.encode('utf-8')[:0xFFFF]
+                string_offsets[value] = len(strings)
+                strings.extend(cls.STRING_LENGTH.pack(len(encoded)))
+                strings.extend(encoded)
+            return string_offsets[value]
+
+        records = bytearray()
+        for start, end, country, city, lat, lon in ranges:
+            records.extend(cls.RECORD.pack(end, intern(country), intern(city), lat, lon))
+
+        strings_offset = cls.HEADER.size + 4 * len(ranges) + len(records)
+        tmp_path = Path(str(out_path) + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, len(ranges), strings_offset))
+            f.write(struct.pack(f"<{len(ranges)}I", *(r[0] for r in ranges)))
+            f.write(records)
+            f.write(strings)
+        os.replace(tmp_path, out_path)
+        return len(ranges)
+
+    @staticmethod
+    def _parse_address(value):
+        value = value.strip()
+        return int(ipaddress.IPv4Address(int(value) if value.isdigit() else value))
+
+    def _string(self, offset):
+        position = self.strings_offset + offset
+        (length,) = self.STRING_LENGTH.unpack_from(self.mm, position)
+        position += self.STRING_LENGTH.size
+        return self.mm[position:position + length].decode('utf-8')
+
+    def lookup(self, ip_address):
+        """Return an ip-api style response dict for an IPv4 address"""
+        try:
+            key = int(ipaddress.IPv4Address(ip_address))
+        except ValueError:
+            message = 'IPv6 is not covered by the offline database' if validate_ip(ip_address) else 'invalid query'
+            return {'status': 'fail', 'message': message, 'query': ip_address}
+
+        with self.lock:
+            if self.mm.closed:
+                return {'status': 'fail', 'message': 'offline database closed', 'query': ip_address}
+            index = bisect.bisect_right(self.starts, key) - 1
+            if index >= 0:
+                end, country, city, lat, lon = self.RECORD.unpack_from(
+                    self.mm, self.records_offset + index * self.RECORD.size)
+                if key <= end:
+                    return {
+                        'status': 'success',
+                        'country': self._string(country),
+                        'city': self._string(city),
+                        'lat': round(lat, 4),
+                        'lon': round(lon, 4),
+                        'query': ip_address
+                    }
+        return {'status': 'fail', 'message': 'not in offline database', 'query': ip_address}
+
+    def close(self):
+        """Release the memory map; later lookups answer that the database is closed"""
+        with self.lock:
+            if getattr(self, 'starts', None) is not None:
+                self.starts.release()
+                self.starts = None
+            self.mm.close()
+            self.file.close()
+
+
+LookupResult = namedtuple("LookupResult", "request_id ip_address status data error")
+LookupResult.__doc__ = """Outcome of a LookupEngine request
+
+status is one of "success", "failed", "invalid", "network_error" or "cancelled".
+"""
+
+
+class RateLimitError(Exception):
+    """The lookup service answered HTTP 429"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Rate limited, quota resets in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """Token bucket for one ip-api quota that learns from the X-Rl / X-Ttl headers
+
+    Until the service has reported its quota the bucket refills smoothly at
+    capacity per period. Once X-Rl (requests left) and X-Ttl (seconds until
+    the window resets) are seen, the bucket follows the server's fixed window.
+    """
+
+    def __init__(self, capacity, period=RATE_LIMIT_PERIOD):
+        self.capacity = capacity
+        self.period = period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.reset_at = None
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        if self.reset_at is not None:
+            if now >= self.reset_at:
+                self.tokens = float(self.capacity)
+                self.reset_at = None
+        else:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / self.period)
+        self.updated = now
+
+    def delay(self):
+        """Seconds until a request may be sent"""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self.tokens >= 1:
+                return 0.0
+            if self.reset_at is not None:
+                return self.reset_at - now
+            return (1 - self.tokens) * self.period / self.capacity
+
+    def try_acquire(self):
+        """Take a token if one is available"""
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def acquire(self, cancelled=None):
+        """Block until a token is taken; returns False if cancelled is set first"""
+        while not self.try_acquire():
+            if cancelled is not None and cancelled.is_set():
+                return False
+            time.sleep(min(max(self.delay(), 0.01), 0.5))
+        return True
+
+    def update(self, headers):
+        """Learn the remaining quota from a response's headers"""
+        try:
+            remaining = int(headers['X-Rl'])
+            ttl = int(headers['X-Ttl'])
+        except (KeyError, TypeError, ValueError):
+            return
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            # The server's count is authoritative; it already includes this request
+            self.capacity = max(self.capacity, remaining + 1)
+            self.tokens = float(remaining)
+            self.reset_at = now + ttl
+
+    def block(self, retry_after):
+        """Stop sending until the quota window resets"""
+        with self.lock:
+            self.tokens = 0.0
+            self.reset_at = time.monotonic() + retry_after
+
+    def seconds_until_reset(self):
+        """Seconds until the server's quota window resets, or 0 if unknown"""
+        with self.lock:
+            if self.reset_at is None:
+                return 0.0
+            return max(0.0, self.reset_at - time.monotonic())
+
+
+def normalize_ip_api(payload):
+    """ip-api.com already answers in the shape used throughout IP Tracker"""
+    if payload.get('status') not in ('success', 'fail'):
+        raise ValueError("Unexpected ip-api response")
+    return payload
+
+
+def normalize_ipwho_is(payload):
+    """Convert an ipwho.is response to the ip-api shape"""
+    if not payload.get('success'):
+        return {'status': 'fail', 'message': payload.get('message', 'lookup failed'), 'query': payload.get('ip')}
+    connection = payload.get('connection') or {}
+    asn = connection.get('asn')
+    return {
+        'status': 'success',
+        'country': payload['country'],
+        'countryCode': payload.get('country_code'),
+        'city': payload.get('city'),
+        'lat': float(payload['latitude']),
+        'lon': float(payload['longitude']),
+        'timezone': (payload.get('timezone') or {}).get('id'),
+        'isp': connection.get('isp'),
+        'org': connection.get('org'),
+        'as': f"AS{asn} {connection.get('org') or ''}".strip() if asn else None,
+        'query': payload.get('ip'),
+    }
+
+
+def normalize_ipapi_co(payload):
+    """Convert an ipapi.co response to the ip-api shape"""
+    if payload.get('error'):
+        return {'status': 'fail', 'message': payload.get('reason', 'lookup failed'), 'query': payload.get('ip')}
+    asn = payload.get('asn')
+    return {
+        'status': 'success',
+        'country': payload['country_name'],
+        'countryCode': payload.get('country_code'),
+        'city': payload.get('city'),
+        'lat': float(payload['latitude']),
+        'lon': float(payload['longitude']),
+        'timezone': payload.get('timezone'),
+        'isp': payload.get('org'),
+        'org': payload.get('org'),
+        'as': f"{asn} {payload.get('org') or ''}".strip() if asn else None,
+        'query': payload.get('ip'),
+    }
+
+
+ProviderSpec = namedtuple("ProviderSpec", "url normalize rate_limit")
+ProviderSpec.__doc__ = """A geolocation backend: URL template, response normalizer and requests per RATE_LIMIT_PERIOD
+
+{api_url} in the URL is replaced by API_URL (or the engine's api_url) and {ip}
+by the address being looked up.
+"""
+
+PROVIDERS = {
+    "ip-api": ProviderSpec("{api_url}/json/{ip}", normalize_ip_api, RATE_LIMIT_SINGLE),
+    "ipwho.is": ProviderSpec("https://ipwho.is/{ip}", normalize_ipwho_is, 60),
+    "ipapi.co": ProviderSpec("https://ipapi.co/{ip}/json/", normalize_ipapi_co, 30),
+}
+
+
+class CircuitBreaker:
+    """Take a provider out of rotation after repeated failures
+
+    After `failures` consecutive failures the circuit opens and the provider
+    is skipped for `cooldown` seconds. It is then half-open: requests are
+    allowed again, a success closes the circuit and a failure reopens it.
+    """
+
+    def __init__(self, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.consecutive = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def state(self):
+        """Current state: closed, open or half-open"""
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at < self.cooldown:
+                return "open"
+            return "half-open"
+
+    def allow(self):
+        """Whether the provider may be sent a request"""
+        return self.state() != "open"
+
+    def retry_in(self):
+        """Seconds until an open circuit becomes half-open"""
+        with self.lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def record_success(self):
+        with self.lock:
+            self.consecutive = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive += 1
+            # A failed trial while half-open reopens the circuit straight away
+            if self.opened_at is not None or self.consecutive >= self.failures:
+                self.opened_at = time.monotonic()
+
+
+class Provider:
+    """One geolocation backend with its own quota, circuit breaker and latency record"""
+
+    def __init__(self, name, url, normalize, rate_limiter=None, timeout=LOOKUP_TIMEOUT, breaker=None):
+        self.name = name
+        self.url = url
+        self.normalize = normalize
+        self.rate_limiter = rate_limiter or RateLimiter(RATE_LIMIT_SINGLE)
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.latencies = deque(maxlen=PROVIDER_LATENCY_WINDOW)
+        self.requests = 0
+        self.errors = 0
+        self.hedged = 0
+        self.wins = 0
+        self.last_error = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_name(cls, name, api_url=API_URL, rate_limiter=None):
+        """Build one of the PROVIDERS by name"""
+        spec = PROVIDERS[name]
+        return cls(name, spec.url.format(api_url=api_url, ip="{ip}"), spec.normalize,
+                   rate_limiter or RateLimiter(spec.rate_limit))
+
+    def fetch(self, ip_address, session):
+        """Request and normalize one lookup
+
+        Raises requests.RequestException on network errors, RateLimitError
+        when the provider answers HTTP 429 and ValueError for a response that
+        cannot be understood.
+        """
+        import requests
+        with self.lock:
+            self.requests += 1
+        _stage_local.connect = 0.0
+        started = time.perf_counter()
+        try:
+            response = session.get(self.url.format(ip=ip_address), timeout=self.timeout)
+            elapsed = time.perf_counter() - started
+            METRICS.observe("http", elapsed - _stage_local.connect)
+            check_rate_limit(response, self.rate_limiter)
+            response.raise_for_status()
+            with METRICS.timer("parse"):
+                try:
+                    data = self.normalize(response.json())
+                except (KeyError, TypeError, AttributeError) as e:
+                    raise ValueError(f"Unexpected response from {self.name}") from e
+        except RateLimitError as e:
+            # Quota exhaustion says nothing about the provider's health
+            self.record_error(e)
+            raise
+        except (requests.RequestException, ValueError) as e:
+            self.record_error(e)
+            self.breaker.record_failure()
+            raise
+        with self.lock:
+            self.latencies.append(elapsed)
+        self.breaker.record_success()
+        METRICS.increment("provider_requests_total", provider=self.name, outcome="success")
+        data['provider'] = self.name  # see location_changes()
+        return data
+
+    def record_error(self, error):
+        with self.lock:
+            self.errors += 1
+            self.last_error = str(error)
+        METRICS.increment("provider_requests_total", provider=self.name, outcome="error")
+
+    def hedge_delay(self, percentile=HEDGE_PERCENTILE):
+        """Seconds to wait for this provider before asking another one"""
+        with self.lock:
+            if len(self.latencies) < HEDGE_MIN_SAMPLES:
+                return HEDGE_DEFAULT_DELAY
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(percentile * len(ordered)))]
+
+    def stats(self):
+        """Counters and latency percentiles (seconds) for display"""
+        with self.lock:
+            ordered = sorted(self.latencies)
+            stats = {
+                'name': self.name, 'requests': self.requests, 'errors': self.errors,
+                'hedged': self.hedged, 'wins': self.wins, 'last_error': self.last_error,
+            }
+        for key, fraction in (('p50', 0.50), ('p95', 0.95)):
+            stats[key] = ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else None
+        stats['state'] = self.breaker.state()
+        return stats
+
+
+class ProviderPool:
+    """Providers in rotation order with hedged requests and failover
+
+    Each lookup goes to the first provider whose circuit is not open and
+    that has quota left. If it has not answered within its learned
+    HEDGE_PERCENTILE latency, the next provider is asked as well and the
+    first usable answer wins. An error fails over to the next provider
+    straight away. Late answers from the losing provider still feed its
+    latency record.
+    """
+
+    def __init__(self, providers, workers=LOOKUP_WORKERS, hedge=True):
+        self.providers = {provider.name: provider for provider in providers}
+        self.rotation = list(self.providers.values())
+        self.hedge = hedge
+        # Room for a hedge and a failover next to every primary request
+        self.executor = ThreadPoolExecutor(max_workers=workers * 3, thread_name_prefix="provider")
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_names(cls, names=DEFAULT_PROVIDERS, api_url=API_URL, rate_limiter=None, workers=LOOKUP_WORKERS):
+        """Build every known provider, with names (in order) in rotation
+
+        rate_limiter, if given, replaces the ip-api quota.
+        """
+        pool = cls([
+            Provider.from_name(name, api_url, rate_limiter if name == "ip-api" else None)
+            for name in PROVIDERS
+        ], workers)
+        pool.configure(names)
+        return pool
+
+    def configure(self, names):
+        """Set which providers are in rotation and in what order"""
+        names = [name for name in names if name in self.providers]
+        if not names:
+            raise ValueError("At least one lookup provider must be enabled")
+        with self.lock:
+            self.rotation = [self.providers[name] for name in names]
+
+    def names(self):
+        """Names of the providers in rotation, primary first"""
+        with self.lock:
+            return [provider.name for provider in self.rotation]
+
+    def next_provider(self, skip=()):
+        """Take a quota token from the first usable provider not in skip; returns it or None"""
+        with self.lock:
+            rotation = list(self.rotation)
+        for provider in rotation:
+            if provider not in skip and provider.breaker.allow() and provider.rate_limiter.try_acquire():
+                return provider
+        return None
+
+    def delay(self):
+        """Seconds until a provider in rotation can take a request"""
+        with self.lock:
+            rotation = list(self.rotation)
+        return min(
+            provider.rate_limiter.delay() if provider.breaker.allow() else provider.breaker.retry_in()
+            for provider in rotation
+        )
+
+    def tripped(self):
+        """Whether every provider in rotation has its circuit open"""
+        with self.lock:
+            rotation = list(self.rotation)
+        return not any(provider.breaker.allow() for provider in rotation)
+
+    def seconds_until_reset(self):
+        """Seconds until some provider in rotation has quota again, or 0 if one has now"""
+        with self.lock:
+            rotation = list(self.rotation)
+        return min(provider.rate_limiter.seconds_until_reset() for provider in rotation)
+
+    def fetch(self, ip_address, session, provider):
+        """Look up ip_address starting with provider, which already holds a quota token
+
+        Raises the last provider's error when none of them answered.
+        """
+        import requests
+        pending = {self.executor.submit(provider.fetch, ip_address, session): provider}
+        tried = {provider}
+        hedge_at = time.monotonic() + provider.hedge_delay() if self.hedge else None
+        error = None
+        while pending:
+            timeout = None if hedge_at is None else max(0.0, hedge_at - time.monotonic())
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # The lead provider is slower than usual; ask the next one too
+                hedge_at = None
+                backup = self.next_provider(tried)
+                if backup is not None:
+                    with provider.lock:
+                        provider.hedged += 1
+                    METRICS.increment("provider_hedges_total", provider=backup.name)
+                    tried.add(backup)
+                    pending[self.executor.submit(backup.fetch, ip_address, session)] = backup
+                continue
+            for future in done:
+                answered = pending.pop(future)
+                try:
+                    data = future.result()
+                except (requests.RequestException, RateLimitError, ValueError) as e:
+                    error = e
+                    logging.warning(f"{answered.name} failed for {ip_address}: {str(e)}")
+                    continue
+                with answered.lock:
+                    answered.wins += 1
+                return data
+            if not pending:
+                provider = self.next_provider(tried)
+                if provider is not None:
+                    tried.add(provider)
+                    pending[self.executor.submit(provider.fetch, ip_address, session)] = provider
+                    if self.hedge and hedge_at is not None:
+                        hedge_at = time.monotonic() + provider.hedge_delay()
+        raise error
+
+    def stats(self):
+        """Per-provider statistics for every known provider, rotation order first"""
+        names = self.names()
+        ordered = [self.providers[name] for name in names] + [
+            provider for name, provider in self.providers.items() if name not in names]
+        return [dict(provider.stats(), enabled=provider.name in names) for provider in ordered]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+DNS_TYPES = {"PTR": 12, "TXT": 16}
+
+
+def _dns_name(name):
+    """Encode a dotted name as DNS labels"""
+    return b"".join(bytes([len(label)]) + label.encode("ascii") for label in name.rstrip(".").split(".")) + b"\0"
+
+
+def _read_dns_name(message, offset):
+    """Decode a possibly compressed name; returns (name, offset just past it)"""
+    labels = []
+    end = None
+    for _ in range(128):  # bounds pointer loops in a hostile response
+        length = message[offset]
+        if length & 0xC0 == 0xC0:
+            if end is None:
+                end = offset + 2
+            offset = ((length & 0x3F) << 8) | message[offset + 1]
+            continue
+        offset += 1
+        if length == 0:
+            return ".".join(labels), offset if end is None else end
+        labels.append(message[offset:offset + length].decode("ascii", errors="replace"))
+        offset += length
+    raise ValueError("DNS name has too many labels")
+
+
+def _dns_answers(message, record_type):
+    """Answer strings of record_type from a DNS response; [] for NXDOMAIN"""
+    flags, questions, answers = struct.unpack("!HHH", message[2:8])
+    rcode = flags & 0xF
+    if rcode == 3:
+        return []
+    if rcode:
+        raise OSError(f"DNS server answered with error code {rcode}")
+    offset = 12
+    for _ in range(questions):
+        offset = _read_dns_name(message, offset)[1] + 4
+    records = []
+    for _ in range(answers):
+        offset = _read_dns_name(message, offset)[1]
+        rtype, _, _, length = struct.unpack("!HHIH", message[offset:offset + 10])
+        offset += 10
+        end = offset + length
+        if rtype == record_type == DNS_TYPES["PTR"]:
+            records.append(_read_dns_name(message, offset)[0])
+        elif rtype == record_type == DNS_TYPES["TXT"]:
+            parts = []
+            while offset < end:
+                size = message[offset]
+                parts.append(message[offset + 1:offset + 1 + size].decode("utf-8", errors="replace"))
+                offset += 1 + size
+            records.append("".join(parts))
+        offset = end
+    return records
+
+
+class DnsResolver:
+    """Minimal stdlib DNS client for the PTR and TXT queries enrichment needs
+
+    server is "host", "host:port" or "[v6 address]:port". Without one, the
+    first nameserver in /etc/resolv.conf is used, or DEFAULT_DNS_SERVER where
+    there is none (e.g. on Windows). Point it at a local stub server to test
+    enrichment offline.
+    """
+
+    def __init__(self, server=DNS_SERVER, timeout=2.0):
+        self.server = server or self.system_nameserver()
+        self.address = self.parse_server(self.server)
+        self.timeout = timeout
+
+    @staticmethod
+    def system_nameserver():
+        """First nameserver configured for the system, or DEFAULT_DNS_SERVER"""
+        try:
+            with open("/etc/resolv.conf", encoding="utf-8", errors="replace") as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) >= 2 and fields[0] == "nameserver":
+                        return fields[1]
+        except OSError:
+            pass
+        return DEFAULT_DNS_SERVER
+
+    @staticmethod
+    def parse_server(server):
+        """Split a server setting into (host, port); raises ValueError if it is malformed"""
+        server = server.strip()
+        if server.startswith("["):
+            host, _, port = server[1:].partition("]")
+            port = port.lstrip(":")
+        elif server.count(":") == 1:
+            host, port = server.split(":")
+        else:
+            host, port = server, ""
+        if not host:
+            raise ValueError(f"Invalid DNS server: {server}")
+        if not port:
+            return host, 53
+        if not port.isdigit() or not 0 < int(port) < 65536:
+            raise ValueError(f"Invalid DNS server port: {port}")
+        return host, int(port)
+
+    def query(self, name, record_type, timeout=None):
+        """Return the answer strings for name, or [] if it does not exist
+
+        The query is resent once halfway through the timeout in case a
+        datagram was lost. Raises TimeoutError when no answer arrives in
+        time and OSError when the server reports a failure.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        if timeout <= 0:
+            raise TimeoutError(f"No time left to look up {name}")
+        query_id = random.getrandbits(16)
+        packet = (struct.pack("!HHHHHH", query_id, 0x0100, 1, 0, 0, 0) + _dns_name(name)
+                  + struct.pack("!HH", DNS_TYPES[record_type], 1))
+        family = socket.AF_INET6 if ":" in self.address[0] else socket.AF_INET
+        deadline = time.monotonic() + timeout
+        resend_at = time.monotonic() + timeout / 2
+        with socket.socket(family, socket.SOCK_DGRAM) as sock:
+            sock.sendto(packet, self.address)
+            while True:
+                now = time.monotonic()
+                if now >= deadline:
+                    raise TimeoutError(f"No DNS answer for {name} within {timeout:g}s")
+                if resend_at is not None and now >= resend_at:
+                    sock.sendto(packet, self.address)
+                    resend_at = None
+                sock.settimeout((deadline if resend_at is None else resend_at) - now)
+                try:
+                    response = sock.recv(4096)
+                except socket.timeout:
+                    continue
+                if len(response) < 12 or struct.unpack("!H", response[:2])[0] != query_id:
+                    continue  # a late answer to an earlier query, or not DNS at all
+                try:
+                    return _dns_answers(response, DNS_TYPES[record_type])
+                except (struct.error, IndexError, ValueError) as e:
+                    raise OSError(f"Malformed DNS response for {name}") from e
+
+
+EnrichResult = namedtuple("EnrichResult", "ip_address stage status data error")
+EnrichResult.__doc__ = """Outcome of one enrichment stage
+
+status is "success", "timeout" or "error". data is {"ptr"} for the ptr stage
+and {"asn", "prefix", "as_name", "registry", "country_code"} for the asn
+stage; values are None when the records do not exist.
+"""
+
+
+class Enricher:
+    """Reverse DNS and ASN/prefix lookups run alongside geolocation
+
+    Each stage runs on its own worker with its own timeout (ENRICH_TIMEOUTS)
+    and cache, and reports as soon as it finishes, so a slow resolver never
+    holds back the other results. ASN and prefix come from Team Cymru's
+    DNS interface, so a single resolver setting covers both stages.
+    """
+
+    def __init__(self, resolver=None, db_path=None, workers=ENRICH_WORKERS, timeouts=None):
+        self.resolver = resolver or DnsResolver()
+        self.timeouts = dict(ENRICH_TIMEOUTS, **(timeouts or {}))
+        self.caches = {
+            stage: LookupCache(db_path, table=f"{stage}_cache") if db_path is not None else None
+            for stage in ENRICH_STAGES
+        }
+        self.stages = {"ptr": self.reverse_dns, "asn": self.origin_asn}
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="enrich")
+
+    def enrich(self, ip_address, callback=None, stages=ENRICH_STAGES):
+        """Start every stage for an IP; returns {stage: Future of EnrichResult}
+
+        callback, if given, is called from a worker thread with each
+        EnrichResult as its stage finishes.
+        """
+        return {stage: self.executor.submit(self.run_stage, stage, ip_address, callback) for stage in stages}
+
+    def run_stage(self, stage, ip_address, callback=None):
+        cache = self.caches.get(stage)
+        data = cache.get(ip_address) if cache is not None else None
+        if data is not None:
+            result = EnrichResult(ip_address, stage, "success", data, None)
+        else:
+            started = time.perf_counter()
+            try:
+                data = self.stages[stage](ip_address, time.monotonic() + self.timeouts[stage])
+                result = EnrichResult(ip_address, stage, "success", data, None)
+            except TimeoutError as e:
+                result = EnrichResult(ip_address, stage, "timeout", None, str(e))
+            except (OSError, ValueError) as e:
+                result = EnrichResult(ip_address, stage, "error", None, str(e))
+            METRICS.observe(stage, time.perf_counter() - started)
+            if cache is not None and result.status == "success":
+                cache.put(ip_address, data)
+        METRICS.increment("enrichments_total", stage=stage, status=result.status)
+        if callback is not None:
+            callback(result)
+        return result
+
+    def reverse_dns(self, ip_address, deadline):
+        """PTR record for an IP"""
+        name = ipaddress.ip_address(ip_address).reverse_pointer
+        records = self.resolver.query(name, "PTR", deadline - time.monotonic())
+        return {'ptr': records[0].rstrip(".") if records else None}
+
+    def origin_asn(self, ip_address, deadline):
+        """Originating ASN and announced prefix, plus the AS name if there is time"""
+        address = ipaddress.ip_address(ip_address)
+        if address.version == 4:
+            name = address.reverse_pointer[:-len(".in-addr.arpa")] + ".origin.asn.cymru.com"
+        else:
+            name = address.reverse_pointer[:-len(".ip6.arpa")] + ".origin6.asn.cymru.com"
+        # "15169 | 8.8.8.0/24 | US | arin | 2023-12-28", one record per announced prefix
+        origins = []
+        for record in self.resolver.query(name, "TXT", deadline - time.monotonic()):
+            fields = [field.strip() for field in record.split("|")]
+            if len(fields) >= 4 and fields[0]:
+                origins.append((fields[0].split()[0], fields[1], fields[2], fields[3]))
+        if not origins:
+            return {'asn': None, 'prefix': None, 'as_name': None, 'registry': None, 'country_code': None}
+        # The most specific announcement is the one traffic actually follows
+        asn, prefix, country_code, registry = max(
+            origins, key=lambda origin: ipaddress.ip_network(origin[1], strict=False).prefixlen)
+
+        as_name = None
+        try:
+            # "15169 | US | arin | 2000-03-30 | GOOGLE - Google LLC, US"
+            records = self.resolver.query(f"AS{asn}.asn.cymru.com", "TXT", deadline - time.monotonic())
+            if records:
+                as_name = records[0].split("|")[-1].strip() or None
+        except OSError:
+            pass  # the origin answer is worth showing without the name
+        return {'asn': int(asn), 'prefix': prefix, 'as_name': as_name, 'registry': registry,
+                'country_code': country_code}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+class _LookupJob:
+    """One IP queued or in flight, shared by every request for that IP"""
+
+    __slots__ = ("ip_address", "priority", "callbacks", "state", "attempts", "cache_checked", "queued_at")
+
+    def __init__(self, ip_address, priority):
+        self.ip_address = ip_address
+        self.priority = priority
+        self.callbacks = {}
+        self.state = "queued"
+        self.attempts = 0
+        self.cache_checked = False
+        self.queued_at = time.perf_counter()
+
+
+class LookupEngine:
+    """Long-lived lookup scheduler with a worker pool and a keep-alive HTTP session
+
+    Requests wait in a priority queue (PRIORITY_INTERACTIVE before
+    PRIORITY_REFRESH before PRIORITY_BULK) and are released by a dispatcher
+    thread as the rate limiter allows. Concurrent requests for the same IP
+    share one job. Results are delivered by calling the callback passed to
+    submit() from a worker thread; GUI code hands in a Qt signal's emit so
+    delivery is queued onto the GUI thread.
+
+    Network lookups go through a ProviderPool, which hedges slow requests
+    and fails over between providers. rate_limiter, if given, replaces the
+    ip-api quota of the default pool.
+    """
+
+    def __init__(self, cache=None, offline_db=None, api_url=API_URL, workers=LOOKUP_WORKERS,
+                 rate_limiter=None, providers=None):
+        self.cache = cache
+        self.offline_db = offline_db
+        self.api_url = api_url
+        self.workers = workers
+        self.providers = providers or ProviderPool.from_names(DEFAULT_PROVIDERS, api_url, rate_limiter, workers)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="lookup")
+        self.request_ids = itertools.count(1)
+        self.sequence = itertools.count()
+        self.heap = []
+        self.jobs = {}
+        self.waiters = {}
+        self.condition = threading.Condition()
+        self.running = True
+        self._session = None
+        self.session_lock = threading.Lock()
+        self.dispatcher = threading.Thread(target=self.dispatch, name="lookup-dispatcher", daemon=True)
+        self.dispatcher.start()
+
+    @property
+    def session(self):
+        """Shared keep-alive session, created on first network lookup"""
+        with self.session_lock:
+            if self._session is None:
+                # Hedges and failovers can briefly double the connections per host
+                self._session = create_session(self.workers * 2)
+            return self._session
+
+    def submit(self, ip_address, callback, priority=PRIORITY_INTERACTIVE):
+        """Queue a lookup and return its request id"""
+        request_id = next(self.request_ids)
+        if not validate_ip(ip_address):
+            self.executor.submit(callback, LookupResult(
+                request_id, ip_address, "invalid", None, "Invalid IP address format"))
+            return request_id
+
+        with self.condition:
+            job = self.jobs.get(ip_address)
+            if job is None:
+                job = _LookupJob(ip_address, priority)
+                self.jobs[ip_address] = job
+                heapq.heappush(self.heap, (priority, next(self.sequence), job))
+            elif job.state == "queued" and priority < job.priority:
+                job.priority = priority
+                heapq.heappush(self.heap, (priority, next(self.sequence), job))
+            job.callbacks[request_id] = callback
+            self.waiters[request_id] = job
+            self.condition.notify()
+        return request_id
+
+    def dispatch(self):
+        """Release queued jobs in priority order as the rate limit allows"""
+        while True:
+            with self.condition:
+                while self.running and not self.heap:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                priority, sequence, job = heapq.heappop(self.heap)
+                if job.state != "queued" or priority != job.priority:
+                    continue  # stale entry left behind by a priority bump
+                if not job.callbacks:
+                    self.drop(job)
+                    continue
+                job.state = "checking"
+            try:
+                self.release(job, sequence)
+            except Exception as e:
+                # A locked cache or a closed offline database must not take the dispatcher down
+                logging.error(f"Lookup of {job.ip_address} failed: {str(e)}")
+                self.executor.submit(self.complete, job, None, "network_error", f"Error: {str(e)}")
+
+    def release(self, job, sequence):
+        """Answer a popped job locally or hand it to a provider; runs on the dispatcher thread"""
+        # Answer from the offline database or cache without spending quota
+        data = None
+        offline_db = self.offline_db  # read once; set_offline_db() may swap it meanwhile
+        if offline_db is not None:
+            data = offline_db.lookup(job.ip_address)
+        elif self.cache is not None and not job.cache_checked:
+            job.cache_checked = True
+            data = self.cache.get(job.ip_address)
+        if data is not None:
+            job.state = "running"
+            METRICS.observe("queue", time.perf_counter() - job.queued_at)
+            METRICS.increment("lookup_answers_total", source="offline" if offline_db is not None else "cache")
+            self.executor.submit(self.complete, job, data)
+            return
+
+        with self.condition:
+            provider = self.providers.next_provider()
+            if provider is None and not self.providers.tripped():
+                job.state = "queued"
+                heapq.heappush(self.heap, (job.priority, sequence, job))
+                self.condition.wait(max(self.providers.delay(), 0.01))
+                return
+            job.state = "running"
+        if provider is None:
+            # Waiting out the circuit breakers would leave the user staring at a spinner
+            retry_in = int(self.providers.delay() + 0.5)
+            self.executor.submit(self.complete, job, None, "network_error",
+                                 f"All lookup providers are failing, retrying them in {retry_in}s")
+            return
+        if not job.attempts:
+            METRICS.observe("queue", time.perf_counter() - job.queued_at)
+        METRICS.increment("lookup_answers_total", source="network")
+        self.executor.submit(self.fetch, job, provider)
+
+    def set_offline_db(self, offline_db):
+        """Answer from offline_db, or the network when None; returns the database it replaces
+
+        The replaced database may still be finishing a lookup, which
+        OfflineGeoDB.close() waits for, so the caller can close it right away.
+        """
+        with self.condition:
+            previous, self.offline_db = self.offline_db, offline_db
+        return previous
+
+    def fetch(self, job, provider):
+        """Perform the network request for a job on a worker thread"""
+        import requests
+        try:
+            data = self.providers.fetch(job.ip_address, self.session, provider)
+        except RateLimitError as e:
+            logging.warning(f"Rate limited while looking up {job.ip_address}, retrying in {e.retry_after}s")
+            with self.condition:
+                job.attempts += 1
+                if job.attempts <= RATE_LIMIT_RETRIES and self.running:
+                    job.state = "queued"
+                    heapq.heappush(self.heap, (job.priority, next(self.sequence), job))
+                    self.condition.notify()
+                    return
+            self.complete(job, None, "network_error", str(e))
+            return
+        except (requests.RequestException, ValueError) as e:
+            self.complete(job, None, "network_error", f"Error: {str(e)}")
+            return
+        if self.cache is not None and data.get('status') == 'success':
+            self.cache.put(job.ip_address, data)
+        self.complete(job, data)
+
+    def complete(self, job, data, status=None, error=None):
+        """Deliver a job's outcome to everyone waiting on it"""
+        if status is None:
+            if data.get('status') == 'success':
+                status = "success"
+            else:
+                status = "failed"
+                error = data.get('message', "Unable to retrieve location information")
+        with self.condition:
+            job.state = "done"
+            if self.jobs.get(job.ip_address) is job:
+                del self.jobs[job.ip_address]
+            callbacks = job.callbacks
+            job.callbacks = {}
+            for request_id in callbacks:
+                self.waiters.pop(request_id, None)
+            self.condition.notify()  # the response may have updated the learned quota
+        METRICS.observe("lookup", time.perf_counter() - job.queued_at)
+        METRICS.increment("lookups_total", status=status)
+        for request_id, callback in callbacks.items():
+            callback(LookupResult(request_id, job.ip_address, status, data, error))
+
+    def drop(self, job):
+        # Caller holds self.condition
+        job.state = "cancelled"
+        if self.jobs.get(job.ip_address) is job:
+            del self.jobs[job.ip_address]
+
+    def cancel(self, request_id):
+        """Cancel one request; the shared job is dropped once nobody waits on it"""
+        with self.condition:
+            job = self.waiters.pop(request_id, None)
+            if job is None:
+                return
+            callback = job.callbacks.pop(request_id)
+            if not job.callbacks and job.state == "queued":
+                self.drop(job)
+        callback(LookupResult(request_id, job.ip_address, "cancelled", None, "Cancelled"))
+
+    def cancel_all(self):
+        """Cancel every pending request"""
+        with self.condition:
+            request_ids = list(self.waiters)
+        for request_id in request_ids:
+            self.cancel(request_id)
+
+    def in_flight(self):
+        """Number of requests that have not completed yet"""
+        with self.condition:
+            return len(self.waiters)
+
+    def queue_depth(self):
+        """Number of distinct IPs waiting for the rate limiter"""
+        with self.condition:
+            return sum(1 for job in self.jobs.values() if job.state == "queued")
+
+    def shutdown(self):
+        """Cancel pending work and release the worker pool and session"""
+        self.cancel_all()
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.executor.shutdown(wait=False)
+        self.providers.shutdown()
+        if self._session is not None:
+            self._session.close()
+
+
+WatchResult = namedtuple("WatchResult", "ip_address status snapshot previous changed error stored_row")
+WatchResult.__doc__ = """Outcome of one watchlist check
+
+changed is True only when a previously seen location, ISP or organization
+differs from the new snapshot. stored_row is the history row written for
+this check, or None when nothing changed.
+"""
+
+
+def location_snapshot(data):
+    """The WATCH_FIELDS and LOCATION_FIELDS of a lookup plus the provider that answered it"""
+    snapshot = {field: data.get(field) for field in WATCH_FIELDS}
+    snapshot['countryCode'] = data.get('countryCode')
+    snapshot['asn'] = (data.get('as') or '').split(' ')[0] or None  # "AS15169 Google LLC" -> "AS15169"
+    snapshot['provider'] = data.get('provider')
+    return snapshot
+
+
+def location_changes(previous, snapshot):
+    """The fields that differ between two location_snapshot()s
+
+    Hedging and failover let any provider answer, so the LOCATION_FIELDS,
+    which every provider normalizes alike, are compared across providers.
+    The remaining WATCH_FIELDS are only compared between answers from the
+    same provider: providers fill isp and org differently (ipapi.co reports
+    its org for both) and disagree slightly on coordinates. A field missing
+    from either snapshot, as in snapshots stored before it was added, is not
+    a change.
+    """
+    if previous is None:
+        return []
+    changes = [
+        field for field in LOCATION_FIELDS
+        if None not in (previous.get(field), snapshot.get(field)) and previous[field] != snapshot[field]
+    ]
+    if previous.get('provider') == snapshot.get('provider'):
+        changes += [field for field in WATCH_FIELDS
+                    if field not in changes and previous.get(field) != snapshot.get(field)]
+    return changes
+
+
+def location_changed(previous, snapshot):
+    """Whether two location_snapshot()s describe a different location, see location_changes()"""
+    return bool(location_changes(previous, snapshot))
+
+
+class WatchlistScheduler:
+    """Re-check watched IPs on their own intervals and store only changes
+
+    Each IP gets a fixed phase within its interval derived from the address,
+    so hundreds of entries sharing an interval are spread across it instead
+    of firing together. Checks go through the LookupEngine at
+    PRIORITY_REFRESH, so interactive lookups still come first.
+    """
+
+    def __init__(self, engine, writer, db_path, on_result=None):
+        self.engine = engine
+        self.writer = writer
+        self.db_path = db_path
+        self.on_result = on_result
+        self.entries = {}
+        self.heap = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def load(self):
+        """Read the watchlist table and schedule every entry"""
+        conn = connect_db(self.db_path)
+        try:
+            rows = conn.execute(
+                "SELECT ip_address, interval, last_checked, last_result FROM watchlist").fetchall()
+        finally:
+            conn.close()
+        with self.condition:
+            for ip_address, interval, last_checked, last_result in rows:
+                self.entries[ip_address] = {
+                    'interval': interval,
+                    'last_checked': last_checked,
+                    'last_result': json.loads(last_result) if last_result else None,
+                }
+                self._schedule(ip_address, self._first_due(ip_address, interval, last_checked))
+            self.condition.notify()
+
+    def start(self):
+        """Start the scheduling thread"""
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="watchlist", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop scheduling new checks"""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def add(self, ip_address, interval):
+        """Watch an IP, re-checking it every interval seconds"""
+        if not validate_ip(ip_address):
+            raise ValueError(f"Invalid IP address: {ip_address}")
+        interval = max(int(interval), WATCH_MIN_INTERVAL)
+        self.writer.execute(
+            "INSERT INTO watchlist (ip_address, interval) VALUES (?, ?) "
+            "ON CONFLICT (ip_address) DO UPDATE SET interval = excluded.interval",
+            (ip_address, interval))
+        with self.condition:
+            entry = self.entries.setdefault(
+                ip_address, {'interval': interval, 'last_checked': None, 'last_result': None})
+            entry['interval'] = interval
+            self._schedule(ip_address, self._first_due(ip_address, interval, entry['last_checked']))
+            self.condition.notify()
+
+    def remove(self, ip_address):
+        """Stop watching an IP"""
+        self.writer.execute("DELETE FROM watchlist WHERE ip_address = ?", (ip_address,))
+        with self.condition:
+            self.entries.pop(ip_address, None)
+
+    def snapshot(self):
+        """Copy of the current entries for display"""
+        with self.condition:
+            return {ip: dict(entry) for ip, entry in self.entries.items()}
+
+    @staticmethod
+    def _phase(ip_address, interval):
+        return zlib.crc32(ip_address.encode()) / 2 ** 32 * interval
+
+    def _first_due(self, ip_address, interval, last_checked):
+        now = time.time()
+        if last_checked is not None and last_checked + interval > now:
+            return last_checked + interval
+        # Overdue or never checked: spread across the first interval
+        return now + self._phase(ip_address, interval)
+
+    def _schedule(self, ip_address, due):
+        # Caller holds self.condition; superseded heap entries are skipped by run()
+        entry = self.entries[ip_address]
+        entry['due'] = due
+        heapq.heappush(self.heap, (due, next(self.sequence), ip_address))
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running:
+                    if self.heap:
+                        delay = self.heap[0][0] - time.time()
+                        if delay <= 0:
+                            break
+                        self.condition.wait(delay)
+                    else:
+                        self.condition.wait()
+                if not self.running:
+                    return
+                due, _, ip_address = heapq.heappop(self.heap)
+                entry = self.entries.get(ip_address)
+                if entry is None or entry.get('due') != due:
+                    continue
+                # Keep the phase: next check is one interval after this slot
+                next_due = due + entry['interval']
+                if next_due <= time.time():
+                    next_due = time.time() + self._phase(ip_address, entry['interval'])
+                self._schedule(ip_address, next_due)
+            self.engine.submit(ip_address, self.handle_result, PRIORITY_REFRESH)
+
+    def handle_result(self, result):
+        """Compare a finished check with the last one and record changes"""
+        ip_address = result.ip_address
+        with self.condition:
+            entry = self.entries.get(ip_address)
+        if entry is None or result.status == "cancelled":
+            return
+        if result.status != "success":
+            if self.on_result is not None:
+                self.on_result(WatchResult(ip_address, result.status, None, entry['last_result'],
+                                           False, result.error, None))
+            return
+
+        snapshot = location_snapshot(result.data)
+        previous = entry['last_result']
+        changed = location_changed(previous, snapshot)
+        checked_at = time.time()
+        stored_row = None
+        if previous is None or changed:
+            stored_row = history_row(ip_address, result.data)
+            self.writer.write([stored_row])
+        self.writer.execute(
+            "UPDATE watchlist SET last_checked = ?, last_result = ? WHERE ip_address = ?",
+            (checked_at, json.dumps(snapshot), ip_address))
+        with self.condition:
+            entry['last_checked'] = checked_at
+            entry['last_result'] = snapshot
+        if self.on_result is not None:
+            self.on_result(WatchResult(ip_address, "success", snapshot, previous, changed, None, stored_row))
+
+
+class BulkLookupJob:
+    """Geolocate a list of IPs through the /batch endpoint in concurrent chunks"""
+
+    def __init__(self, ip_addresses, writer=None, cache=None, offline_db=None, api_url=API_URL,
+                 chunk_size=BATCH_SIZE, workers=BATCH_WORKERS, session=None, rate_limiter=None):
+        self.ip_addresses = list(ip_addresses)
+        self.session = session
+        self.rate_limiter = rate_limiter or RateLimiter(RATE_LIMIT_BATCH)
+        self.writer = writer
+        self.cache = cache
+        self.offline_db = offline_db
+        self.api_url = api_url
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.progress_queue = queue.Queue()
+        self.cancelled = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Run the job in a background thread"""
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        """Stop dispatching chunks that have not been sent yet"""
+        self.cancelled.set()
+
+    def run(self):
+        """Dispatch all chunks and report progress through progress_queue"""
+        chunks = [
+            self.ip_addresses[i:i + self.chunk_size]
+            for i in range(0, len(self.ip_addresses), self.chunk_size)
+        ]
+        if self.session is None and self.offline_db is None:
+            self.session = create_session(self.workers)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self.process_chunk, chunk): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                chunk = futures[future]
+                try:
+                    self.progress_queue.put(("chunk", future.result()))
+                except Exception as e:
+                    logging.error(f"Bulk lookup chunk failed: {str(e)}")
+                    self.progress_queue.put(("chunk", [(ip, "error", str(e), None) for ip in chunk]))
+        if self.writer is not None:
+            self.writer.flush()
+        self.progress_queue.put(("done", self.cancelled.is_set()))
+
+    def process_chunk(self, chunk):
+        """Look up one chunk and store its successful rows in a single transaction"""
+        if self.cancelled.is_set():
+            return [(ip, "cancelled", "Cancelled", None) for ip in chunk]
+
+        responses = {}
+        if self.offline_db is not None:
+            for ip_address in chunk:
+                responses[ip_address] = self.offline_db.lookup(ip_address)
+        elif self.cache is not None:
+            for ip_address in chunk:
+                data = self.cache.get(ip_address)
+                if data is not None:
+                    responses[ip_address] = data
+
+        missing = [ip for ip in chunk if ip not in responses]
+        if missing:
+            for attempt in itertools.count():
+                if not self.rate_limiter.acquire(self.cancelled):
+                    return [(ip, "cancelled", "Cancelled", None) for ip in chunk]
+                response = self.session.post(f"{self.api_url}/batch", json=missing, timeout=10)
+                try:
+                    check_rate_limit(response, self.rate_limiter)
+                    break
+                except RateLimitError as e:
+                    if attempt >= RATE_LIMIT_RETRIES:
+                        raise
+                    logging.warning(f"Bulk lookup rate limited, retrying in {e.retry_after}s")
+            response.raise_for_status()
+            for ip_address, data in zip(missing, response.json()):
+                responses[ip_address] = data
+                if self.cache is not None and data.get('status') == 'success':
+                    self.cache.put(ip_address, data)
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        results = []
+        rows = []
+        for ip_address in chunk:
+            data = responses.get(ip_address, {})
+            if data.get('status') == 'success':
+                rows.append(history_row(ip_address, data, timestamp))
+                results.append((ip_address, "success", f"{data.get('country')}, {data.get('city')}", data))
+            else:
+                results.append((ip_address, "error",
+                                data.get('message', "Unable to retrieve location information"), data))
+
+        if rows and self.writer is not None:
+            self.writer.write(rows)
+        return results
+
+
+def count_log_ips(stream, field=0, block_size=LOG_READ_SIZE, on_block=None, cancelled=None):
+    """Count the client address column of every line in a binary stream
+
+    field is the whitespace-separated column holding the address (0 for the
+    common and combined formats written by nginx and Apache). Each block is
+    matched with one regular expression and counted in C, so memory grows
+    with the number of distinct addresses rather than the size of the log.
+    on_block(lines) is called after every block. Returns (Counter of address
+    bytes, line count).
+    """
+    # Anchoring on a literal newline lets the regex engine skip ahead with a fast
+    # scan; ^ in MULTILINE mode is tried at every byte and is several times slower
+    pattern = re.compile(rb'\n[ \t]*(?:[^ \t\n]+[ \t]+){%d}([^ \t\n]+)' % field)
+    counts = Counter()
+    lines = 0
+    tail = b""
+    while not (cancelled is not None and cancelled.is_set()):
+        block = stream.read(block_size)
+        if not block:
+            break
+        block = b"\n" + tail + block
+        end = block.rfind(b"\n")  # the last line may continue in the next block
+        tail = block[end + 1:]
+        lines += block.count(b"\n", 1, end + 1)
+        counts.update(pattern.findall(block, 0, end))
+        if on_block is not None:
+            on_block(lines)
+    if tail.strip():
+        lines += 1
+        counts.update(pattern.findall(b"\n" + tail))
+    return counts, lines
+
+
+def store_log_import(conn, path, lines, hits, locations):
+    """Record per-address hit counts of an ingested log; returns the import id
+
+    hits maps addresses to hit counts and locations maps them to (country, city).
+    """
+    with conn:
+        _begin_write(conn)
+        import_id = conn.execute(
+            "INSERT INTO log_imports (path, imported_at, lines, matched, unique_ips) VALUES (?, ?, ?, ?, ?)",
+            (str(path), datetime.now().strftime("%Y-%m-%d %H:%M:%S"), lines, sum(hits.values()), len(hits))
+        ).lastrowid
+        conn.executemany(
+            "INSERT INTO log_hits (import_id, ip_address, country, city, hits) VALUES (?, ?, ?, ?, ?)",
+            ((import_id, ip_address, *locations.get(ip_address, (None, None)), count)
+             for ip_address, count in hits.items())
+        )
+    return import_id
+
+
+class LogIngestJob:
+    """Count client addresses in an access log and geolocate each distinct one
+
+    Plain and gzipped logs are streamed in LOG_READ_SIZE blocks. Only
+    distinct public addresses are looked up, through BulkLookupJob, so each
+    is stored in history once however many lines it has. Progress arrives on
+    progress_queue as ("progress", bytes_read, total_bytes, lines) and
+    ("lookup", done, total), followed by ("done", report), ("cancelled", None)
+    or ("error", message).
+    """
+
+    def __init__(self, log_path, writer=None, cache=None, offline_db=None, field=0, lookup=True,
+                 top=LOG_TOP_IPS, api_url=API_URL, workers=BATCH_WORKERS, session=None, rate_limiter=None):
+        self.log_path = Path(log_path)
+        self.writer = writer
+        self.cache = cache
+        self.offline_db = offline_db
+        self.field = field
+        self.lookup = lookup
+        self.top = top
+        self.api_url = api_url
+        self.workers = workers
+        self.session = session
+        self.rate_limiter = rate_limiter
+        self.progress_queue = queue.Queue()
+        self.cancelled = threading.Event()
+        self.lookup_job = None
+        self.thread = None
+
+    def start(self):
+        """Run the job in a background thread"""
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        """Stop reading the log and dispatching lookups"""
+        self.cancelled.set()
+        if self.lookup_job is not None:
+            self.lookup_job.cancel()
+
+    def run(self):
+        """Ingest the log and report progress through progress_queue"""
+        try:
+            report = self.ingest()
+        except Exception as e:
+            logging.error(f"Log ingestion failed for {self.log_path}: {str(e)}")
+            self.progress_queue.put(("error", str(e)))
+            return
+        self.progress_queue.put(("cancelled", None) if self.cancelled.is_set() else ("done", report))
+
+    def ingest(self):
+        """Count, geolocate and store the log's addresses; returns the report"""
+        started = time.perf_counter()
+        with open(self.log_path, 'rb') as raw:
+            total = os.fstat(raw.fileno()).st_size
+            stream = gzip.GzipFile(fileobj=raw, mode='rb') if raw.peek(2)[:2] == b'\x1f\x8b' else raw
+            counts, lines = count_log_ips(
+                stream, self.field, cancelled=self.cancelled,
+                on_block=lambda lines: self.progress_queue.put(("progress", raw.tell(), total, lines))
+            )
+        read_seconds = time.perf_counter() - started
+
+        hits = {}
+        for token, count in counts.items():
+            ip_address = token.strip(b'[]",').decode('ascii', 'replace')
+            if validate_ip(ip_address):
+                hits[ip_address] = hits.get(ip_address, 0) + count
+        locations = self.geolocate(hits) if self.lookup and not self.cancelled.is_set() else {}
+
+        import_id = None
+        if self.writer is not None and hits and not self.cancelled.is_set():
+            import_id = self.writer.submit(
+                lambda conn: store_log_import(conn, self.log_path, lines, hits, locations)).result()
+
+        countries = {}
+        for ip_address, count in hits.items():
+            country = locations.get(ip_address, (None, None))[0] or ""
+            total_hits, ips = countries.get(country, (0, 0))
+            countries[country] = (total_hits + count, ips + 1)
+        matched = sum(hits.values())
+        return {
+            "import_id": import_id,
+            "path": str(self.log_path),
+            "lines": lines,
+            "matched": matched,
+            "skipped": lines - matched,
+            "unique_ips": len(hits),
+            "located": len(locations),
+            "seconds": round(time.perf_counter() - started, 3),
+            "lines_per_sec": lines / read_seconds if read_seconds else 0.0,
+            "countries": sorted(((country, total_hits, ips) for country, (total_hits, ips) in countries.items()),
+                                key=lambda item: item[1], reverse=True),
+            "top_ips": [(ip_address, count, *locations.get(ip_address, (None, None)))
+                        for ip_address, count in heapq.nlargest(self.top, hits.items(), key=lambda item: item[1])],
+        }
+
+    def geolocate(self, hits):
+        """Look up every distinct public address; returns {ip: (country, city)}"""
+        public = [ip_address for ip_address in hits if ipaddress.ip_address(ip_address).is_global]
+        locations = {}
+        if not public:
+            return locations
+        self.lookup_job = BulkLookupJob(public, self.writer, cache=self.cache, offline_db=self.offline_db,
+                                        api_url=self.api_url, workers=self.workers, session=self.session,
+                                        rate_limiter=self.rate_limiter)
+        if self.cancelled.is_set():
+            self.lookup_job.cancel()
+        self.lookup_job.start()
+        done = 0
+        while True:
+            kind, payload = self.lookup_job.progress_queue.get()
+            if kind == "done":
+                return locations
+            for ip_address, status, message, data in payload:
+                if status == "success":
+                    locations[ip_address] = (data.get('country'), data.get('city'))
+            done += len(payload)
+            self.progress_queue.put(("lookup", done, len(public)))
+
+
+class HistoryExportJob:
+    """Stream history rows to a file in the background"""
+
+    def __init__(self, db_path, export_path, export_format="CSV", writer=None,
+                 date_from=None, date_to=None, country=None):
+        self.db_path = db_path
+        self.export_path = Path(export_path)
+        self.export_format = export_format
+        self.writer = writer
+        self.date_from = date_from
+        self.date_to = date_to
+        self.country = country
+        self.progress_queue = queue.Queue()
+        self.cancelled = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Run the export in a background thread"""
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        """Stop the export and discard the partial file"""
+        self.cancelled.set()
+
+    def query(self):
+        """Build the filtered FROM clause and its parameters"""
+        return history_filter(country=self.country, date_from=self.date_from, date_to=self.date_to)
+
+    def run(self):
+        """Export all matching rows and report progress through progress_queue"""
+        tmp_path = self.export_path.with_name(self.export_path.name + ".part")
+        if self.writer is not None:
+            self.writer.flush()
+        conn = connect_db(self.db_path)
+        try:
+            source, params = self.query()
+            total = conn.execute(f"SELECT COUNT(*){source}", params).fetchone()[0]
+            self.progress_queue.put(("progress", 0, total))
+            cursor = conn.execute(
+                f"SELECT {', '.join(HISTORY_COLUMNS)}{source} ORDER BY timestamp", params)
+
+            exported = 0
+            with self.open_output(tmp_path) as write_batch:
+                while not self.cancelled.is_set():
+                    batch = cursor.fetchmany(EXPORT_BATCH_SIZE)
+                    if not batch:
+                        break
+                    write_batch(batch)
+                    exported += len(batch)
+                    self.progress_queue.put(("progress", exported, total))
+
+            if self.cancelled.is_set():
+                tmp_path.unlink(missing_ok=True)
+                self.progress_queue.put(("cancelled", None))
+            else:
+                os.replace(tmp_path, self.export_path)
+                self.progress_queue.put(("done", self.export_path))
+        except Exception as e:
+            tmp_path.unlink(missing_ok=True)
+            self.progress_queue.put(("error", str(e)))
+        finally:
+            conn.close()
+
+    @contextlib.contextmanager
+    def open_output(self, path):
+        """Yield a function that appends a batch of rows in the selected format"""
+        if self.export_format in ("CSV", "CSV (gzip)"):
+            opener = gzip.open if self.export_format == "CSV (gzip)" else open
+            with opener(path, 'wt', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(HISTORY_HEADERS)
+                yield writer.writerows
+        elif self.export_format == "JSON Lines":
+            with open(path, 'w', encoding='utf-8') as f:
+                def write_batch(batch):
+                    f.writelines(
+                        json.dumps(dict(zip(HISTORY_COLUMNS, row)), ensure_ascii=False) + "\n"
+                        for row in batch
+                    )
+                yield write_batch
+        elif self.export_format == "Parquet":
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+            schema = pa.schema([
+                ("ip_address", pa.string()), ("country", pa.string()), ("city", pa.string()),
+                ("latitude", pa.float64()), ("longitude", pa.float64()), ("isp", pa.string()),
+                ("org", pa.string()), ("timestamp", pa.string()),
+            ])
+            with pq.ParquetWriter(str(path), schema) as parquet_writer:
+                def write_batch(batch):
+                    columns = list(zip(*batch))
+                    parquet_writer.write_batch(pa.record_batch(
+                        [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                        schema=schema
+                    ))
+                yield write_batch
+        else:
+            raise ValueError(f"Unknown export format: {self.export_format}")
+
+
+class ApiServer:
+    """Local HTTP/JSON API sharing one warm lookup engine with scripts and other tools
+
+    GET /json/<ip> and POST /batch answer like ip-api, so existing clients,
+    and another IP Tracker started with IPTRACKER_API_URL, work unchanged.
+    Single lookups go through the LookupEngine, so every client shares its
+    cache, keep-alive connections, provider failover and quota, and parallel
+    requests for one address cost a single upstream request. Batches run as
+    a BulkLookupJob on the engine's cache and session with one shared batch
+    quota. GET /history, /stats and /health read the history database and
+    the engine; /metrics serves METRICS like MetricsServer.
+
+    Successful lookups are recorded through writer when one is given.
+    """
+
+    request_queue_size = 128  # many clients may connect at once
+
+    def __init__(self, port, engine, db_path=DEFAULT_DB_PATH, writer=None, host="127.0.0.1",
+                 batch_rate_limiter=None, lookup_timeout=API_LOOKUP_TIMEOUT):
+        self.engine = engine
+        self.db_path = db_path
+        self.writer = writer
+        self.batch_rate_limiter = batch_rate_limiter or RateLimiter(RATE_LIMIT_BATCH)
+        self.lookup_timeout = lookup_timeout
+        self.connections = queue.SimpleQueue()  # idle read connections, reused across requests
+        self.httpd = _http_server((host, port), _api_handler(), self, self.request_queue_size)
+
+    @property
+    def server_address(self):
+        return self.httpd.server_address
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve from a daemon thread"""
+        threading.Thread(target=self.serve_forever, name="api-server", daemon=True).start()
+
+    def serve_forever(self):
+        """Serve from the calling thread until stop() or an exception"""
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        while True:
+            try:
+                self.connections.get_nowait().close()
+            except queue.Empty:
+                break
+
+    @contextlib.contextmanager
+    def read_connection(self):
+        """Borrow a history connection for the current request thread"""
+        try:
+            conn = self.connections.get_nowait()
+        except queue.Empty:
+            conn = connect_db(self.db_path, check_same_thread=False)
+        try:
+            yield conn
+        finally:
+            self.connections.put(conn)
+
+    def lookup(self, ip_address):
+        """Geolocate one address through the engine; returns (HTTP status, ip-api style answer)"""
+        done = threading.Event()
+        results = []
+
+        def deliver(result):
+            results.append(result)
+            done.set()
+
+        request_id = self.engine.submit(ip_address, deliver)
+        if not done.wait(self.lookup_timeout):
+            self.engine.cancel(request_id)
+            done.wait()
+        result = results[0]
+        if result.status == "success":
+            if self.writer is not None:
+                self.writer.write([history_row(ip_address, result.data)])
+            return 200, dict(result.data, query=ip_address)
+        if result.status == "failed":
+            return 200, dict(result.data, query=ip_address)
+        if result.status == "invalid":
+            return 200, {'status': "fail", 'message': "invalid query", 'query': ip_address}
+        if result.status == "cancelled":
+            return 504, {'status': "fail", 'message': "Lookup timed out", 'query': ip_address}
+        return 502, {'status': "fail", 'message': result.error, 'query': ip_address}
+
+    def batch(self, queries):
+        """Geolocate a /batch request body; returns answers in request order"""
+        ip_addresses = [query.get('query') if isinstance(query, dict) else query for query in queries]
+        valid = [ip for ip in dict.fromkeys(ip_addresses) if isinstance(ip, str) and validate_ip(ip)]
+        engine = self.engine
+        offline_db = engine.offline_db
+        job = BulkLookupJob(valid, self.writer, engine.cache, offline_db, engine.api_url,
+                            session=engine.session if offline_db is None else None,
+                            rate_limiter=self.batch_rate_limiter)
+        job.run()
+        answers = {}
+        while True:
+            kind, payload = job.progress_queue.get_nowait()
+            if kind == "done":
+                break
+            for ip_address, status, message, data in payload:
+                if status == "success":
+                    answers[ip_address] = dict(data, query=ip_address)
+                else:
+                    answers[ip_address] = {'status': "fail", 'message': message, 'query': ip_address}
+        invalid = {'status': "fail", 'message': "invalid query"}
+        return [answers.get(ip) or dict(invalid, query=ip) for ip in ip_addresses]
+
+    @staticmethod
+    def limit_param(params, default):
+        """Positive integer limit from the query parameters; ValueError with a fixed message otherwise"""
+        value = params.get('limit')
+        if not value:
+            return default
+        try:
+            limit = int(value)
+        except ValueError:
+            raise ValueError("limit must be an integer") from None
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        return limit
+
+    def history(self, params):
+        """Most recent history rows matching the /history query parameters
+
+        Accepts search, country, from, to, network and limit; compacted=1
+        returns the rollups of compacted rows instead. Raises ValueError for a
+        malformed network or limit.
+        """
+        limit = min(self.limit_param(params, 20), API_HISTORY_LIMIT)
+        search = params.get('search')
+        if params.get('compacted') in ("1", "true"):
+            if search:
+                raise ValueError("search cannot be combined with compacted")
+            with self.read_connection() as conn:
+                rows = compacted_history(conn, params.get('country'), params.get('from'), params.get('to'),
+                                         params.get('network'), limit)
+            return [dict(zip(ROLLUP_COLUMNS, row)) for row in rows]
+        source, sql_params = history_filter(search, params.get('country'), params.get('from'),
+                                            params.get('to'), params.get('network'))
+        order = "match_id DESC" if search and search.strip() else "timestamp DESC"
+        with self.read_connection() as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(HISTORY_COLUMNS)}{source} ORDER BY {order} LIMIT ?",
+                (*sql_params, limit)
+            ).fetchall()
+        return [dict(zip(HISTORY_COLUMNS, row)) for row in rows]
+
+    def stats(self, params):
+        """Lookup counts per country, or per city with by=city, for the /stats query parameters"""
+        limit = self.limit_param(params, None)
+        with self.read_connection() as conn:
+            if params.get('by') == "city":
+                keys = ("country", "city", "lookups")
+                rows = city_counts(conn, params.get('from'), params.get('to'), limit)
+            else:
+                keys = ("country", "lookups")
+                rows = country_counts(conn, params.get('from'), params.get('to'), limit)
+        return [dict(zip(keys, row)) for row in rows]
+
+    def health(self):
+        return {
+            'status': "ok",
+            'queue_depth': self.engine.queue_depth(),
+            'in_flight': self.engine.in_flight(),
+            'providers': list(self.engine.providers.providers),
+        }
+
+
+def _api_handler():
+    """Request handler class for ApiServer"""
+    from http.server import BaseHTTPRequestHandler
+
+    class ApiHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, so scripts making many requests reuse one connection
+        # Send headers and body in one segment so keep-alive clients are not held up by delayed ACKs
+        wbufsize = -1
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def respond(self, status, payload, content_type="application/json; charset=utf-8"):
+            body = payload.encode() if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("X-Rl", str(API_QUOTA))
+            self.send_header("X-Ttl", "0")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def fail(self, status, message):
+            self.respond(status, {'status': "fail", 'message': message})
+
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            params = dict(urllib.parse.parse_qsl(url.query))
+            try:
+                if url.path.startswith("/json/"):
+                    self.respond(*self.server.owner.lookup(urllib.parse.unquote(url.path[len("/json/"):])))
+                elif url.path == "/history":
+                    self.respond(200, self.server.owner.history(params))
+                elif url.path == "/stats":
+                    self.respond(200, self.server.owner.stats(params))
+                elif url.path == "/health":
+                    self.respond(200, self.server.owner.health())
+                elif url.path == "/metrics":
+                    self.respond(200, METRICS.prometheus_text(), "text/plain; version=0.0.4; charset=utf-8")
+                else:
+                    self.fail(404, "not found")
+            except ValueError as e:
+                self.fail(400, str(e))
+            except sqlite3.Error as e:
+                logging.error(f"API request {url.path} failed: {str(e)}")
+                self.fail(500, str(e))
+
+        def do_POST(self):
+            if urllib.parse.urlsplit(self.path).path != "/batch":
+                self.fail(404, "not found")
+                return
+            try:
+                queries = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            except ValueError:
+                self.fail(400, "body must be a JSON array")
+                return
+            if not isinstance(queries, list):
+                self.fail(400, "body must be a JSON array")
+            elif len(queries) > API_BATCH_LIMIT:
+                self.fail(413, f"at most {API_BATCH_LIMIT} queries per request")
+            else:
+                try:
+                    self.respond(200, self.server.owner.batch(queries))
+                except Exception as e:
+                    logging.error(f"API batch of {len(queries)} failed: {str(e)}")
+                    self.fail(502, str(e))
+
+    return ApiHandler
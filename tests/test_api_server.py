@@ -0,0 +1,67 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from benchmarks.fake_ipapi import FakeGeoServer, geolocate
+from iptracker_core import ApiServer, HistoryWriter, LookupEngine, open_history_db
+
+
+@pytest.fixture
+def api(tmp_path):
+    db_path = tmp_path / "history.db"
+    open_history_db(db_path).close()
+    geo = FakeGeoServer()
+    geo.serve_in_background()
+    writer = HistoryWriter(db_path)
+    writer.start()
+    engine = LookupEngine(api_url=geo.url)
+    server = ApiServer(0, engine, db_path, writer)
+    server.start()
+    yield server
+    server.stop()
+    engine.shutdown()
+    writer.stop()
+    geo.shutdown()
+    geo.server_close()
+
+
+def request(server, path, body=None):
+    data = None if body is None else json.dumps(body).encode()
+    try:
+        with urllib.request.urlopen(server.url + path, data, timeout=10) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_lookup_answers_like_ip_api_and_is_recorded(api):
+    status, answer = request(api, "/json/8.8.8.8")
+    assert status == 200
+    assert answer['city'] == geolocate("8.8.8.8")['city']
+    assert answer['query'] == "8.8.8.8"
+    api.writer.flush(5)
+    status, rows = request(api, "/history?limit=5")
+    assert status == 200
+    assert [row['ip_address'] for row in rows] == ["8.8.8.8"]
+
+
+def test_batch_keeps_request_order(api):
+    status, answers = request(api, "/batch", ["1.1.1.1", "not an ip", {'query': "8.8.4.4"}])
+    assert status == 200
+    assert [answer['query'] for answer in answers] == ["1.1.1.1", "not an ip", "8.8.4.4"]
+    assert [answer['status'] for answer in answers] == ["success", "fail", "success"]
+
+
+def test_bad_requests_are_rejected(api):
+    assert request(api, "/history?limit=0") == (400, {'status': "fail", 'message': "limit must be positive"})
+    assert request(api, "/batch", {'query': "1.1.1.1"})[0] == 400
+    assert request(api, "/nowhere")[0] == 404
+
+
+def test_health(api):
+    status, health = request(api, "/health")
+    assert status == 200
+    assert health['status'] == "ok"
+    assert "ip-api" in health['providers']
@@ -0,0 +1,15 @@
+from iptracker_core import HISTORY_INSERT, connect_db, history_row, open_history_db, stored_response
+
+
+def test_stored_response_by_id_for_lookups_in_the_same_second(tmp_path):
+    db_path = tmp_path / "history.db"
+    open_history_db(db_path).close()
+    conn = connect_db(db_path)
+    with conn:
+        for city in ("Before", "After"):
+            conn.execute(HISTORY_INSERT, history_row("192.0.2.1", {'city': city}, "2024-01-01 00:00:00"))
+    first, second = [row_id for row_id, in conn.execute("SELECT id FROM history ORDER BY id")]
+    assert stored_response(conn, first)['city'] == "Before"
+    assert stored_response(conn, second)['city'] == "After"
+    assert stored_response(conn, second + 1) is None
+    conn.close()
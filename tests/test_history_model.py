@@ -0,0 +1,68 @@
+import pytest
+
+pytest.importorskip("PyQt6")
+
+from PyQt6.QtCore import Qt  # noqa: E402
+
+from IPTracker import HistoryModel  # noqa: E402
+from iptracker_core import HISTORY_INSERT, connect_db, history_row, open_history_db  # noqa: E402
+
+ROWS = 3 * HistoryModel.PAGE_SIZE + 17
+
+
+@pytest.fixture
+def conn(tmp_path):
+    db_path = tmp_path / "history.db"
+    open_history_db(db_path).close()
+    conn = connect_db(db_path)
+    with conn:
+        # Three lookups per second, so pages end in the middle of ties, and some rows without a city
+        conn.executemany(HISTORY_INSERT, [
+            history_row(f"198.51.{i // 250}.{i % 250}",
+                        {'country': ("Testland", "Otherland")[i % 2], 'city': None if i % 5 == 0 else f"City{i % 11}"},
+                        f"2024-01-01 00:{i // 180:02d}:{i // 3 % 60:02d}")
+            for i in range(ROWS)
+        ])
+    yield conn
+    conn.close()
+
+
+def load_all(model):
+    model.refresh()
+    while model.canFetchMore():
+        model.fetchMore()
+    return [row[len(model.COLUMNS)] for row in model.rows]
+
+
+def test_pages_follow_the_sort_order_without_gaps_or_repeats(conn):
+    model = HistoryModel(conn)
+    expected = [row_id for row_id, in conn.execute("SELECT id FROM history ORDER BY timestamp DESC, id DESC")]
+    assert load_all(model) == expected
+
+    model.sort(HistoryModel.COLUMNS.index("city"), Qt.SortOrder.AscendingOrder)
+    expected = [row_id for row_id, in conn.execute("SELECT id FROM history ORDER BY ifnull(city, ''), id")]
+    assert load_all(model) == expected
+
+
+def test_prepended_row_does_not_shift_the_next_page(conn):
+    model = HistoryModel(conn)
+    model.refresh()
+    first_page = [row[len(model.COLUMNS)] for row in model.rows]
+    new_row = history_row("203.0.113.1", {'country': "Testland"}, "2024-01-02 00:00:00")
+    with conn:
+        conn.execute(HISTORY_INSERT, new_row)
+    model.prepend_row(new_row)
+    while model.canFetchMore():
+        model.fetchMore()
+    ids = [row[len(model.COLUMNS)] for row in model.rows]
+    assert ids[0] is None and ids[1:len(first_page) + 1] == first_page
+    assert sorted(ids[1:]) == list(range(1, ROWS + 1))
+
+
+def test_filters_page_only_matching_rows(conn):
+    model = HistoryModel(conn)
+    model.set_filters(country="Otherland")
+    while model.canFetchMore():
+        model.fetchMore()
+    assert len(model.rows) == ROWS // 2
+    assert {row[1] for row in model.rows} == {"Otherland"}
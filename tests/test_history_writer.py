@@ -0,0 +1,70 @@
+import sqlite3
+import threading
+
+import iptracker_core
+from iptracker_core import HistoryWriter, history_row, open_history_db
+
+
+def row(ip_address):
+    return history_row(ip_address, {'country': "Testland", 'city': "Testville", 'lat': 1.5, 'lon': 2.5},
+                       "2024-01-01 00:00:00")
+
+
+def stored(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return [ip for ip, in conn.execute("SELECT ip_address FROM history ORDER BY id")]
+    finally:
+        conn.close()
+
+
+def test_locked_batch_is_retried(tmp_path, monkeypatch):
+    db_path = tmp_path / "history.db"
+    open_history_db(db_path).close()
+    connect_db = iptracker_core.connect_db
+
+    def impatient(path):
+        conn = connect_db(path)
+        conn.execute("PRAGMA busy_timeout = 50")
+        return conn
+
+    monkeypatch.setattr(iptracker_core, "connect_db", impatient)
+    failures = []
+    writer = HistoryWriter(db_path, on_error=failures.append)
+    writer.start()
+    blocker = sqlite3.connect(db_path, check_same_thread=False)
+    blocker.execute("BEGIN IMMEDIATE")
+    release = threading.Timer(0.3, blocker.commit)
+    release.start()
+    try:
+        writer.write([row("192.0.2.1")])
+        assert writer.flush(5)
+    finally:
+        release.join()
+        blocker.close()
+        writer.stop()
+    assert failures == []
+    assert stored(db_path) == ["192.0.2.1"]
+
+
+def test_failed_writes_are_reported_and_the_rest_kept(tmp_path, monkeypatch):
+    db_path = tmp_path / "history.db"
+    open_history_db(db_path).close()
+    monkeypatch.setattr(iptracker_core, "WRITE_RETRY_DELAY", 0)
+    failures = []
+    writer = HistoryWriter(db_path, flush_interval=1, on_error=failures.append)
+    writer.start()
+    bad_statement = ("INSERT INTO watchlist (ip_address, interval) VALUES (?, NULL)", ("192.0.2.9",))
+    try:
+        writer.write([row("192.0.2.1")])
+        writer.execute(*bad_statement)
+        writer.write([row("192.0.2.2")[:3]])
+        writer.write([row("192.0.2.3")])
+        assert writer.flush(5)
+    finally:
+        writer.stop()
+    assert stored(db_path) == ["192.0.2.1", "192.0.2.3"]
+    [failure] = failures
+    assert isinstance(failure.error, sqlite3.Error)
+    assert failure.rows == [row("192.0.2.2")[:3]]
+    assert failure.statements == [bad_statement]
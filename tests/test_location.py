@@ -0,0 +1,33 @@
+from iptracker_core import location_changed, location_changes, location_snapshot
+
+
+def answer(provider, country_code="US", city="Mountain View", isp="Google LLC", asn="AS15169 Google LLC"):
+    return {'status': "success", 'country': country_code, 'countryCode': country_code, 'city': city,
+            'lat': 37.4, 'lon': -122.1, 'isp': isp, 'org': isp, 'as': asn, 'provider': provider}
+
+
+def test_first_check_is_not_a_change():
+    assert not location_changed(None, location_snapshot(answer("ip-api")))
+
+
+def test_isp_wording_is_ignored_across_providers():
+    previous = location_snapshot(answer("ip-api"))
+    current = location_snapshot(answer("ipapi.co", isp="GOOGLE", asn="AS15169"))
+    assert location_changes(previous, current) == []
+
+
+def test_country_change_is_reported_across_providers():
+    previous = location_snapshot(answer("ip-api"))
+    current = location_snapshot(answer("ipwho.is", country_code="DE", city="Frankfurt"))
+    assert location_changes(previous, current) == ["countryCode", "city"]
+
+
+def test_same_provider_compares_every_field():
+    previous = location_snapshot(answer("ip-api"))
+    assert location_changes(previous, location_snapshot(answer("ip-api", isp="Other"))) == ["isp", "org"]
+
+
+def test_snapshot_stored_before_asn_was_added():
+    previous = location_snapshot(answer("ip-api"))
+    del previous['countryCode'], previous['asn']
+    assert not location_changed(previous, location_snapshot(answer("ip-api")))
@@ -0,0 +1,56 @@
+import sqlite3
+import threading
+
+from iptracker_core import LookupEngine
+
+ANSWER = {'status': "success", 'country': "Testland", 'city': "Testville", 'lat': 1.0, 'lon': 2.0}
+
+
+class FlakyCache:
+    """Cache whose lookups of broken fail the way a locked database does"""
+
+    def __init__(self, broken):
+        self.broken = broken
+
+    def get(self, ip_address):
+        if ip_address == self.broken:
+            raise sqlite3.OperationalError("database is locked")
+        return dict(ANSWER, query=ip_address)
+
+    def put(self, ip_address, data):
+        pass
+
+
+def lookup(engine, ip_address, timeout=5):
+    done = threading.Event()
+    results = []
+
+    def deliver(result):
+        results.append(result)
+        done.set()
+
+    engine.submit(ip_address, deliver)
+    assert done.wait(timeout), f"no answer for {ip_address}"
+    return results[0]
+
+
+def test_cache_error_fails_only_that_lookup():
+    engine = LookupEngine(cache=FlakyCache("192.0.2.1"), api_url="http://127.0.0.1:9")
+    try:
+        failed = lookup(engine, "192.0.2.1")
+        assert failed.status == "network_error"
+        assert "database is locked" in failed.error
+
+        answered = lookup(engine, "192.0.2.2")
+        assert answered.status == "success"
+        assert answered.data['city'] == "Testville"
+    finally:
+        engine.shutdown()
+
+
+def test_invalid_address_is_rejected():
+    engine = LookupEngine(cache=FlakyCache(None), api_url="http://127.0.0.1:9")
+    try:
+        assert lookup(engine, "not an ip").status == "invalid"
+    finally:
+        engine.shutdown()
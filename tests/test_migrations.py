@@ -0,0 +1,52 @@
+import sqlite3
+
+import pytest
+
+import iptracker_core
+from iptracker_core import MIGRATIONS, connect_db, migrate_db, open_history_db
+
+
+def columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def test_new_database_is_fully_migrated(tmp_path):
+    conn = open_history_db(tmp_path / "history.db")
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+    assert {"isp", "org", "ip_packed", "response"} <= set(columns(conn, "history"))
+    conn.close()
+
+
+def test_failed_migration_rolls_back_and_can_be_rerun(tmp_path, monkeypatch):
+    db_path = tmp_path / "history.db"
+    open_history_db(db_path).close()
+    conn = connect_db(db_path)
+    conn.execute("INSERT INTO history (ip_address, timestamp) VALUES ('192.0.2.1', '2024-01-01 00:00:00')")
+    conn.commit()
+
+    broken = [
+        "ALTER TABLE history ADD COLUMN note TEXT",
+        "CREATE INDEX idx_history_note ON history (note)",
+        "UPDATE history SET note = no_such_function(ip_address)",
+    ]
+    monkeypatch.setattr(iptracker_core, "MIGRATIONS", MIGRATIONS + [broken])
+    with pytest.raises(sqlite3.OperationalError):
+        migrate_db(conn)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+    assert "note" not in columns(conn, "history")
+    assert not conn.in_transaction
+
+    fixed = broken[:2] + ["UPDATE history SET note = upper(ip_address)"]
+    monkeypatch.setattr(iptracker_core, "MIGRATIONS", MIGRATIONS + [fixed])
+    migrate_db(conn)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS) + 1
+    assert conn.execute("SELECT note FROM history").fetchone() == ("192.0.2.1",)
+    conn.close()
+
+
+def test_migrations_are_idempotent_across_opens(tmp_path):
+    db_path = tmp_path / "history.db"
+    open_history_db(db_path).close()
+    conn = open_history_db(db_path)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+    conn.close()
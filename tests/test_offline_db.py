@@ -0,0 +1,54 @@
+import threading
+
+from iptracker_core import LookupEngine, OfflineGeoDB
+
+from test_lookup_engine import lookup
+
+
+def build(tmp_path):
+    csv_path = tmp_path / "ranges.csv"
+    csv_path.write_text("start,end,country,city,lat,lon\n"
+                        "10.0.0.0,10.0.0.255,Testland,Testville,1.5,2.5\n"
+                        "2001:db8::,2001:db8::ff,Sixland,Sixville,0,0\n")
+    OfflineGeoDB.build(csv_path, tmp_path / "ranges.bin")
+    return OfflineGeoDB(tmp_path / "ranges.bin")
+
+
+def test_lookup_and_ipv6(tmp_path):
+    db = build(tmp_path)
+    try:
+        assert db.lookup("10.0.0.7")['city'] == "Testville"
+        assert db.lookup("10.0.1.7")['status'] == "fail"
+        assert "IPv6" in db.lookup("2001:db8::1")['message']
+    finally:
+        db.close()
+
+
+def test_lookup_after_close_fails_cleanly(tmp_path):
+    db = build(tmp_path)
+    db.close()
+    assert db.lookup("10.0.0.7") == {'status': "fail", 'message': "offline database closed", 'query': "10.0.0.7"}
+
+
+def test_engine_survives_closing_the_database_during_lookups(tmp_path):
+    db = build(tmp_path)
+    engine = LookupEngine(offline_db=db, api_url="http://127.0.0.1:9")
+    errors = []
+
+    def look_up_many():
+        for i in range(300):
+            result = lookup(engine, f"10.0.0.{i % 256}")
+            if result.status not in ("success", "failed", "network_error"):
+                errors.append(result)
+
+    worker = threading.Thread(target=look_up_many)
+    worker.start()
+    for _ in range(20):
+        engine.set_offline_db(build(tmp_path)).close()
+    engine.set_offline_db(None).close()
+    worker.join(30)
+    try:
+        assert not worker.is_alive()
+        assert not errors
+    finally:
+        engine.shutdown()